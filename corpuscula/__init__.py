@@ -14,5 +14,6 @@ corpus processing. Highlights are:
 """
 from corpuscula._version import __version__
 from corpuscula.conllu import Conllu
+from corpuscula.conllu_corpus import ConlluCorpus
 from corpuscula.corpus_dict import CorpusDict
 from corpuscula.items import Items
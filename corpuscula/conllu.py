@@ -6,13 +6,18 @@
 """
 Full CoNLL-U and CoNLL-U Plus formats support.
 """
-from collections import OrderedDict
+import bz2
+from collections import OrderedDict, deque
 from difflib import SequenceMatcher
+import gzip
 from io import BufferedReader
+import lzma
+from multiprocessing import Pool
 import os
 import pickle
 import sys
 
+from corpuscula.conllu_index import ConlluIndex
 from corpuscula.utils import LOG_FILE, print_progress
 
 
@@ -23,6 +28,119 @@ def id_to_numeric(id_):
            float(id_)
 
 
+class LazyOrderedDict(OrderedDict):
+    """OrderedDict that keeps the raw *FEATS* or *MISC* string of CoNLL-U and
+    parses it only on the first access. After that it behaves exactly as
+    OrderedDict. Its ``repr()`` is the same as of OrderedDict, too"""
+
+    _raw = None
+
+    def _decode(self):
+        raw, self._raw = self._raw, None
+        for item in raw.split('|'):
+            if item and item != '_':
+                key, val = item.split('=', 1) if '=' in item else (item, None)
+                OrderedDict.__setitem__(self, key, val)
+
+    def __eq__(self, other):
+        if self._raw is not None:
+            self._decode()
+        if isinstance(other, LazyOrderedDict) and other._raw is not None:
+            other._decode()
+        return OrderedDict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(OrderedDict(self))
+
+    def __reduce__(self):
+        return (_lazy_ordered_dict, (self._raw,)) \
+                   if self._raw is not None else \
+               (self.__class__, (list(OrderedDict.items(self)),))
+
+def _lazy_method(name):
+    method = getattr(OrderedDict, name)
+    def lazy_method(self, *args, **kwargs):
+        if self._raw is not None:
+            self._decode()
+        return method(self, *args, **kwargs)
+    lazy_method.__name__ = name
+    return lazy_method
+
+for name in ['__contains__', '__delitem__', '__getitem__', '__iter__',
+             '__len__', '__reversed__',
+             '__setitem__', '__sizeof__', 'clear', 'copy', 'get', 'items',
+             'keys', 'move_to_end', 'pop', 'popitem', 'setdefault', 'update',
+             'values', '__or__', '__ror__', '__ior__']:
+    if hasattr(OrderedDict, name):
+        setattr(LazyOrderedDict, name, _lazy_method(name))
+del name
+
+def _lazy_ordered_dict(raw):
+    res = LazyOrderedDict()
+    if raw:
+        res._raw = raw
+    return res
+
+
+SHARD_SIZE = 4 * 1024 * 1024
+def get_shard_bounds(file_path, shard_size=SHARD_SIZE):
+    """Split a CoNLL-U file *file_path* to byte ranges of about *shard_size*
+    bytes each aligned on blank lines, i.e. on sentence boundaries.
+
+    :return: list of (start, end) offsets
+    :rtype: list(tuple(int, int))
+    """
+    size = os.path.getsize(file_path)
+    bounds = [0]
+    with open(file_path, 'rb') as f:
+        while bounds[-1] + shard_size < size:
+            f.seek(bounds[-1] + shard_size)
+            f.readline()  # we could be in the middle of a line
+            for line in f:
+                if not line.strip():
+                    break
+            pos = f.tell()
+            if pos >= size:
+                break
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def get_columns(file_path, encoding='utf-8-sig'):
+    """Return a list of column names of a CoNLL-U file *file_path*. For
+    CoNLL-U Plus format they are taken from the meta variable
+    "global.columns" of the first line; elsewise, standard CoNLL-U columns
+    are returned"""
+    with open(file_path, 'rt', encoding=encoding) as f:
+        line = f.readline().strip()
+    if line.startswith('#'):
+        meta = [x.strip() for x in line[1:].split('=', 1)]
+        if len(meta) == 2 and meta[0] == 'global.columns':
+            return meta[1].split()
+    return Conllu.STD_COLUMNS
+
+BUFFER_SIZE = 1024 * 1024
+def _open_for_write(file_path):
+    """Open *file_path* for writing text choosing compression by the file
+    extension"""
+    ext = os.path.splitext(file_path)[1].lower()
+    opener = gzip.open if ext == '.gz' else \
+             bz2.open if ext == '.bz2' else \
+             lzma.open if ext == '.xz' else \
+             open
+    return opener(file_path, mode='wt', encoding='utf-8')
+
+def _load_shard(args):
+    file_path, start, end, encoding, columns, fast = args
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode(encoding).split('\n')
+    return list(Conllu._parse(lines, columns=columns, fast=fast))
+
+
 class Conllu:
     """Full CoNLL-U and CoNLL-U Plus formats support"""
 
@@ -32,6 +150,24 @@ class Conllu:
     def __new__(cls):
         raise NotImplementedError('This class has only static methods')
 
+    @staticmethod
+    def _renumber_heads(sentence, id_map):
+        """Replace old token ids in HEAD and DEPS fields of the *sentence*
+        tokens with the new ones from *id_map* (dict(old_id: new_id))"""
+        for token in sentence:
+            head = token.get('HEAD')
+            if head in id_map:
+                token['HEAD'] = id_map[head]
+            deps = token.get('DEPS')
+            if deps:
+                deps_ = []
+                for dep in deps.split('|'):
+                    head, colon, deprel = dep.partition(':')
+                    if head in id_map:
+                        dep = id_map[head] + colon + deprel
+                    deps_.append(dep)
+                token['DEPS'] = '|'.join(deps_)
+
     @classmethod
     def fix(cls, corpus, split_multi=False, adjust_for_speech=False,
             columns=None):
@@ -56,7 +192,7 @@ class Conllu:
                 sentence if isinstance(sentence, tuple) else \
                 (sentence, OrderedDict())
 
-            tokens = []
+            tokens, renamed = [], []
             id_, sub_id = 0, 0
             multi_token, multi_token_id, last_old_id = None, None, None
             for token in sentence:
@@ -126,11 +262,11 @@ class Conllu:
                             sub_id += 1
                             token['ID'] = str(id_) + '.' + str(sub_id)
                     if token['ID'] != old_id:
-                        for token_ in sentence:
-                            if token_['HEAD'] == old_id:
-                                token_['HEAD'] = token['ID']
+                        renamed.append((old_id, token))
             assert not multi_token, 'ERROR: ' \
                 "can't close multi-token {}".format(multi_token_id)
+            if renamed:
+                cls._renumber_heads(tokens, {x: y['ID'] for x, y in renamed})
             sentence = tokens
             if not sentence:
                 vals = {}
@@ -224,7 +360,7 @@ class Conllu:
 
     @classmethod
     def load(cls, corpus, encoding='utf-8-sig', fix=True, split_multi=False,
-             adjust_for_speech=False, log_file=LOG_FILE):
+             adjust_for_speech=False, fast=False, log_file=LOG_FILE):
         """Load *corpus* in CoNLL-U format as sequence of Parsed CoNLL-U
         sentences. Each sentence returns as tuple of a list of tagged tokens
         and a dict of metadata that can be used to restore corpus back to
@@ -236,6 +372,10 @@ class Conllu:
         :param adjust_for_speech: if yes, remove all non alphanumeric tokens
                                   and convert all words to lower case (used
                                   only with fix=True)
+        :param fast: if True, use the fast-path parser: each token line is
+                     split only once, and FEATS and MISC fields are kept as
+                     ``LazyOrderedDict`` that parses the raw value only on
+                     the first access
         :param log_file: stream for messages
         :return: sentences in Parsed CoNLL-U format
         :rtype: sequence of tuple(list(dict(str: str|OrderedDict(str: str))),
@@ -246,7 +386,7 @@ class Conllu:
               "global.columns")"""
         if fix:
             yield from cls.fix(cls.load(corpus, encoding=encoding, fix=False,
-                                        log_file=log_file),
+                                        fast=fast, log_file=log_file),
                                split_multi=split_multi,
                                adjust_for_speech=adjust_for_speech)
 
@@ -257,82 +397,15 @@ class Conllu:
             if log_file:
                 print('Load corpus', file=log_file)
             nsentence = ntoken = 0
-            sentence = []
-            sentence_meta = OrderedDict()
-            columns = None
-            sent_no = -1
-            for line_no, line in enumerate(corpus):
-                line = line.strip()
-                if len(line) == 0:
-                    if len(sentence) > 0 or len(sentence_meta) > 0:
-                        if len(sentence) == 0:
-                            if columns is None:
-                                columns = cls.STD_COLUMNS
-                            vals = {}
-                            for column in columns:
-                                vals[column] = \
-                                    '0.1' if column == 'ID' else \
-                                    OrderedDict() \
-                                        if column in ['FEATS', 'MISC'] else \
-                                    None
-                            sentence = [vals]
-                        yield sentence, sentence_meta
-                        sent_no += 1
-                        if log_file and not sent_no % 100:
-                            print_progress(sent_no, end_value=None, step=1000,
-                                           file=log_file)
-                        nsentence += 1
-                        ntoken += len(sentence)
-                        sentence = []
-                        sentence_meta = OrderedDict()
-                elif line[0] == '#':
-                    meta = tuple(x.strip() for x in line[1:].split('=', 1))
-                    sentence_meta.update(
-                        [meta if len(meta) > 1 else (meta[0], None)]
-                    )
-                    if columns is None and meta[0] == 'global.columns':
-                        columns = meta[1].split()
-                    else:
-                        columns = cls.STD_COLUMNS
-                else:
-                    if columns is None:
-                        columns = cls.STD_COLUMNS
-                    columns_i = iter(columns)
-                    vals = {}
-                    for val in line.split('\t'):
-                        column = next(columns_i)
-                        if column in ['FEATS', 'MISC']:
-                            try:
-                                val = OrderedDict(
-                                    #() if val == '_'
-                                    # fix for the last MISC feat of syntagrus
-                                    # that is '_~':
-                                    #() if val.startswith ('_') else
-                                    [(k, v) for k, v in [
-                                        t.split('=', 1) if '=' in t else
-                                        (t, None)
-                                            for t in val.split('|')
-                                            if t and t != '_'
-                                    ]])
-                            except ValueError as e:
-                                print('ERROR when loading Conllu (line {})'
-                                          .format(line_no + 1), sys.stderr)
-                                print(line, sys.stderr)
-                                print(column, sys.stderr)
-                                print(val, sys.stderr)
-                                raise e
-                        else:
-                            if val == '_':
-                                val = None
-                            if val == '*' and column not in cls.STD_COLUMNS:
-                                val = ''
-                        vals[column] = val
-                    sentence.append(vals)
-            if sentence or sentence_meta:
-                yield sentence, sentence_meta
-                sent_no += 1
-            if log_file and sent_no >= 0:
-                print_progress(sent_no + 1, end_value=0, step=1000,
+            for sentence in cls._parse(corpus, fast=fast):
+                yield sentence
+                if log_file and not nsentence % 100:
+                    print_progress(nsentence, end_value=None, step=1000,
+                                   file=log_file)
+                nsentence += 1
+                ntoken += len(sentence[0])
+            if log_file and nsentence:
+                print_progress(nsentence, end_value=0, step=1000,
                                file=log_file)
                 print('Corpus has been loaded: {} sentences, {} tokens'
                           .format(nsentence, ntoken),
@@ -342,22 +415,300 @@ class Conllu:
                 corpus.close()
 
     @classmethod
-    def get_as_text(cls, corpus, fix=True, split_multi=False,
-                    adjust_for_speech=False, log_file=LOG_FILE):
-        """Convert a *corpus* in Parsed CoNLL-U format to text form.
+    def load_parallel(cls, file_path, encoding='utf-8-sig', fix=True,
+                      split_multi=False, adjust_for_speech=False, fast=False,
+                      workers=None, ordered=True, shard_size=SHARD_SIZE,
+                      log_file=LOG_FILE):
+        """Load a CoNLL-U file *file_path* in parallel. The file is split
+        into byte ranges aligned on sentence boundaries, and the ranges are
+        parsed in a process pool.
 
-        :param fix: fix CoNLL-U structure of after conversion
-        :param split_multi: if True then wforms with spaces will be processed
-                            as multiword tokens (used only with fix=True)
-        :param adjust_for_speech: if yes, remove all non alphanumeric tokens
-                                  and convert all words to lower case (used
-                                  only with fix=True)
+        :param workers: number of worker processes. If None, the number of
+                        CPUs is used
+        :param ordered: if True (default), sentences are returned in the
+                        original order. Elsewise, in the order they become
+                        ready
+        :param shard_size: approximate size of one shard in bytes
+        :type shard_size: int
+
+        Other params are the same as for ``.load()``. Note, that with
+        fix=True and ordered=False, sentence ids generated for sentences
+        without "sent_id" will reflect the order of the output.
+
+        :return: sentences in Parsed CoNLL-U format
+        :rtype: sequence of tuple(list(dict(str: str|OrderedDict(str: str))),
+                                  OrderedDict(str: str))
+        """
+        if fix:
+            yield from cls.fix(
+                cls.load_parallel(file_path, encoding=encoding, fix=False,
+                                  fast=fast, workers=workers, ordered=ordered,
+                                  shard_size=shard_size, log_file=log_file),
+                split_multi=split_multi, adjust_for_speech=adjust_for_speech
+            )
+
+        else:
+            columns = get_columns(file_path, encoding=encoding)
+            shards = [(file_path, start, end, encoding, columns, fast)
+                          for start, end in get_shard_bounds(file_path,
+                                                             shard_size)]
+            if log_file:
+                print('Load corpus', file=log_file)
+            nsentence = ntoken = 0
+            with Pool(processes=workers) as pool:
+                for sentences in (pool.imap if ordered else
+                                  pool.imap_unordered)(_load_shard, shards):
+                    for sentence in sentences:
+                        yield sentence
+                        if log_file and not nsentence % 100:
+                            print_progress(nsentence, end_value=None,
+                                           step=1000, file=log_file)
+                        nsentence += 1
+                        ntoken += len(sentence[0])
+            if log_file and nsentence:
+                print_progress(nsentence, end_value=0, step=1000,
+                               file=log_file)
+                print('Corpus has been loaded: {} sentences, {} tokens'
+                          .format(nsentence, ntoken),
+                      file=log_file)
+
+    @classmethod
+    def build_index(cls, file_path, index_path=None, encoding='utf-8-sig',
+                    log_file=LOG_FILE):
+        """Create the sidecar index of a CoNLL-U file *file_path* for random
+        access to its sentences or update the existing one. If the file has
+        only grown since the index was built, just its new part is scanned.
+
+        :param index_path: path to the index file. If None, the index is
+                           placed near the *file_path*
         :param log_file: stream for messages
-        :return: CoNLL-U as text
-        :rtype: iter(str)
+        :rtype: ConlluIndex
+        """
+        if log_file:
+            print('Index corpus', file=log_file)
+        index = ConlluIndex(file_path, index_path=index_path,
+                            encoding=encoding, update=False)
+        num_sents = index.update()
+        if log_file:
+            print('Corpus has been indexed: {} sentences ({} new)'
+                      .format(len(index), num_sents),
+                  file=log_file)
+        return index
+
+    @classmethod
+    def _load_ranges(cls, file_path, ranges, encoding, fix, split_multi,
+                     adjust_for_speech, fast):
+        """Load sentences of a CoNLL-U file *file_path* from the byte
+        *ranges*"""
+        columns = get_columns(file_path, encoding=encoding)
+
+        def load():
+            with open(file_path, 'rb') as f:
+                for start, end in ranges:
+                    f.seek(start)
+                    lines = f.read(end - start).decode(encoding).split('\n')
+                    yield from cls._parse(lines, columns=columns, fast=fast)
+
+        return cls.fix(load(), split_multi=split_multi,
+                       adjust_for_speech=adjust_for_speech,
+                       columns=columns) if fix else \
+               load()
+
+    @classmethod
+    def load_by_ids(cls, file_path, sent_ids, encoding='utf-8-sig',
+                    fix=False, split_multi=False, adjust_for_speech=False,
+                    fast=False, index_path=None):
+        """Load sentences with given "sent_id" meta variables from a CoNLL-U
+        file *file_path*. The sidecar index of the file is used; if it's
+        absent or outdated, it will be built or updated.
+
+        :param sent_ids: "sent_id" values of the sentences to load
+        :type sent_ids: iter(str)
+        :param index_path: path to the index file. If None, the index is
+                           placed near the *file_path*
+
+        Other params are the same as for ``.load()``. Note, that with
+        fix=True, ids of the sentences without "sent_id" are generated
+        according to their order in the output.
+
+        :return: sentences in Parsed CoNLL-U format in the order of
+                 *sent_ids*. If several sentences of the file have the same
+                 "sent_id", all of them are returned in the order of the file
+        :rtype: iter(tuple(list(dict(str: str|OrderedDict(str: str))),
+                           OrderedDict(str: str)))
+        :raise KeyError: if some of *sent_ids* is not found
+        """
+        index = ConlluIndex(file_path, index_path=index_path,
+                            encoding=encoding)
+        ranges = [index.get_bounds(x) for x in sent_ids
+                                      for x in index.get_sent_nos(x)]
+        return cls._load_ranges(file_path, ranges, encoding, fix,
+                                split_multi, adjust_for_speech, fast)
+
+    @classmethod
+    def load_slice(cls, file_path, start, stop=None, encoding='utf-8-sig',
+                   fix=False, split_multi=False, adjust_for_speech=False,
+                   fast=False, index_path=None):
+        """Load sentences from *start* to *stop* (the numbers of sentences in
+        the file, as for python slices) of a CoNLL-U file *file_path*. The
+        sidecar index of the file is used; if it's absent or outdated, it
+        will be built or updated.
+
+        :param stop: if None, load to the end of the file
+
+        Other params are the same as for ``.load_by_ids()``.
+
+        :return: sentences in Parsed CoNLL-U format
+        :rtype: iter(tuple(list(dict(str: str|OrderedDict(str: str))),
+                           OrderedDict(str: str)))
+        """
+        index = ConlluIndex(file_path, index_path=index_path,
+                            encoding=encoding)
+        start, stop, _ = slice(start, stop).indices(len(index))
+        ranges = [(index.get_bounds(start)[0],
+                   index.get_bounds(stop - 1)[1])] if start < stop else \
+                 []
+        return cls._load_ranges(file_path, ranges, encoding, fix,
+                                split_multi, adjust_for_speech, fast)
+
+    @classmethod
+    def _parse(cls, corpus, columns=None, fast=False):
+        """Parse lines of *corpus* in CoNLL-U format to Parsed CoNLL-U
+        sentences.
+
+        :param columns: list of column names. If None, they will be taken
+                        from the "global.columns" meta variable of the first
+                        line of the *corpus* or standard CoNLL-U columns will
+                        be used
+        :param fast: use the fast-path parser (see ``.load()``)
+        """
+        sentence = []
+        sentence_meta = OrderedDict()
+        fast_columns = None
+        for line_no, line in enumerate(corpus):
+            line = line.strip()
+            if len(line) == 0:
+                if len(sentence) > 0 or len(sentence_meta) > 0:
+                    if len(sentence) == 0:
+                        if columns is None:
+                            columns = cls.STD_COLUMNS
+                        vals = {}
+                        for column in columns:
+                            vals[column] = \
+                                '0.1' if column == 'ID' else \
+                                OrderedDict() \
+                                    if column in ['FEATS', 'MISC'] else \
+                                None
+                        sentence = [vals]
+                    yield sentence, sentence_meta
+                    sentence = []
+                    sentence_meta = OrderedDict()
+            elif line[0] == '#':
+                meta = tuple(x.strip() for x in line[1:].split('=', 1))
+                sentence_meta.update(
+                    [meta if len(meta) > 1 else (meta[0], None)]
+                )
+                if columns is None:
+                    columns = meta[1].split() \
+                                  if meta[0] == 'global.columns' else \
+                              cls.STD_COLUMNS
+            elif fast:
+                if columns is None:
+                    columns = cls.STD_COLUMNS
+                if columns is not fast_columns:
+                    fast_columns = columns
+                    dict_columns = [x for x in columns
+                                        if x in ['FEATS', 'MISC']]
+                    plus_columns = [x for x in columns
+                                        if x not in cls.STD_COLUMNS]
+                vals = dict(zip(columns, [None if x == '_' else x
+                                              for x in line.split('\t')]))
+                for column in dict_columns:
+                    if column in vals:
+                        vals[column] = _lazy_ordered_dict(vals[column])
+                for column in plus_columns:
+                    if vals.get(column) == '*':
+                        vals[column] = ''
+                sentence.append(vals)
+            else:
+                if columns is None:
+                    columns = cls.STD_COLUMNS
+                columns_i = iter(columns)
+                vals = {}
+                for val in line.split('\t'):
+                    column = next(columns_i)
+                    if column in ['FEATS', 'MISC']:
+                        try:
+                            val = OrderedDict(
+                                #() if val == '_'
+                                # fix for the last MISC feat of syntagrus
+                                # that is '_~':
+                                #() if val.startswith ('_') else
+                                [(k, v) for k, v in [
+                                    t.split('=', 1) if '=' in t else
+                                    (t, None)
+                                        for t in val.split('|')
+                                        if t and t != '_'
+                                ]])
+                        except ValueError as e:
+                            print('ERROR when loading Conllu (line {})'
+                                      .format(line_no + 1), sys.stderr)
+                            print(line, sys.stderr)
+                            print(column, sys.stderr)
+                            print(val, sys.stderr)
+                            raise e
+                    else:
+                        if val == '_':
+                            val = None
+                        if val == '*' and column not in cls.STD_COLUMNS:
+                            val = ''
+                    vals[column] = val
+                sentence.append(vals)
+        if sentence or sentence_meta:
+            yield sentence, sentence_meta
+
+    @classmethod
+    def _get_layout(cls, columns):
+        """Return the output layout for the list of *columns*: the columns
+        itself, the positions of FEATS and MISC among them and the positions
+        of non-standard columns"""
+        return columns, \
+               columns.index('FEATS') if 'FEATS' in columns else None, \
+               columns.index('MISC') if 'MISC' in columns else None, \
+               [i for i, x in enumerate(columns) if x not in cls.STD_COLUMNS]
+
+    @classmethod
+    def _get_token_layout(cls, keys):
+        """Return the output layout for the sentence which first token has
+        *keys*: standard columns go first, then the rest in alphabetic
+        order"""
+        cols = set(keys)
+        return cls._get_layout([x for x in cls.STD_COLUMNS if x in cols]
+                             + sorted(cols.difference(cls.STD_COLUMNS)))
+
+    @classmethod
+    def _get_as_lines(cls, corpus, fix=True, split_multi=False,
+                      adjust_for_speech=False, presorted=False,
+                      log_file=LOG_FILE):
+        """Convert a *corpus* in Parsed CoNLL-U format to text form. For each
+        sentence, return a list of its lines.
+
+        Params are the same as for ``.get_as_text()``.
         """
         if log_file:
             print('Save corpus', file=log_file)
+        layouts, plus_layouts = {}, {}
+
+        def dict_to_str(val):
+            if presorted and isinstance(val, LazyOrderedDict) \
+                         and val._raw is not None:
+                return val._raw
+            if not val or val == '_':  # '_' is for None
+                return '_'
+            return '|'.join([k + '=' + v if v else k
+                                 for k, v in (val.items() if presorted else
+                                              sorted(val.items()))])
+
         sent_no = -1
         for sent_no, sentence in enumerate(
             cls.fix(corpus, split_multi=split_multi,
@@ -371,79 +722,96 @@ class Conllu:
                 sentence if isinstance(sentence, tuple) else \
                 (sentence, OrderedDict())
 
-            columns, feats_idx, misc_idx = [None] * 3
-            first_meta = []
+            lines, layout, first_meta = [], None, []
             for meta, val in sentence_meta.items():
-                if columns is None and meta == 'global.columns':
-                    columns = val.split()
-                    try:
-                        feats_idx = columns.index('FEATS')
-                    except ValueError:
-                        pass
-                    try:
-                        misc_idx = columns.index('MISC')
-                    except ValueError:
-                        pass
-                line = '# {}{}'.format(meta, ' = {}'.format(val)
-                                                 if val is not None else
-                                             '')
-                if columns is None:
+                if layout is None and meta == 'global.columns':
+                    layout = plus_layouts.get(val)
+                    if layout is None:
+                        layout = plus_layouts[val] = \
+                            cls._get_layout(val.split())
+                line = '# {}{}\n'.format(meta, ' = {}'.format(val)
+                                                   if val is not None else
+                                               '')
+                if layout is None:
                     first_meta.append(line)
                 else:
-                    yield line + '\n'
-            line = []
+                    lines.append(line)
             for token in sentence:
-                if columns is None:
-                    columns = []
-                    cols = set(token.keys())
-                    for col in cls.STD_COLUMNS:
-                        if col in cols:
-                            if col == 'FEATS':
-                                feats_idx = len(columns)
-                            if col == 'MISC':
-                                misc_idx = len(columns)
-                            columns.append(col)
-                            cols.remove(col)
-                    if cols:
-                        columns.extend(sorted(cols))
-                        yield '# global.columns = ' + ' '.join(columns) + '\n'
-                    if first_meta:
-                        for line in first_meta:
-                            yield line + '\n'
-                line = ['_' if token[x] is None else
-                        '*' if token[x] == ''
-                           and x not in cls.STD_COLUMNS else
-                        token[x] for x in columns]
+                if layout is None:
+                    keys = tuple(token)
+                    layout = layouts.get(keys)
+                    if layout is None:
+                        layout = layouts[keys] = cls._get_token_layout(keys)
+                    if layout[3]:
+                        lines.append('# global.columns = '
+                                   + ' '.join(layout[0]) + '\n')
+                    lines.extend(first_meta)
+                columns, feats_idx, misc_idx, plus_idxs = layout
+                line = ['_' if x is None else x
+                            for x in map(token.__getitem__, columns)]
+                for idx in plus_idxs:
+                    if line[idx] == '':
+                        line[idx] = '*'
                 if feats_idx is not None:
-                    feats = line[feats_idx]
-                    line[feats_idx] = \
-                        '|'.join('='.join((x, feats[x])) if feats[x] else x \
-                                     for x in sorted(feats)) \
-                                         if feats else \
-                                 '_'
+                    line[feats_idx] = dict_to_str(line[feats_idx])
                 if misc_idx is not None:
-                    misc = line[misc_idx]
-                    line[misc_idx] = \
-                        '|'.join('='.join((x, misc[x])) if misc[x] else x \
-                                     for x in sorted(misc)) \
-                                         if misc else \
-                                 '_'
-                yield '\t'.join(line) + '\n'
-            yield '\n'
+                    line[misc_idx] = dict_to_str(line[misc_idx])
+                lines.append('\t'.join(line) + '\n')
+            lines.append('\n')
+            yield lines
         if log_file and sent_no >= 0:
             print_progress(sent_no + 1, end_value=0, step=1000,
                            file=log_file)
             print('Corpus has been saved', file=log_file)
 
     @classmethod
-    def save(cls, corpus, file_path, **kwargs):
-        """Save a *corpus* in Parsed CoNLL-U format to CoNLL-U file.
+    def get_as_text(cls, corpus, fix=True, split_multi=False,
+                    adjust_for_speech=False, presorted=False,
+                    log_file=LOG_FILE):
+        """Convert a *corpus* in Parsed CoNLL-U format to text form.
 
+        :param fix: fix CoNLL-U structure of after conversion
+        :param split_multi: if True then wforms with spaces will be processed
+                            as multiword tokens (used only with fix=True)
+        :param adjust_for_speech: if yes, remove all non alphanumeric tokens
+                                  and convert all words to lower case (used
+                                  only with fix=True)
+        :param presorted: if True, keys of FEATS and MISC are supposed to be
+                          already sorted, so they are output as is. FEATS and
+                          MISC loaded with ``fast=True`` and not yet accessed
+                          are output exactly as in the source file
+        :param log_file: stream for messages
+        :return: CoNLL-U as text
+        :rtype: iter(str)
+        """
+        for lines in cls._get_as_lines(corpus, fix=fix,
+                                       split_multi=split_multi,
+                                       adjust_for_speech=adjust_for_speech,
+                                       presorted=presorted,
+                                       log_file=log_file):
+            yield from lines
+
+    @classmethod
+    def save(cls, corpus, file_path, buffer_size=BUFFER_SIZE, **kwargs):
+        """Save a *corpus* in Parsed CoNLL-U format to CoNLL-U file. If
+        *file_path* ends with ".gz", ".bz2" or ".xz", the file will be
+        compressed with the corresponding method.
+
+        :param buffer_size: the size of the output buffer (in chars)
+        :type buffer_size: int
         :param **kwargs: params for ``.get_as_text()`` method
         """
-        with open(file_path, mode='wt', encoding='utf-8') as f:
-            for line in cls.get_as_text(corpus, **kwargs):
-                print(line, end='', file=f)
+        with _open_for_write(file_path) as f:
+            buffer, buffer_len = [], 0
+            for lines in cls._get_as_lines(corpus, **kwargs):
+                text = ''.join(lines)
+                buffer.append(text)
+                buffer_len += len(text)
+                if buffer_len >= buffer_size:
+                    f.write(''.join(buffer))
+                    buffer, buffer_len = [], 0
+            if buffer:
+                f.write(''.join(buffer))
 
     @classmethod
     def merge(cls, corpus1, corpus2, encoding='utf-8-sig',
@@ -579,3 +947,204 @@ class Conllu:
             pass
         else:
             error('Extra sentence in corpus1:', sentence1, None)
+
+    @classmethod
+    def merge_aligned(cls, corpus1, corpus2, encoding='utf-8-sig',
+                      ignore_new_meta=False, window=1000, conflicts=None,
+                      fast=False, log_file=LOG_FILE):
+        """Merge CoNLL-U fields of two corpuses. Unlike ``.merge()``, the
+        corpuses may differ in the set of sentences: they are aligned by the
+        "sent_id" meta variable or, if any of two sentences doesn't have it,
+        by their text. Sentences of *corpus2* are looked for in the window of
+        *window* sentences after the last matched one, so only O(window)
+        sentences are kept in memory. Tokens are matched by their IDs.
+
+        Mismatches don't stop the process, they are reported to *conflicts*.
+        Values of *corpus2* take precedence over conflicting values of
+        *corpus1*, except the FORM field: if FORMs differ, the token is not
+        merged.
+
+        :param ignore_new_meta: if ``True``, output metadata will be exactly
+                                as in *corpus1*. Metadata of *corpus2* is
+                                ignored.
+        :param window: the size of the look-ahead window in sentences
+        :type window: int
+        :param conflicts: a list (or any object with the ``.append()`` method)
+                          to store conflicts. Each conflict is a dict with
+                          the keys: "type" (one of "missing_sentence",
+                          "extra_sentence", "missing_token", "extra_token",
+                          "meta", "field", "feat"), "sent_no1", "sent_no2"
+                          (numbers of sentences in the corpuses), "sent_id",
+                          "token_id", "field" (the name of the meta variable,
+                          the field or the field and the feat separated with
+                          ':'), "value1", "value2". Inapplicable values are
+                          None
+        :param fast: use the fast-path parser while loading (see ``.load()``)
+        :param log_file: stream for messages
+        :return: sentences of *corpus1* in Parsed CoNLL-U format merged with
+                 corresponding sentences of *corpus2*
+        :rtype: iter(tuple(list(dict(str: str|OrderedDict(str: str))),
+                           OrderedDict(str: str)))
+        """
+        num_conflicts = 0
+
+        def conflict(type_, sent_no1=None, sent_no2=None, sent_id=None,
+                     token_id=None, field=None, value1=None, value2=None):
+            nonlocal num_conflicts
+            num_conflicts += 1
+            if conflicts is not None:
+                conflicts.append({
+                    'type': type_, 'sent_no1': sent_no1, 'sent_no2': sent_no2,
+                    'sent_id': sent_id, 'token_id': token_id, 'field': field,
+                    'value1': value1, 'value2': value2
+                })
+
+        def get_text(sentence, sentence_meta):
+            text = sentence_meta.get('text')
+            return text if text is not None else \
+                   ' '.join(x.get('FORM') or '' for x in sentence)
+
+        # entry: [sent_no2, sentence, sentence_meta, sent_id, is_done, text]
+        buffer, by_id, by_text = deque(), {}, {}
+
+        def find(sent_id, text):
+            if sent_id is not None:
+                entries = by_id.get(sent_id)
+                if entries:
+                    for entry in entries:
+                        if not entry[4]:
+                            return entry
+            entries = by_text.get(text)
+            if entries:
+                for entry in entries:
+                    if not entry[4] and (sent_id is None
+                                      or entry[3] is None):
+                        return entry
+
+        def drop(entry):
+            entry[4] = True
+            for idx, key in [(by_id, entry[3]), (by_text, entry[5])]:
+                entries = idx.get(key)
+                if entries is not None:
+                    while entries and entries[0][4]:
+                        entries.popleft()
+                    if not entries:
+                        del idx[key]
+
+        corpus2 = enumerate(cls.load(corpus2, encoding=encoding, fix=False,
+                                     fast=fast, log_file=None))
+        last_sent_no2, is_eof2 = -1, False
+
+        def read():
+            nonlocal is_eof2
+            try:
+                sent_no2, (sentence2, sentence_meta2) = next(corpus2)
+            except StopIteration:
+                is_eof2 = True
+                return None
+            sent_id = sentence_meta2.get('sent_id')
+            text = get_text(sentence2, sentence_meta2)
+            entry = [sent_no2, sentence2, sentence_meta2, sent_id, False,
+                     text]
+            buffer.append(entry)
+            if sent_id is not None:
+                by_id.setdefault(sent_id, deque()).append(entry)
+            by_text.setdefault(text, deque()).append(entry)
+            return entry
+
+        def evict(up_to):
+            while buffer and buffer[0][0] < up_to:
+                entry = buffer.popleft()
+                if not entry[4]:
+                    conflict('extra_sentence', sent_no2=entry[0],
+                             sent_id=entry[3])
+                    drop(entry)
+
+        sent_no1 = -1
+        for sent_no1, (sentence1, sentence_meta1) in enumerate(
+            cls.load(corpus1, encoding=encoding, fix=False, fast=fast,
+                     log_file=log_file)
+        ):
+            sent_id = sentence_meta1.get('sent_id')
+            text = get_text(sentence1, sentence_meta1)
+            entry = find(sent_id, text)
+            while entry is None and not is_eof2 and (
+                not buffer or buffer[-1][0] < last_sent_no2 + window
+            ):
+                entry = read()
+                if entry is not None and (
+                    entry[3] != sent_id if sent_id is not None
+                                       and entry[3] is not None else
+                    entry[5] != text
+                ):
+                    entry = None
+            if entry is None:
+                conflict('missing_sentence', sent_no1=sent_no1,
+                         sent_id=sent_id)
+                yield sentence1, sentence_meta1
+                continue
+            drop(entry)
+            sent_no2, sentence2, sentence_meta2 = entry[:3]
+            last_sent_no2 = max(last_sent_no2, sent_no2)
+            evict(last_sent_no2 - window)
+
+            if not ignore_new_meta:
+                for key, val2 in sentence_meta2.items():
+                    if val2 is not None:
+                        val1 = sentence_meta1.get(key)
+                        if val1 is not None and val1 != val2:
+                            conflict('meta', sent_no1, sent_no2, sent_id,
+                                     field=key, value1=val1, value2=val2)
+                        sentence_meta1[key] = val2
+
+            tokens1 = {x.get('ID'): x for x in sentence1}
+            for token2 in sentence2:
+                token_id = token2.get('ID')
+                token1 = tokens1.pop(token_id, None)
+                if token1 is None:
+                    conflict('extra_token', sent_no1, sent_no2, sent_id,
+                             token_id=token_id)
+                    continue
+                form1, form2 = token1.get('FORM'), token2.get('FORM')
+                if form1 != form2 and form1 is not None \
+                                  and form2 is not None:
+                    conflict('field', sent_no1, sent_no2, sent_id, token_id,
+                             'FORM', form1, form2)
+                    continue
+                for key, val2 in token2.items():
+                    if val2 is None:
+                        continue
+                    val1 = token1.get(key)
+                    if key in ['FEATS', 'MISC']:
+                        if not val1:
+                            token1[key] = val2
+                            continue
+                        for feat, feat_val2 in val2.items():
+                            if feat_val2 is not None:
+                                feat_val1 = val1.get(feat)
+                                if feat_val1 is not None \
+                               and feat_val1 != feat_val2:
+                                    conflict('feat', sent_no1, sent_no2,
+                                             sent_id, token_id,
+                                             key + ':' + feat,
+                                             feat_val1, feat_val2)
+                                val1[feat] = feat_val2
+                    elif val1 != val2:
+                        if val1 is not None:
+                            conflict('field', sent_no1, sent_no2, sent_id,
+                                     token_id, key, val1, val2)
+                        token1[key] = val2
+            for token_id in tokens1:
+                if token_id is None \
+                or '-' not in token_id and '.' not in token_id:
+                    conflict('missing_token', sent_no1, sent_no2, sent_id,
+                             token_id=token_id)
+            yield sentence1, sentence_meta1
+
+        while read() is not None:
+            evict(buffer[-1][0] - window)
+        evict(float('inf'))
+        if log_file:
+            print('Corpuses have been merged: {} sentences, {} conflicts'
+                      .format(sent_no1 + 1, num_conflicts),
+                  file=log_file)
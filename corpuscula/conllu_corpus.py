@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# Corpuscula project: Columnar CoNLL-U corpus
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Compact columnar in-memory storage for corpora in Parsed CoNLL-U format.
+"""
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from corpuscula.conllu import LazyOrderedDict
+
+
+_ABSENT = object()  # marker for the column absent in the token
+
+# codes of the HEAD column; non-negative codes are HEAD values itself
+_HEAD_NONE = -1
+_HEAD_ABSENT = -2
+_HEAD_STR = -3  # _HEAD_STR - code: index of a non-numeric HEAD value
+
+def _encode_dict(val):
+    if isinstance(val, LazyOrderedDict) and val._raw is not None:
+        return val._raw
+    return '|'.join(k if v is None else k + '=' + v for k, v in val.items())
+
+def _decode_dict(val, token, column):
+    res = _DictField()
+    for item in val.split('|'):
+        if item and item != '_':
+            key, val_ = item.split('=', 1) if '=' in item else (item, None)
+            OrderedDict.__setitem__(res, key, val_)
+    res._token, res._column = token, column
+    return res
+
+
+class _DictField(OrderedDict):
+    """OrderedDict of *FEATS* or *MISC* of a ``ConlluCorpus`` token. Any
+    change of it is stored back to the corpus"""
+
+    _token = None
+
+    def _store(self):
+        if self._token is not None:
+            self._token[self._column] = self
+
+    def copy(self):
+        return OrderedDict(self)
+
+    def __reduce__(self):
+        return (OrderedDict, (list(self.items()),))
+
+    def __repr__(self):
+        return repr(OrderedDict(self))
+
+def _storing_method(name):
+    method = getattr(OrderedDict, name)
+    def storing_method(self, *args, **kwargs):
+        res = method(self, *args, **kwargs)
+        self._store()
+        return res
+    storing_method.__name__ = name
+    return storing_method
+
+for name in ['__delitem__', '__setitem__', 'clear', 'move_to_end', 'pop',
+             'popitem', 'setdefault', 'update', '__ior__']:
+    if hasattr(OrderedDict, name):
+        setattr(_DictField, name, _storing_method(name))
+del name
+
+
+class _TokenView(MutableMapping):
+    """Dict-like view of a token of ``ConlluCorpus``"""
+
+    __slots__ = ('_corpus', '_idx')
+
+    def __init__(self, corpus, idx):
+        self._corpus = corpus
+        self._idx = idx
+
+    def __getitem__(self, column):
+        res = self._corpus._get(self._idx, column)
+        if res is _ABSENT:
+            raise KeyError(column)
+        return res
+
+    def __setitem__(self, column, val):
+        self._corpus._set(self._idx, column, val)
+
+    def __delitem__(self, column):
+        if self._corpus._get(self._idx, column) is _ABSENT:
+            raise KeyError(column)
+        self._corpus._set(self._idx, column, _ABSENT)
+
+    def __contains__(self, column):
+        return self._corpus._get(self._idx, column) is not _ABSENT
+
+    def __iter__(self):
+        corpus, idx = self._corpus, self._idx
+        return iter([x for x in corpus._columns
+                         if corpus._get(idx, x) is not _ABSENT])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class ConlluCorpus:
+    """Compact columnar storage for a corpus in Parsed CoNLL-U format.
+
+    String fields are interned into integer-coded arrays, HEAD is kept as an
+    int array, FEATS and MISC are interned in their text form. Sentences
+    are returned as tuples of a list of dict-like token views and an
+    OrderedDict of metadata, so the corpus can be used anywhere Parsed
+    CoNLL-U is expected (``Conllu.fix()``, ``Conllu.get_as_text()``,
+    ``CorpusDict.parse()``, etc.)
+
+    NB: Changes of token fields via views are stored in the corpus. FEATS
+    and MISC are decoded anew on every access, but the returned dicts store
+    their changes back to the corpus, too."""
+
+    DICT_COLUMNS = ['FEATS', 'MISC']
+
+    def __init__(self, corpus=None):
+        """
+        :param corpus: sentences in Parsed CoNLL-U format to add
+        """
+        self._columns = []   # [column]
+        self._codes = {}     # {column: array(code)}, except HEAD
+        self._vocabs = {}    # {column: [val]}
+        self._vocabs_id = {} # {column: {val: code}}
+        self._heads = None   # array(head), see _HEAD_* for negative codes
+        self._head_vocab, self._head_vocab_id = [], {}
+        self._offsets = array('I', [0])  # [token_offset] of sentences
+        self._metas = []     # [OrderedDict(str: str)]
+        self._ntokens = 0
+
+        if corpus is not None:
+            self.extend(corpus)
+
+    def _add_column(self, column):
+        self._columns.append(column)
+        if column == 'HEAD':
+            self._heads = array('i', [_HEAD_ABSENT]) * self._ntokens
+        else:
+            self._codes[column] = array('I', [0]) * self._ntokens
+            self._vocabs[column] = [_ABSENT]
+            self._vocabs_id[column] = {}
+
+    def _encode(self, column, val):
+        if column == 'HEAD':
+            if val is _ABSENT:
+                code = _HEAD_ABSENT
+            elif val is None:
+                code = _HEAD_NONE
+            elif val.isdecimal():
+                code = int(val)
+                if str(code) != val:  # e.g. '01'
+                    code = None
+            else:
+                code = None
+            if code is None:
+                code = self._head_vocab_id.get(val)
+                if code is None:
+                    code = self._head_vocab_id[val] = len(self._head_vocab)
+                    self._head_vocab.append(val)
+                code = _HEAD_STR - code
+        elif val is _ABSENT:
+            code = 0
+        else:
+            if column in self.DICT_COLUMNS and val is not None:
+                val = _encode_dict(val)
+            vocab_id = self._vocabs_id[column]
+            code = vocab_id.get(val)
+            if code is None:
+                vocab = self._vocabs[column]
+                code = vocab_id[val] = len(vocab)
+                vocab.append(val)
+        return code
+
+    def _get(self, idx, column):
+        if column == 'HEAD':
+            heads = self._heads
+            if heads is None:
+                return _ABSENT
+            code = heads[idx]
+            return str(code) if code >= 0 else \
+                   None if code == _HEAD_NONE else \
+                   _ABSENT if code == _HEAD_ABSENT else \
+                   self._head_vocab[_HEAD_STR - code]
+        codes = self._codes.get(column)
+        if codes is None:
+            return _ABSENT
+        res = self._vocabs[column][codes[idx]]
+        if res is not _ABSENT and res is not None \
+                              and column in self.DICT_COLUMNS:
+            res = _decode_dict(res, _TokenView(self, idx), column)
+        return res
+
+    def _set(self, idx, column, val):
+        if column not in self._columns:
+            if val is _ABSENT:
+                return
+            self._add_column(column)
+        code = self._encode(column, val)
+        if column == 'HEAD':
+            self._heads[idx] = code
+        else:
+            self._codes[column][idx] = code
+
+    def append(self, sentence):
+        """Add a *sentence* in Parsed CoNLL-U format to the corpus"""
+        sentence, sentence_meta = \
+            sentence if isinstance(sentence, tuple) else \
+            (sentence, OrderedDict())
+        for token in sentence:
+            for column in token:
+                if column not in self._columns:
+                    self._add_column(column)
+            for column in self._columns:
+                code = self._encode(column, token.get(column, _ABSENT))
+                if column == 'HEAD':
+                    self._heads.append(code)
+                else:
+                    self._codes[column].append(code)
+            self._ntokens += 1
+        self._offsets.append(self._ntokens)
+        self._metas.append(sentence_meta)
+
+    def extend(self, corpus):
+        """Add sentences of a *corpus* in Parsed CoNLL-U format"""
+        for sentence in corpus:
+            self.append(sentence)
+
+    def get_columns(self):
+        """Return a list of all column names met in the corpus"""
+        return self._columns[:]
+
+    def get_num_tokens(self):
+        """Return a total number of tokens in the corpus"""
+        return self._ntokens
+
+    def __len__(self):
+        return len(self._metas)
+
+    def __getitem__(self, sent_no):
+        """Return a sentence as a tuple of a list of token views and an
+        OrderedDict of metadata"""
+        if isinstance(sent_no, slice):
+            return [self[x] for x in range(*sent_no.indices(len(self)))]
+        if sent_no < 0:
+            sent_no += len(self)
+        if not 0 <= sent_no < len(self):
+            raise IndexError('sentence index out of range')
+        return [_TokenView(self, x)
+                    for x in range(self._offsets[sent_no],
+                                   self._offsets[sent_no + 1])], \
+               self._metas[sent_no]
+
+    def __iter__(self):
+        for sent_no in range(len(self)):
+            yield self[sent_no]
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Corpuscula project: CoNLL-U index
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Sidecar index of a CoNLL-U file. The index keeps byte offsets of all the
+sentences of the file along with their "sent_id" and "newdoc id" meta
+variables, so any sentence can be read without parsing the rest of the file.
+
+When the file grows, the index is updated incrementally: only the new part of
+the file is scanned.
+"""
+from array import array
+from hashlib import sha1
+import os
+import pickle
+
+INDEX_VERSION = 1
+INDEX_EXT = '.idx'
+_FINGERPRINT_SIZE = 64 * 1024
+
+
+def get_index_fpath(file_path):
+    """Return a default path of the index of a CoNLL-U file *file_path*"""
+    return file_path + INDEX_EXT
+
+def _get_fingerprint(f, end):
+    """Return a hash of the head of the file *f* and of its part just before
+    the offset *end*"""
+    key = sha1()
+    f.seek(0)
+    key.update(f.read(min(end, _FINGERPRINT_SIZE)))
+    f.seek(max(end - _FINGERPRINT_SIZE, 0))
+    key.update(f.read(end - f.tell()))
+    return key.hexdigest()
+
+
+class ConlluIndex:
+    """Index of sentences of a CoNLL-U file"""
+
+    def __init__(self, file_path, index_path=None, encoding='utf-8-sig',
+                 update=True):
+        """
+        :param file_path: path to the CoNLL-U file
+        :param index_path: path to the index file. If None, it is placed
+                           near the *file_path*
+        :param encoding: encoding of the CoNLL-U file
+        :param update: if True (default), the index is created or updated
+                       if it's absent or outdated, and then saved. Elsewise,
+                       the index file is only read
+        """
+        self.file_path = file_path
+        self.index_path = index_path if index_path else \
+                          get_index_fpath(file_path)
+        self._encoding = encoding
+        self._starts = array('Q')  # [offset of the sentence's first line]
+        self._ends = array('Q')    # [offset after the sentence]
+        self._sent_ids = []        # [sent_id|None]
+        self._newdoc_ids = {}      # {sent_no: newdoc_id|None}
+        self._size = 0
+        self._fingerprint = None
+        self._sent_ids_idx = None
+
+        if os.path.isfile(self.index_path):
+            self._read()
+        if update:
+            self.update()
+
+    def _read(self):
+        with open(self.index_path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != INDEX_VERSION:
+            return
+        self._size, self._fingerprint = data['size'], data['fingerprint']
+        self._starts, self._ends = data['starts'], data['ends']
+        self._sent_ids, self._newdoc_ids = data['sent_ids'], data['newdoc_ids']
+
+    def _write(self):
+        index_path_ = self.index_path + '$'
+        with open(index_path_, 'wb') as f:
+            pickle.dump({
+                'version': INDEX_VERSION, 'size': self._size,
+                'fingerprint': self._fingerprint,
+                'starts': self._starts, 'ends': self._ends,
+                'sent_ids': self._sent_ids, 'newdoc_ids': self._newdoc_ids
+            }, f, 2)
+        os.replace(index_path_, self.index_path)
+
+    def _truncate(self, num_sents):
+        del self._starts[num_sents:]
+        del self._ends[num_sents:]
+        del self._sent_ids[num_sents:]
+        for sent_no in [x for x in self._newdoc_ids if x >= num_sents]:
+            del self._newdoc_ids[sent_no]
+
+    def update(self):
+        """Bring the index in line with the CoNLL-U file. If the file has
+        only grown since the last update, just its new part is scanned;
+        elsewise, the index is built anew.
+
+        :return: the number of sentences (re)indexed
+        :rtype: int
+        """
+        size = os.path.getsize(self.file_path)
+        with open(self.file_path, 'rb') as f:
+            if self._fingerprint is None or size < self._size \
+            or _get_fingerprint(f, self._size) != self._fingerprint:
+                self._truncate(0)
+            elif size == self._size:
+                return 0
+            # the last sentence could be incomplete, so we rescan it
+            num_sents = max(len(self._starts) - 1, 0)
+            pos = self._starts[num_sents] if num_sents < len(self._starts) \
+                                          else 0
+            self._truncate(num_sents)
+            self._scan(f, pos)
+            self._size = size
+            self._fingerprint = _get_fingerprint(f, size)
+        self._sent_ids_idx = None
+        self._write()
+        return len(self._starts) - num_sents
+
+    def _scan(self, f, pos):
+        encoding = self._encoding
+        f.seek(pos)
+        start = sent_id = newdoc_id = None
+        has_newdoc = False
+        for line in f:
+            end = pos + len(line)
+            if line.strip():
+                if start is None:
+                    start = pos
+                if pos == 0 or line.lstrip().startswith(b'#'):
+                    line = line.decode(encoding).strip()  # cut BOM, if any
+                    if line.startswith('#'):
+                        meta = [x.strip() for x in line[1:].split('=', 1)]
+                        val = meta[1] if len(meta) > 1 else None
+                        if meta[0] == 'sent_id':
+                            sent_id = val
+                        elif meta[0] in ['newdoc', 'newdoc id']:
+                            has_newdoc, newdoc_id = True, val
+            elif start is not None:
+                self._add(start, pos, sent_id, has_newdoc, newdoc_id)
+                start = sent_id = newdoc_id = None
+                has_newdoc = False
+            pos = end
+        if start is not None:
+            self._add(start, pos, sent_id, has_newdoc, newdoc_id)
+
+    def _add(self, start, end, sent_id, has_newdoc, newdoc_id):
+        if has_newdoc:
+            self._newdoc_ids[len(self._starts)] = newdoc_id
+        self._starts.append(start)
+        self._ends.append(end)
+        self._sent_ids.append(sent_id)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def get_bounds(self, sent_no):
+        """Return byte offsets of the start and the end of a sentence with
+        the index *sent_no*
+
+        :rtype: tuple(int, int)
+        """
+        return self._starts[sent_no], self._ends[sent_no]
+
+    def get_sent_nos(self, sent_id):
+        """Return the indices of all the sentences with *sent_id* in the
+        order of the file
+
+        :rtype: list(int)
+        :raise KeyError: if *sent_id* is not found
+        """
+        if self._sent_ids_idx is None:
+            self._sent_ids_idx = {}
+            for sent_no, sent_id_ in enumerate(self._sent_ids):
+                self._sent_ids_idx.setdefault(sent_id_, []).append(sent_no)
+        return self._sent_ids_idx[sent_id][:]
+
+    def get_sent_no(self, sent_id):
+        """Return the index of the sentence with *sent_id*. If there are
+        several such sentences, the index of the first one is returned
+
+        :raise KeyError: if *sent_id* is not found
+        """
+        return self.get_sent_nos(sent_id)[0]
+
+    def get_sent_ids(self):
+        """Return a list of "sent_id" values of all the sentences (None for
+        the sentences without "sent_id")"""
+        return self._sent_ids[:]
+
+    def get_newdoc_ids(self):
+        """Return a dict of indices of the sentences that start new documents
+        and the values of their "newdoc id" meta variable (None if the
+        variable has no value)
+
+        :rtype: dict(int: str)
+        """
+        return dict(self._newdoc_ids)
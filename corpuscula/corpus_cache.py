@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Corpuscula project: Binary corpus cache
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Binary on-disk cache for corpora in Parsed CoNLL-U format. The cache file is
+opened via mmap, so any sentence can be fetched without decoding the rest.
+
+Layout of the cache file (all numbers are in native byte order):
+
+    header: magic, version, reserved, number of sentences N, table offset
+    N pickled sentences one after another
+    table: N + 1 offsets of the sentences (the last one is the table offset)
+"""
+from array import array
+from hashlib import sha1
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+from corpuscula._version import __version__
+
+CACHE_VERSION = 1
+_MAGIC = b'CRPSCACH'
+_HEADER = struct.Struct('=8sIIQQ')
+_FINGERPRINT_SIZE = 1024 * 1024
+TMP_SUFFIX = '$'  # suffix of the unfinished cache files
+
+
+def get_cache_key(fpaths, variant=None):
+    """Return a key of the cache for the corpus built from the files
+    *fpaths*. The key depends on sizes and modification times of the files
+    and on a hash of their heads and tails. Also, it changes with the
+    version of the package.
+
+    :param variant: any additional value the corpus depends on
+    :type variant: str
+    :rtype: str
+    """
+    key = sha1(repr((CACHE_VERSION, __version__, sys.byteorder,
+                     variant)).encode('utf-8'))
+    for fpath in fpaths:
+        stat = os.stat(fpath)
+        key.update(repr((os.path.abspath(fpath), stat.st_size,
+                         stat.st_mtime_ns)).encode('utf-8'))
+        with open(fpath, 'rb') as f:
+            key.update(f.read(_FINGERPRINT_SIZE))
+            if stat.st_size > _FINGERPRINT_SIZE:
+                f.seek(max(stat.st_size - _FINGERPRINT_SIZE,
+                           _FINGERPRINT_SIZE))
+                key.update(f.read())
+    return key.hexdigest()
+
+
+class CorpusCacheWriter:
+    """Writer of the corpus cache. The file appears under its name only after
+    ``.close()``; until then the data is written to a temporary file. The
+    temporary file is unique for each writer, so several writers of the same
+    cache don't interfere: the cache is made by the one that finishes last"""
+
+    def __init__(self, file_path):
+        self._fpath = file_path
+        self._fpath_ = '{}.{}.{}{}'.format(file_path, os.getpid(),
+                                           os.urandom(4).hex(), TMP_SUFFIX)
+        self._f = open(self._fpath_, 'xb')
+        self._f.write(_HEADER.pack(_MAGIC, CACHE_VERSION, 0, 0, 0))
+        self._offsets = array('Q', [_HEADER.size])
+
+    def add(self, sentence):
+        """Add a *sentence* in Parsed CoNLL-U format to the cache"""
+        data = pickle.dumps(sentence, pickle.HIGHEST_PROTOCOL)
+        self._f.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        """Finalize the cache file"""
+        f, offsets = self._f, self._offsets
+        table_offset = offsets[-1]
+        padding = -table_offset % offsets.itemsize
+        if padding:
+            f.write(b'\0' * padding)
+            table_offset += padding
+        f.write(offsets.tobytes())
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, CACHE_VERSION, 0, len(offsets) - 1,
+                             table_offset))
+        f.close()
+        try:
+            os.replace(self._fpath_, self._fpath)
+        except OSError:
+            # the cache is in use, so another writer has already made it
+            if not os.path.isfile(self._fpath):
+                raise
+            os.remove(self._fpath_)
+
+    def abort(self):
+        """Drop the unfinished cache file"""
+        self._f.close()
+        try:
+            os.remove(self._fpath_)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CorpusCache:
+    """Random access to sentences of the corpus cache"""
+
+    def __init__(self, file_path):
+        self._f = open(file_path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, _, num_sents, table_offset = \
+                _HEADER.unpack_from(self._mm)
+            if magic != _MAGIC or version != CACHE_VERSION:
+                raise ValueError('ERROR: {} is not a corpus cache file '
+                                 'of version {}'
+                                     .format(file_path, CACHE_VERSION))
+        except Exception as e:
+            self._f.close()
+            raise e
+        self._offsets = memoryview(self._mm)[
+            table_offset:table_offset + (num_sents + 1) * 8
+        ].cast('Q')
+        self._num_sents = num_sents
+
+    def close(self):
+        if self._mm is not None:
+            self._offsets.release()
+            self._mm.close()
+            self._f.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._num_sents
+
+    def __getitem__(self, sent_no):
+        """Return a sentence *sent_no* in Parsed CoNLL-U format"""
+        if sent_no < 0:
+            sent_no += self._num_sents
+        if not 0 <= sent_no < self._num_sents:
+            raise IndexError('sentence index out of range')
+        return pickle.loads(self._mm[self._offsets[sent_no]:
+                                     self._offsets[sent_no + 1]])
+
+    def __iter__(self):
+        for sent_no in range(self._num_sents):
+            yield self[sent_no]
@@ -8,14 +8,78 @@ A corpus dictionary to use for further morphology processing. It contains
 a bunch of useful statictics and the generator of LEMMA by the word FORM and
 POS tag.
 """
+from collections import OrderedDict
+from itertools import islice
+from multiprocessing import Pool
 from operator import itemgetter
 import pickle
 import sys
 
-from corpuscula.conllu import Conllu
+from corpuscula.conllu import Conllu, _load_shard, get_columns, \
+                              get_shard_bounds
+from corpuscula.corpus_dict_model import MODEL_VERSION, attach_model, \
+                                         is_model_file, load_model, \
+                                         save_model, share_model
+from corpuscula.corpus_dict_storage import PackedCounts, SuffixTrie
+try:
+    from corpuscula.corpus_dict_numpy import fit_counts as fit_counts_numpy
+except ImportError:  # numpy is not installed
+    fit_counts_numpy = None
 from corpuscula.corpus_utils import _AbstractCorpus
 from corpuscula.utils import LOG_FILE, find_affixes, print_progress
 
+PARSE_CHUNK_SIZE = 10000  # sentences in a shard for parallel parse
+PREDICT_CACHE_SIZE = 65536  # default size of the cache of predictions
+
+
+def _parse_shard(shard):
+    """Extract information from a *shard* of a corpus in a worker process.
+    The *shard* is either a list of sentences in Parsed CoNLL-U format or a
+    tuple (file_path, start, end, columns) of a byte range of a CoNLL-U
+    file"""
+    if isinstance(shard, tuple):
+        file_path, start, end, columns = shard
+        shard = Conllu.fix(_load_shard((file_path, start, end, 'utf-8-sig',
+                                        columns, False)))
+    cdict = CorpusDict()
+    return cdict._get_partial(cdict._parse_sentences(shard))
+
+
+class _LRUCache:
+    """Bounded cache that drops the least recently used items"""
+
+    __slots__ = ('maxsize', 'hits', 'misses', 'evictions', '_data')
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """Return the value for the *key* or None if it's absent"""
+        val = self._data.get(key)
+        if val is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return val
+
+    def put(self, key, val):
+        data = self._data
+        data[key] = val
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._data),
+                'maxsize': self.maxsize}
+
 
 class CorpusDict:
     """Arrays of information extracted from labeled corpus(es).
@@ -23,7 +87,7 @@ class CorpusDict:
 
     def __init__(self, restore_from=None, corpus=None, format='conllu',
                  backup_to=None, cnt_thresh=20, ambiguity_thresh=1.,
-                 log_file=LOG_FILE):
+                 predict_cache_size=PREDICT_CACHE_SIZE, log_file=LOG_FILE):
         """
         :param restore_from: path to backup file to load from
         :type restore_from: str
@@ -36,6 +100,7 @@ class CorpusDict:
         :type backup_to: str
         :param cnt_thresh: param for ``fit()``
         :param ambiguity_thresh: param for ``fit()``
+        :param predict_cache_size: param for ``set_predict_cache()``
         :param log_file: stream for info messages
         :type file
 
@@ -71,14 +136,32 @@ class CorpusDict:
             #                      '--- may be empty ---'
 
         self._most_probable_tags        = {}    # {wform_id: tag_id}
+        self._wform_tags_top            = {}
+            # {wform_id: (tag_id, cnt, cnt2)}: the best tag, its count and
+            # the count of the runner-up
+        self._wform_title_tags_top      = {}
+            # {wform_id: (tag_id, cnt, cnt2)}: the same for the counts of
+            # the title wform merged with the counts of its lower form
+        self._wform_tag_lemmata_top     = {}
+            # {wform_id: {tag_id: (lemma_id, cnt, cnt2)}}
         self._most_common_tag           = None  # tag
         self._common_endings            = {}
-            # {tag_id: {wform_ed: [(lemma_ed, cnt)]})
+            # {tag_id: SuffixTrie({wform_ed: [(lemma_ed, cnt)]})}
             # [(lemma_ed, cnt)] sorted by cnt
         self._capitalized_tags          = set() # set(tag_id)
+        self._tag_case_cnts             = []
+            # [(lower_cnt, upper_cnt)]: numbers of lowercase and other alpha
+            # lemmata of the tag
         self._tag_feats                 = []    # [set(feat_id)]
         self._most_probable_wform_feats = {}    # {wform_id: {feat_id: val_id}}
         self._most_probable_lemma_feats = {}    # {lemma_id: {feat_id: val_id}}
+        self._fit_thresholds            = None
+            # (cnt_thresh, ambiguity_thresh) of the last fit; None if the
+            # results of fit are absent or outdated
+        self._fit_delta                 = None
+            # changes of the counters since the last fit for the incremental
+            # fit; see ``._new_fit_delta()``
+        self.set_predict_cache(predict_cache_size)
 
         if restore_from:
             self.restore_from(restore_from)
@@ -89,9 +172,30 @@ class CorpusDict:
         if corpus:
             self.fit(log_file=log_file)
 
-    def backup(self):
-        """Get current state"""
-        return {'_cnt_thresh'      : self._cnt_thresh      ,
+    _FITTED_ATTRS = ['_most_probable_tags', '_wform_tags_top',
+                     '_wform_title_tags_top', '_wform_tag_lemmata_top',
+                     '_most_common_tag',
+                     '_common_endings', '_capitalized_tags',
+                     '_tag_case_cnts', '_tag_feats',
+                     '_most_probable_wform_feats',
+                     '_most_probable_lemma_feats',
+                     '_tags_freq', '_feats_freq', '_feat_vals_freq']
+    _COUNT_ATTRS = ['_wforms_id', '_lemmata_id', '_tags_id', '_feats_id',
+                    '_feat_vals_id', '_wform_tag_cnts', '_wform_feat_cnts',
+                    '_lemma_tag_cnts', '_lemma_feat_cnts']
+
+    def _get_fit_fingerprint(self):
+        """Get cheap invariants of the counters that are stored along with
+        the results of ``.fit()`` to check them on restore"""
+        return (MODEL_VERSION,) \
+             + tuple(len(getattr(self, x)) for x in self._COUNT_ATTRS)
+
+    def backup(self, fitted=False):
+        """Get current state
+
+        :param fitted: if True, the results of ``.fit()`` are included, too
+        """
+        res = {'_cnt_thresh'      : self._cnt_thresh      ,
                 '_ambiguity_thresh': self._ambiguity_thresh,
                 '_wforms_id'       : self._wforms_id       ,
                 '_lemmata_id'      : self._lemmata_id      ,
@@ -102,14 +206,34 @@ class CorpusDict:
                 '_wform_feat_cnts' : self._wform_feat_cnts ,
                 '_lemma_tag_cnts'  : self._lemma_tag_cnts  ,
                 '_lemma_feat_cnts' : self._lemma_feat_cnts }
-
-    def backup_to(self, file_path):
-        """Store current state to file"""
+        if fitted:
+            res['_fit_thresholds'] = self._fit_thresholds
+            res['_fit_fingerprint'] = \
+                None if self._fit_thresholds is None else \
+                self._get_fit_fingerprint()
+            res.update({x: getattr(self, x) for x in self._FITTED_ATTRS})
+        return res
+
+    def backup_to(self, file_path, fitted=False):
+        """Store current state to file
+
+        :param fitted: if True, the results of ``.fit()`` are stored, too
+        """
         with open(file_path, 'wb') as f:
-            pickle.dump(self.backup(), f, 2)
-
-    def restore(self, o, log_file=LOG_FILE):
-        """Restore current state from backup object"""
+            pickle.dump(self.backup(fitted=fitted), f, 2)
+
+    def restore(self, o, refit=True, log_file=LOG_FILE):
+        """Restore current state from backup object
+
+        :param refit: if False and the backup contains the results of
+                      ``.fit()`` made with the same thresholds and on the
+                      same counters as stored in the backup, those results
+                      are used as is. Elsewise, ``.fit()`` is called. The
+                      counters are checked by the fingerprint (the sizes
+                      of the counters) stored by ``.backup()``, so the
+                      backups of the old versions are always refitted
+        """
+        self._clear_predict_cache()
         (self._cnt_thresh      ,
          self._ambiguity_thresh,
          self._wforms_id       ,
@@ -143,18 +267,112 @@ class CorpusDict:
             [k for k, _ in sorted(vals.items(), key=itemgetter(1))]
                 for vals in self._feat_vals_id
         )
-        self.fit(log_file=log_file)
+        fit_thresholds = o.get('_fit_thresholds')
+        fit_fingerprint = o.get('_fit_fingerprint')
+        if not refit and fit_thresholds is not None \
+       and fit_fingerprint is not None \
+       and tuple(fit_thresholds) == (self._cnt_thresh,
+                                     self._ambiguity_thresh) \
+       and tuple(fit_fingerprint) == self._get_fit_fingerprint():
+            for attr in self._FITTED_ATTRS:
+                setattr(self, attr, o[attr])
+            self._fit_thresholds = tuple(fit_thresholds)
+            self._fit_delta = None
+        else:
+            self._fit_delta = None
+            self.fit(log_file=log_file)
 
-    def restore_from(self, file_path, log_file=LOG_FILE):
-        """Restore current state from file"""
-        with open(file_path, 'rb') as f:
-            self.restore(pickle.load(f), log_file=log_file)
+    def restore_from(self, file_path, refit=True, log_file=LOG_FILE):
+        """Restore current state from file. The file may be either a backup
+        made by ``.backup_to()`` or a model saved by ``.save_model()``. The
+        model is memory-mapped and doesn't need ``.fit()``
+
+        :param refit: see ``.restore()``. Ignored for models
+        """
+        if is_model_file(file_path):
+            self._clear_predict_cache()
+            load_model(self, file_path)
+            self._fit_delta = None
+        else:
+            with open(file_path, 'rb') as f:
+                self.restore(pickle.load(f), refit=refit, log_file=log_file)
+
+    def save_model(self, file_path):
+        """Store current state along with the results of ``.fit()`` to the
+        binary model file. The model can be loaded by ``.restore_from()``
+        without fitting. It is opened via mmap, so the loading takes
+        milliseconds, and processes that load the same model share its
+        memory pages.
+
+        NB: The model file is platform-dependent. It can be loaded on the
+        platform with the different byte order, but then it's copied to
+        memory"""
+        save_model(self, file_path)
+
+    def share_model(self, name=None):
+        """Store current state along with the results of ``.fit()`` to a new
+        shared memory segment in the format of the binary model. Other
+        processes can attach to it with ``.attach_model()`` without copying.
+        Requires Python 3.8+
+
+        :param name: name of the segment. If None, a unique name is generated
+        :type name: str
+        :return: the segment; its name is in the ``.name`` attribute. When
+                 the segment is no longer needed, call its ``.close()`` and
+                 ``.unlink()`` methods
+        :rtype: multiprocessing.shared_memory.SharedMemory
+        """
+        return share_model(self, name=name)
+
+    def attach_model(self, name):
+        """Restore current state from the shared memory segment created by
+        ``.share_model()``. Like the model loaded from file, the segment is
+        used in place, so no time or memory are spent for loading
+
+        :param name: name of the segment
+        :type name: str
+        """
+        self._clear_predict_cache()
+        attach_model(self, name)
+        self._fit_delta = None
 
     def isempty(self):
         """Check if current state does not contain any information"""
         return not self._wforms
 
-    def parse(self, corpus, format='conllu', append=False, log_file=LOG_FILE):
+    _COUNTS_DEPTHS = [('_wform_tag_cnts', 3), ('_wform_feat_cnts', 5),
+                      ('_lemma_tag_cnts', 2), ('_lemma_feat_cnts', 4)]
+
+    def compact(self):
+        """Convert the counters extracted from corpora to the compact
+        read-only form. That reduces memory consumption and the size of
+        backups in several times. The results of ``.fit()`` and predictions
+        don't change. If ``.parse()`` will be called afterwards, the counters
+        are unpacked back."""
+        for attr, depth in self._COUNTS_DEPTHS:
+            counts = getattr(self, attr)
+            if not isinstance(counts, PackedCounts):
+                setattr(self, attr, PackedCounts(counts, depth))
+
+    def iscompact(self):
+        """Check if the counters are in the compact form"""
+        return isinstance(self._wform_tag_cnts, PackedCounts)
+
+    def _unpack(self):
+        for attr, attr_id in [('_wforms', '_wforms_id'),
+                              ('_lemmata', '_lemmata_id')]:
+            vals = getattr(self, attr)
+            if not isinstance(vals, list):  # loaded from the model
+                vals = list(vals)
+                setattr(self, attr, vals)
+                setattr(self, attr_id, {x: i for i, x in enumerate(vals)})
+        for attr, _ in self._COUNTS_DEPTHS:
+            counts = getattr(self, attr)
+            if isinstance(counts, PackedCounts):
+                setattr(self, attr, counts.unpack())
+
+    def parse(self, corpus, format='conllu', append=False, workers=1,
+              log_file=LOG_FILE):
         """Extract useful information from a *corpus* given.
 
         :param corpus: path to file in known format or list of already parsed
@@ -165,6 +383,11 @@ class CorpusDict:
         :param append: if False then method will throw exception if current
                        state is not empty
         :type append: bool
+        :param workers: number of worker processes. If 1 (default), the
+                        corpus is processed in the current process. If None,
+                        the number of CPUs is used. The result doesn't depend
+                        on the number of workers
+        :type workers: int
         :param log_file: stream for info messages
         :type file
         """
@@ -172,10 +395,17 @@ class CorpusDict:
             'empty. Use append=True to append next corpus'
         assert format in ['conllu', 'conllu_parsed'], \
             "Error: Invalid format '{}'".format(format)
+        self._unpack()
+        self._clear_predict_cache()
+        if self._fit_thresholds is not None and not self.isempty():
+            # the results of the last fit will be updated incrementally
+            self._fit_delta = self._new_fit_delta()
+        self._fit_thresholds = None
         if isinstance(corpus, type) and issubclass(corpus,
                                                    _AbstractCorpus):
             corpus = corpus.train()
-        elif format == 'conllu':
+        elif format == 'conllu' and (workers == 1
+                                  or not isinstance(corpus, str)):
             corpus = Conllu.load(corpus, log_file=None)
         corpus_len = None if format == 'conllu' else \
                      len(corpus) if isinstance(corpus, list) else \
@@ -186,6 +416,61 @@ class CorpusDict:
 
         if log_file:
             print('Parse corpus', file=log_file)
+        if workers == 1 and self._fit_delta is None:
+            nsent, ntoken, nyo = self._parse_sentences(
+                corpus, corpus_len=corpus_len, progress_step=progress_step,
+                progress_check_step=progress_check_step, log_file=log_file
+            )
+        elif workers == 1:
+            # the corpus is parsed apart to collect the changes of the
+            # counters for the incremental fit
+            cdict = CorpusDict()
+            nsent, ntoken, nyo = self._merge_partial(cdict._get_partial(
+                cdict._parse_sentences(
+                    corpus, corpus_len=corpus_len,
+                    progress_step=progress_step,
+                    progress_check_step=progress_check_step,
+                    log_file=log_file
+                )
+            ))
+        else:
+            if isinstance(corpus, str):
+                columns = get_columns(corpus)
+                shards = [(corpus, start, end, columns)
+                              for start, end in get_shard_bounds(corpus)]
+            else:
+                corpus = iter(corpus)
+                shards = iter(lambda: list(islice(corpus, PARSE_CHUNK_SIZE)),
+                              [])
+            nsent = ntoken = nyo = 0
+            with Pool(processes=workers) as pool:
+                for partial in pool.imap(_parse_shard, shards):
+                    nsent_, ntoken_, nyo_ = self._merge_partial(partial)
+                    nsent += nsent_
+                    ntoken += ntoken_
+                    nyo += nyo_
+                    if log_file:
+                        print_progress(nsent, end_value=None,
+                                       step=progress_step, file=log_file)
+
+        if log_file:
+            print_progress(nsent,
+                           end_value=corpus_len if corpus_len else 0,
+                           step=progress_step, file=log_file)
+            print(('done: {} sentences, {} acceptable tokens '
+                   '(plus {} for YO letters)')
+                      .format(nsent, ntoken, nyo),
+                  file=log_file)
+
+    def _parse_sentences(self, corpus, corpus_len=None, progress_step=1000,
+                         progress_check_step=100, log_file=None):
+        """Extract information from sentences of a *corpus* in Parsed CoNLL-U
+        format.
+
+        :return: numbers of sentences, acceptable tokens and tokens added
+                 for YO letters
+        :rtype: tuple(int, int, int)
+        """
         ntoken = 0
         nyo = 0
         sent_no = -1
@@ -295,17 +580,140 @@ class CorpusDict:
                                 vals.append(val)
                                 vals_id[val] = val_id
 
-        if log_file:
-            sent_no += 1
-            print_progress(sent_no,
-                           end_value=corpus_len if corpus_len else 0,
-                           step=progress_step, file=log_file)
-            print(('done: {} sentences, {} acceptable tokens '
-                   '(plus {} for YO letters)')
-                      .format(sent_no, ntoken, nyo),
-                  file=log_file)
-
-    def fit(self, cnt_thresh=None, ambiguity_thresh=None, log_file=LOG_FILE):
+        return sent_no + 1, ntoken, nyo
+
+    def _get_partial(self, counters):
+        """Return the information extracted from a corpus in the form that
+        ``._merge_partial()`` accepts"""
+        return (self._wforms, self._lemmata, self._tags, self._feats,
+                self._feat_vals, self._feat_vals_id,
+                self._wform_tag_cnts, self._wform_feat_cnts,
+                self._lemma_tag_cnts, self._lemma_feat_cnts, counters)
+
+    def _new_fit_delta(self):
+        """Return an empty record of the changes of the counters since the
+        last fit"""
+        return {
+            'thresholds': self._fit_thresholds,
+            'wforms': set(),      # set(wform_id) with changed counts
+            'lemmata': set(),     # set(lemma_id) with changed counts
+            'triples': [],        # [(wform_id, tag_id, lemma_id)] added
+            'lemma_tags': [],     # [(lemma_id, tag_id)] added
+            'tag_cnts': {},       # {tag_id: cnt} added
+            'feat_cnts': {}       # {tag_id: {feat_id: {val_id: cnt}}} added
+        }
+
+    def _merge_partial(self, partial):
+        """Add the information extracted from a shard of a corpus by
+        ``_parse_shard()``. The local ids of the shard are converted to the
+        ids of the current state; new values get ids in the same order as
+        if the shard was parsed by the ``.parse()`` directly.
+
+        :return: numbers of sentences, acceptable tokens and tokens added
+                 for YO letters in the shard
+        :rtype: tuple(int, int, int)
+        """
+        (wforms, lemmata, tags, feats, feat_vals, feat_vals_id,
+         wform_tag_cnts, wform_feat_cnts, lemma_tag_cnts, lemma_feat_cnts,
+         counters) = partial
+
+        def get_ids(vals, all_vals, all_vals_id):
+            ids = []
+            for val in vals:
+                id_ = all_vals_id.get(val)
+                if id_ is None:
+                    id_ = all_vals_id[val] = len(all_vals)
+                    all_vals.append(val)
+                ids.append(id_)
+            return ids
+
+        wform_ids = get_ids(wforms, self._wforms, self._wforms_id)
+        lemma_ids = get_ids(lemmata, self._lemmata, self._lemmata_id)
+        tag_ids = get_ids(tags, self._tags, self._tags_id)
+        feat_ids, val_ids = [], []
+        for feat, vals, vals_id in zip(feats, feat_vals, feat_vals_id):
+            feat_id = self._feats_id.get(feat)
+            if feat_id is None:
+                feat_id = self._feats_id[feat] = len(self._feats)
+                self._feats.append(feat)
+                self._feat_vals.append(vals[:])
+                self._feat_vals_id.append(vals_id.copy())
+                val_ids.append(list(range(len(vals))))
+            else:
+                val_ids.append(get_ids(vals, self._feat_vals[feat_id],
+                                       self._feat_vals_id[feat_id]))
+            feat_ids.append(feat_id)
+
+        delta = self._fit_delta
+        if delta is not None:
+            delta['wforms'].update(wform_ids[x] for x in wform_tag_cnts)
+            delta['lemmata'].update(lemma_ids[x] for x in lemma_tag_cnts)
+            for wform_id, tags_ in wform_tag_cnts.items():
+                wform_id = wform_ids[wform_id]
+                tags = self._wform_tag_cnts.get(wform_id, {})
+                for tag_id, lemmata_ in tags_.items():
+                    tag_id = tag_ids[tag_id]
+                    lemmata = tags.get(tag_id, {})
+                    cnts = delta['tag_cnts']
+                    for lemma_id, cnt in lemmata_.items():
+                        lemma_id = lemma_ids[lemma_id]
+                        if lemma_id not in lemmata:
+                            delta['triples'].append((wform_id, tag_id,
+                                                     lemma_id))
+                        cnts[tag_id] = cnts.get(tag_id, 0) + cnt
+            for lemma_id, tags_ in lemma_tag_cnts.items():
+                lemma_id = lemma_ids[lemma_id]
+                tags = self._lemma_tag_cnts.get(lemma_id, {})
+                delta['lemma_tags'].extend(
+                    (lemma_id, x) for x in (tag_ids[x] for x in tags_)
+                                      if x not in tags
+                )
+            for tags_ in wform_feat_cnts.values():
+                for tag_id, lemmata_ in tags_.items():
+                    feats = delta['feat_cnts'].setdefault(tag_ids[tag_id], {})
+                    for feats_ in lemmata_.values():
+                        for feat_id, vals_ in feats_.items():
+                            val_ids_ = val_ids[feat_id]
+                            vals = feats.setdefault(feat_ids[feat_id], {})
+                            for val_id, cnt in vals_.items():
+                                val_id = val_ids_[val_id]
+                                vals[val_id] = vals.get(val_id, 0) + cnt
+
+        def add_feat_cnts(cnts, cnts_):
+            for feat_id, vals_ in cnts_.items():
+                val_ids_ = val_ids[feat_id]
+                vals = cnts.setdefault(feat_ids[feat_id], {})
+                for val_id, cnt in vals_.items():
+                    val_id = val_ids_[val_id]
+                    vals[val_id] = vals.get(val_id, 0) + cnt
+
+        for wform_id, tags_ in wform_tag_cnts.items():
+            tags = self._wform_tag_cnts.setdefault(wform_ids[wform_id], {})
+            for tag_id, lemmata_ in tags_.items():
+                lemmata = tags.setdefault(tag_ids[tag_id], {})
+                for lemma_id, cnt in lemmata_.items():
+                    lemma_id = lemma_ids[lemma_id]
+                    lemmata[lemma_id] = lemmata.get(lemma_id, 0) + cnt
+        for wform_id, tags_ in wform_feat_cnts.items():
+            tags = self._wform_feat_cnts.setdefault(wform_ids[wform_id], {})
+            for tag_id, lemmata_ in tags_.items():
+                lemmata = tags.setdefault(tag_ids[tag_id], {})
+                for lemma_id, feats_ in lemmata_.items():
+                    add_feat_cnts(lemmata.setdefault(lemma_ids[lemma_id], {}),
+                                  feats_)
+        for lemma_id, tags_ in lemma_tag_cnts.items():
+            tags = self._lemma_tag_cnts.setdefault(lemma_ids[lemma_id], {})
+            for tag_id, cnt in tags_.items():
+                tag_id = tag_ids[tag_id]
+                tags[tag_id] = tags.get(tag_id, 0) + cnt
+        for lemma_id, tags_ in lemma_feat_cnts.items():
+            tags = self._lemma_feat_cnts.setdefault(lemma_ids[lemma_id], {})
+            for tag_id, feats_ in tags_.items():
+                add_feat_cnts(tags.setdefault(tag_ids[tag_id], {}), feats_)
+        return counters
+
+    def fit(self, cnt_thresh=None, ambiguity_thresh=None, use_numpy=None,
+            log_file=LOG_FILE):
         """Gather additional statictics from corups information.
 
         :type cnt_thresh: int
@@ -314,6 +722,15 @@ class CorpusDict:
         was tagged by the same label at least in (*ambiguity_thresh* * 100)%
         cases, then that label will mark as trusted for that wform.
 
+        If the corpora were added by ``.parse(append=True)`` after the last
+        fit with the same thresholds, only the statistics of the wforms and
+        lemmata met in those corpora are recounted.
+
+        :param use_numpy: if True, the statistics of tags and feats are
+                          counted with numpy. That is faster for big corpora
+                          and gives the same result. If None (default),
+                          numpy is used if it's installed
+        :type use_numpy: bool
         :param log_file: stream for info messages
         :type file
         """
@@ -326,74 +743,73 @@ class CorpusDict:
         else:
             self._ambiguity_thresh = ambiguity_thresh
 
+        if use_numpy is None:
+            use_numpy = fit_counts_numpy is not None
+        else:
+            assert not use_numpy or fit_counts_numpy is not None, \
+                'ERROR: numpy is not installed'
+
         if log_file:
             print('Fit corpus dict...', end=' ', file=log_file)
             log_file.flush()
 
-        tag_id_cnts = {}
-        total_cnt = 0
+        self._clear_predict_cache()
+        delta, self._fit_delta = self._fit_delta, None
+        if delta is not None \
+       and delta['thresholds'] == (cnt_thresh, ambiguity_thresh):
+            self._fit_update(delta, cnt_thresh, ambiguity_thresh)
+        else:
+            self._fit_all(cnt_thresh, ambiguity_thresh, use_numpy=use_numpy)
 
-        self._most_probable_tags = {}
-        for wform_id, item in self._wform_tag_cnts.items():
-            tag_cnts = {x: sum(y.values()) for x, y in item.items()}
-            for tag_id, cnt in tag_cnts.items():
-                tag_id_cnts[tag_id] = tag_id_cnts.get(tag_id, 0) + cnt
-                total_cnt += cnt
-            tag_id, cnt = max(tag_cnts.items(), key=itemgetter(1))
-            n = sum(tag_cnts.values())
-            # Don't add rare wforms to the tag dictionary
-            # Only add quite unambiguous wforms
-            if n >= cnt_thresh and cnt / n >= ambiguity_thresh:
-                self._most_probable_tags[wform_id] = tag_id
+        self._fit_thresholds = (cnt_thresh, ambiguity_thresh)
 
-        self._tags_freq = [(self._tags[x], y, y / total_cnt)
-                               for x, y in tag_id_cnts.items()]
-        self._tags_freq.sort(key=lambda x: (x[1], x[0]), reverse=True)
-        #self._most_common_tag = self._tags[
-        #    max(tag_id_cnts.keys(), key=lambda x: (tag_id_cnts[x], x))
-        #]
-        if self._tags_freq:
-            self._most_common_tag = self._tags_freq[0][0] 
+        if log_file:
+            print('done.', file=log_file)
+
+    def _fit_all(self, cnt_thresh, ambiguity_thresh, use_numpy=False):
+        """Count all the results of ``.fit()`` from scratch"""
+        tag_id_cnts, feat_val_id_cnts = \
+            fit_counts_numpy(self, cnt_thresh, ambiguity_thresh) \
+                if use_numpy else \
+            self._fit_counts(cnt_thresh, ambiguity_thresh)
 
-        self._common_endings = eds = {}
+        self._wform_title_tags_top = {}
+        self._fit_title_tags()
+
+        eds = {}
         for wform_id, item in self._wform_tag_cnts.items():
             for tag_id, item in item.items():
-                for lemma_id, cnt in item.items():
-                    wform = self._wforms[wform_id]
-                    lemma = self._lemmata[lemma_id]
-                    if wform.isalpha() and lemma.isalpha():
-                        wop, wcp, wed, lop, lcp, led = \
-                            find_affixes(wform, lemma, lower=True)
-                        if wcp and wop == lop:
-                            for i in range(len(wcp) + 1):
-                                wed_ = wcp[i:] + wed
-                                led_ = lcp[i:] + led
-                                eds[tag_id][wed_][led_] = \
-                                    eds.setdefault(tag_id, {}) \
-                                       .setdefault(wed_, {}) \
-                                       .get(led_, 0) + 1
-        for _, items in eds.items():
-            for wed, led_cnts in items.items():
-                items[wed] = sorted(led_cnts.items(),
-                                    # x[0] for stability
-                                    key=lambda x: (x[1], x[0]), reverse=True)
+                for lemma_id in item:
+                    self._add_endings(eds, wform_id, tag_id, lemma_id)
+        self._common_endings = {}
+        self._fit_endings(eds)
 
         # _capitalized_tags: Tags with mostly capitalized wforms
-        tag_lower_cnts, tag_upper_cnts = {}, {}
-        for lemma_id, tag_cnts in self._lemma_tag_cnts.items():
-            lemma = self._lemmata[lemma_id]
-            if lemma.isalpha():
-                islower = lemma.islower()
-                for tag_id, cnt in tag_cnts.items():
-                    if islower:
-                        tag_lower_cnts[tag_id] = \
-                            tag_lower_cnts.get(tag_id, 0) + 1
-                    else:
-                        tag_upper_cnts[tag_id] = \
-                            tag_upper_cnts.get(tag_id, 0) + 1
-        self._capitalized_tags = set(
-            x for x in range(len(self._tags))
-                if tag_upper_cnts.get(x, 0) > tag_lower_cnts.get(x, 0))
+        self._tag_case_cnts = [(0, 0)] * len(self._tags)
+        self._fit_capitalized_tags(
+            (x, y) for x, y in self._lemma_tag_cnts.items() for y in y
+        )
+
+        self._fit_freqs(tag_id_cnts, feat_val_id_cnts)
+
+    def _fit_counts(self, cnt_thresh, ambiguity_thresh):
+        """Count the statistics of tags and feats from scratch. The numpy
+        version of the method is ``corpus_dict_numpy.fit_counts()``
+
+        :return: the counts of tags and the counts of feat values for every
+                 tag
+        :rtype: tuple(dict(int: int), list(dict(int: dict(int: int))))
+        """
+        tag_id_cnts = {}
+
+        self._most_probable_tags = {}
+        self._wform_tags_top = {}
+        self._wform_tag_lemmata_top = {}
+        for wform_id in self._wform_tag_cnts:
+            tag_cnts = self._fit_wform_tags(wform_id, cnt_thresh,
+                                            ambiguity_thresh)
+            for tag_id, cnt in tag_cnts.items():
+                tag_id_cnts[tag_id] = tag_id_cnts.get(tag_id, 0) + cnt
 
         tag_feats = self._tag_feats = [set() for _ in range(len(self._tags))]
         feat_val_id_cnts            = [{}    for _ in range(len(self._tags))]
@@ -408,6 +824,183 @@ class CorpusDict:
                                                                     {}) \
                                                         .get(val_id, 0) + cnt
 
+        self._most_probable_wform_feats = {}
+        for wform_id in self._wform_feat_cnts:
+            self._fit_wform_feats(wform_id, cnt_thresh, ambiguity_thresh)
+
+        self._most_probable_lemma_feats = {}
+        for lemma_id in self._lemma_feat_cnts:
+            self._fit_lemma_feats(lemma_id, cnt_thresh, ambiguity_thresh)
+
+        return tag_id_cnts, feat_val_id_cnts
+
+    def _fit_update(self, delta, cnt_thresh, ambiguity_thresh):
+        """Update the results of the last ``.fit()`` with the changes of the
+        counters collected by ``.parse()`` in *delta*"""
+        for attr in ['_most_probable_tags', '_wform_tags_top',
+                     '_wform_title_tags_top', '_wform_tag_lemmata_top',
+                     '_most_probable_wform_feats',
+                     '_most_probable_lemma_feats']:
+            table = getattr(self, attr)
+            if isinstance(table, PackedCounts):  # loaded from the model
+                setattr(self, attr, table.unpack())
+        wform_ids, lemma_ids = delta['wforms'], delta['lemmata']
+
+        for wform_id in wform_ids:
+            self._fit_wform_tags(wform_id, cnt_thresh, ambiguity_thresh)
+        self._fit_title_tags(wform_ids)
+
+        eds = {}
+        for wform_id, tag_id, lemma_id in delta['triples']:
+            self._add_endings(eds, wform_id, tag_id, lemma_id)
+        self._fit_endings(eds)
+
+        num_tags = len(self._tags)
+        self._tag_case_cnts += \
+            [(0, 0)] * (num_tags - len(self._tag_case_cnts))
+        self._fit_capitalized_tags(delta['lemma_tags'])
+
+        tag_feats = self._tag_feats
+        tag_feats += [set() for _ in range(num_tags - len(tag_feats))]
+        tag_id_cnts = {self._tags_id[x]: y for x, y, _ in self._tags_freq}
+        for tag_id, cnt in delta['tag_cnts'].items():
+            tag_id_cnts[tag_id] = tag_id_cnts.get(tag_id, 0) + cnt
+        feat_val_id_cnts = [{} for _ in range(num_tags)]
+        for tag, item in self._feat_vals_freq.items():
+            val_id_cnts = feat_val_id_cnts[self._tags_id[tag]]
+            for feat, vals_freq in item.items():
+                feat_id = self._feats_id[feat]
+                vals_id = self._feat_vals_id[feat_id]
+                val_id_cnts[feat_id] = {vals_id[x]: y for x, y, _ in vals_freq}
+        new_tags = set()  # tags with new feats
+        for tag_id, item in delta['feat_cnts'].items():
+            if not tag_feats[tag_id].issuperset(item):
+                tag_feats[tag_id].update(item)
+                new_tags.add(tag_id)
+            for feat_id, item in item.items():
+                val_cnts = feat_val_id_cnts[tag_id].setdefault(feat_id, {})
+                for val_id, cnt in item.items():
+                    val_cnts[val_id] = val_cnts.get(val_id, 0) + cnt
+        self._fit_freqs(tag_id_cnts, feat_val_id_cnts)
+
+        # new feats of a tag change the statistics of all wforms and lemmata
+        # of that tag
+        if new_tags:
+            wform_ids = wform_ids.union(
+                x for x, y in self._wform_feat_cnts.items()
+                      if not new_tags.isdisjoint(y)
+            )
+            lemma_ids = lemma_ids.union(
+                x for x, y in self._lemma_feat_cnts.items()
+                      if not new_tags.isdisjoint(y)
+            )
+        for wform_id in wform_ids:
+            self._fit_wform_feats(wform_id, cnt_thresh, ambiguity_thresh)
+        for lemma_id in lemma_ids:
+            self._fit_lemma_feats(lemma_id, cnt_thresh, ambiguity_thresh)
+
+    def _fit_wform_tags(self, wform_id, cnt_thresh, ambiguity_thresh):
+        """Count the best tags and lemmata of the wform *wform_id*
+
+        :return: counts of the tags of the wform
+        :rtype: dict(int: int)
+        """
+        item = self._wform_tag_cnts[wform_id]
+        self._wform_tag_lemmata_top[wform_id] = \
+            {x: self._get_top(y) for x, y in item.items()}
+        tag_cnts = {x: sum(y.values()) for x, y in item.items()}
+        self._wform_tags_top[wform_id] = self._get_top(tag_cnts)
+        tag_id, cnt = max(tag_cnts.items(), key=itemgetter(1))
+        n = sum(tag_cnts.values())
+        # Don't add rare wforms to the tag dictionary
+        # Only add quite unambiguous wforms
+        if n >= cnt_thresh and cnt / n >= ambiguity_thresh:
+            self._most_probable_tags[wform_id] = tag_id
+        else:
+            self._most_probable_tags.pop(wform_id, None)
+        return tag_cnts
+
+    def _fit_title_tags(self, wform_ids=None):
+        """Count the best tags of title wforms merged with their lower forms.
+        If *wform_ids* is specified, only the title wforms that are in
+        *wform_ids* or whose lower forms are in *wform_ids* are counted"""
+        if wform_ids is not None:
+            lower_wforms = set(self._wforms[x] for x in wform_ids)
+        for wform_id, wform in enumerate(self._wforms):
+            if wform.istitle():
+                wform_ = wform.lower()
+                if wform_ids is not None and wform_id not in wform_ids \
+                                         and wform_ not in lower_wforms:
+                    continue
+                wform_id2 = self._wforms_id.get(wform_)
+                if wform_id2 is not None:
+                    self._wform_title_tags_top[wform_id] = \
+                        self._get_tags_top(wform_id, wform_id2, cached=False)
+
+    def _add_endings(self, eds, wform_id, tag_id, lemma_id):
+        """Add the endings of the wform and the lemma to *eds*
+        {tag_id: {wform_ed: {lemma_ed: cnt}}}"""
+        wform = self._wforms[wform_id]
+        lemma = self._lemmata[lemma_id]
+        if wform.isalpha() and lemma.isalpha():
+            wop, wcp, wed, lop, lcp, led = \
+                find_affixes(wform, lemma, lower=True)
+            if wcp and wop == lop:
+                for i in range(len(wcp) + 1):
+                    wed_ = wcp[i:] + wed
+                    led_ = lcp[i:] + led
+                    eds[tag_id][wed_][led_] = \
+                        eds.setdefault(tag_id, {}) \
+                           .setdefault(wed_, {}) \
+                           .get(led_, 0) + 1
+
+    def _fit_endings(self, eds):
+        """Add the endings *eds* {tag_id: {wform_ed: {lemma_ed: cnt}}} to
+        ``._common_endings``"""
+        for tag_id, items in eds.items():
+            endings = self._common_endings.get(tag_id)
+            for wed, led_cnts in items.items():
+                if endings is not None:
+                    for led, cnt in endings.get(wed, []):
+                        led_cnts[led] = led_cnts.get(led, 0) + cnt
+                items[wed] = sorted(led_cnts.items(),
+                                    # x[0] for stability
+                                    key=lambda x: (x[1], x[0]), reverse=True)
+            if endings is None:
+                self._common_endings[tag_id] = SuffixTrie(items)
+            else:
+                endings._update(items)
+
+    def _fit_capitalized_tags(self, lemma_tags):
+        """Add the pairs (lemma_id, tag_id) *lemma_tags* to the counts of
+        lowercase and capitalized lemmata and recount
+        ``._capitalized_tags``"""
+        tag_case_cnts = self._tag_case_cnts
+        for lemma_id, tag_id in lemma_tags:
+            lemma = self._lemmata[lemma_id]
+            if lemma.isalpha():
+                lower_cnt, upper_cnt = tag_case_cnts[tag_id]
+                tag_case_cnts[tag_id] = (lower_cnt + 1, upper_cnt) \
+                                            if lemma.islower() else \
+                                        (lower_cnt, upper_cnt + 1)
+        self._capitalized_tags = set(
+            i for i, (x, y) in enumerate(tag_case_cnts) if y > x
+        )
+
+    def _fit_freqs(self, tag_id_cnts, feat_val_id_cnts):
+        """Count the frequencies of tags, feats and feat values by their
+        counts *tag_id_cnts* {tag_id: cnt} and *feat_val_id_cnts*
+        [{feat_id: {val_id: cnt}}]"""
+        total_cnt = sum(tag_id_cnts.values())
+        self._tags_freq = [(self._tags[x], y, y / total_cnt)
+                               for x, y in tag_id_cnts.items()]
+        self._tags_freq.sort(key=lambda x: (x[1], x[0]), reverse=True)
+        #self._most_common_tag = self._tags[
+        #    max(tag_id_cnts.keys(), key=lambda x: (tag_id_cnts[x], x))
+        #]
+        if self._tags_freq:
+            self._most_common_tag = self._tags_freq[0][0] 
+
         for tag_id, item in enumerate(feat_val_id_cnts):
             tag = self._tags[tag_id]
             total_cnt = sum(x for x in item.values() for x in x.values())
@@ -425,57 +1018,19 @@ class CorpusDict:
                 feat_vals_freq.sort(key=lambda x: (x[1], x[0]), reverse=True)
             feats_freq.sort(key=lambda x: (x[1], x[0]), reverse=True)
 
-        self._most_probable_wform_feats = {}
-        wtl_cnts = self._wform_tag_cnts
-            # {wform_id: {tag_id: {lemma_id: cnt}}}
-        for wform_id, item in self._wform_feat_cnts.items():  # {wform_id:
-                         # {tag_id: {lemma_id: {feat_id: {val_id: cnt}}}}}
-            tl_cnts = wtl_cnts[wform_id]  # {tag_id: {lemma_id: cnt}}
-            feat_cnts = {}
-            for tag_id, item in item.items():  # {tag_id:
-                  # {lemma_id: {feat_id: {val_id: cnt}}}}
-                l_cnts = tl_cnts[tag_id]  # {lemma_id: cnt}
-                for lemma_id, item in item.items():  # {lemma_id: 
-                                      # {feat_id: {val_id: cnt}}}
-                    all_feats = set(tag_feats[tag_id])
-                    _cnts = l_cnts[lemma_id]  # cnt
-                    for feat_id, item in item.items():  # {feat_id: 
-                                                   # {val_id: cnt}}
-                        cnts = 0
-                        all_feats.remove(feat_id)
-                        for val_id, cnt in item.items():  # {val_id: cnt}
-                            cnts += cnt
-                            feat_cnts[feat_id][val_id] = \
-                                feat_cnts.setdefault(feat_id, {}) \
-                                         .get(val_id, 0) + cnt
-                        if _cnts > cnts:
-                            feat_cnts[feat_id][0] = \
-                                feat_cnts.setdefault(feat_id, {}) \
-                                         .get(0, 0) + _cnts - cnts
-                    for feat_id in all_feats:
-                        feat_cnts[feat_id][0] = \
-                            feat_cnts.setdefault(feat_id, {}) \
-                                     .get(0, 0) + _cnts
-            for feat_id, val_cnts in feat_cnts.items():
-                val_id, cnt = max(val_cnts.items(), key=itemgetter(1))
-                n = sum(val_cnts.values())
-                # Don't add rare wforms to the feat dictionary
-                # Only add quite unambiguous wforms
-                if n >= cnt_thresh and cnt / n >= ambiguity_thresh:
-                    self._most_probable_wform_feats \
-                        .setdefault(wform_id, {})[feat_id] = val_id
-
-        self._most_probable_lemma_feats = {}
-        lt_cnts = self._lemma_tag_cnts
-            # {lemma_id: {tag_id: cnt}}
-        for lemma_id, item in self._lemma_feat_cnts.items():  # {lemma_id:
-                                     # {tag_id: {feat_id: {val_id: cnt}}}}
-            t_cnts = lt_cnts[lemma_id]  # {tag_id: cnt}
-            feat_cnts = {}
-            for tag_id, item in item.items():  # {tag_id:
-                              # {feat_id: {val_id: cnt}}}
+    def _fit_wform_feats(self, wform_id, cnt_thresh, ambiguity_thresh):
+        """Count the trusted feat values of the wform *wform_id*"""
+        tag_feats = self._tag_feats
+        tl_cnts = self._wform_tag_cnts[wform_id]
+            # {tag_id: {lemma_id: cnt}}
+        feat_cnts = {}
+        for tag_id, item in self._wform_feat_cnts[wform_id].items():
+              # {tag_id: {lemma_id: {feat_id: {val_id: cnt}}}}
+            l_cnts = tl_cnts[tag_id]  # {lemma_id: cnt}
+            for lemma_id, item in item.items():  # {lemma_id: 
+                                  # {feat_id: {val_id: cnt}}}
                 all_feats = set(tag_feats[tag_id])
-                _cnts = t_cnts[tag_id]  # cnt
+                _cnts = l_cnts[lemma_id]  # cnt
                 for feat_id, item in item.items():  # {feat_id: 
                                                # {val_id: cnt}}
                     cnts = 0
@@ -493,17 +1048,51 @@ class CorpusDict:
                     feat_cnts[feat_id][0] = \
                         feat_cnts.setdefault(feat_id, {}) \
                                  .get(0, 0) + _cnts
-            for feat_id, val_cnts in feat_cnts.items():
-                val_id, cnt = max(val_cnts.items(), key=itemgetter(1))
-                n = sum(val_cnts.values())
-                # Don't add rare lemmata to the feat dictionary
-                # Only add quite unambiguous lemmata
-                if n >= cnt_thresh and cnt / n >= ambiguity_thresh:
-                    self._most_probable_lemma_feats \
-                        .setdefault(lemma_id, {})[feat_id] = val_id
-
-        if log_file:
-            print('done.', file=log_file)
+        self._most_probable_wform_feats.pop(wform_id, None)
+        for feat_id, val_cnts in feat_cnts.items():
+            val_id, cnt = max(val_cnts.items(), key=itemgetter(1))
+            n = sum(val_cnts.values())
+            # Don't add rare wforms to the feat dictionary
+            # Only add quite unambiguous wforms
+            if n >= cnt_thresh and cnt / n >= ambiguity_thresh:
+                self._most_probable_wform_feats \
+                    .setdefault(wform_id, {})[feat_id] = val_id
+
+    def _fit_lemma_feats(self, lemma_id, cnt_thresh, ambiguity_thresh):
+        """Count the trusted feat values of the lemma *lemma_id*"""
+        tag_feats = self._tag_feats
+        t_cnts = self._lemma_tag_cnts[lemma_id]  # {tag_id: cnt}
+        feat_cnts = {}
+        for tag_id, item in self._lemma_feat_cnts[lemma_id].items():
+                          # {tag_id: {feat_id: {val_id: cnt}}}
+            all_feats = set(tag_feats[tag_id])
+            _cnts = t_cnts[tag_id]  # cnt
+            for feat_id, item in item.items():  # {feat_id: 
+                                           # {val_id: cnt}}
+                cnts = 0
+                all_feats.remove(feat_id)
+                for val_id, cnt in item.items():  # {val_id: cnt}
+                    cnts += cnt
+                    feat_cnts[feat_id][val_id] = \
+                        feat_cnts.setdefault(feat_id, {}) \
+                                 .get(val_id, 0) + cnt
+                if _cnts > cnts:
+                    feat_cnts[feat_id][0] = \
+                        feat_cnts.setdefault(feat_id, {}) \
+                                 .get(0, 0) + _cnts - cnts
+            for feat_id in all_feats:
+                feat_cnts[feat_id][0] = \
+                    feat_cnts.setdefault(feat_id, {}) \
+                             .get(0, 0) + _cnts
+        self._most_probable_lemma_feats.pop(lemma_id, None)
+        for feat_id, val_cnts in feat_cnts.items():
+            val_id, cnt = max(val_cnts.items(), key=itemgetter(1))
+            n = sum(val_cnts.values())
+            # Don't add rare lemmata to the feat dictionary
+            # Only add quite unambiguous lemmata
+            if n >= cnt_thresh and cnt / n >= ambiguity_thresh:
+                self._most_probable_lemma_feats \
+                    .setdefault(lemma_id, {})[feat_id] = val_id
 
     def get_tags(self):
         """Return a set of all known tag labels.
@@ -578,6 +1167,73 @@ class CorpusDict:
         """Return most common tag for the whole corpus"""
         return self._most_common_tag
 
+    @staticmethod
+    def _get_top(cnts):
+        """Return the key of *cnts* with the max (count, key), its count and
+        the max count of other keys
+
+        :type cnts: dict(int: int)
+        :rtype: tuple(int, int, int)
+        """
+        # x[0] for stability
+        key, cnt = max(cnts.items(), key=lambda x: (x[1], x[0]))
+        return key, cnt, max((y for x, y in cnts.items() if x != key),
+                             default=0)
+
+    def _get_tags_top(self, wform_id, wform_id2=None, cached=True):
+        """Return the best tag for the wform (merged with the wform
+        *wform_id2*, if specified), its count and the count of the runner-up.
+        If *cached* is True, the tables made by ``.fit()`` are used when
+        they are up to date"""
+        if cached and self._fit_thresholds is not None:
+            res = (self._wform_tags_top if wform_id2 is None else
+                   self._wform_title_tags_top).get(wform_id)
+            if res is not None:
+                return res
+        tag_cnts = {x: sum(y.values())
+                        for x, y in self._wform_tag_cnts[wform_id].items()}
+        if wform_id2 is not None:
+            for x, y in self._wform_tag_cnts[wform_id2].items():
+                tag_cnts[x] = tag_cnts.get(x, 0) + sum(y.values())
+        return self._get_top(tag_cnts)
+
+    def _get_lemmata_top(self, wform_id, tag_id):
+        """Return the best lemma for the wform and tag, its count and the
+        count of the runner-up, or None if the wform has no such tag"""
+        res = None if self._fit_thresholds is None else \
+              self._wform_tag_lemmata_top.get(wform_id, {}).get(tag_id)
+        if res is None:
+            lemma_cnts = self._wform_tag_cnts[wform_id].get(tag_id)
+            if lemma_cnts:
+                res = self._get_top(lemma_cnts)
+        return res
+
+    def set_predict_cache(self, size=PREDICT_CACHE_SIZE):
+        """Set the size of the cache of the results of ``.predict_tag()``,
+        ``.predict_lemma()`` and ``.predict_feat()``. When the cache is full,
+        the least recently used results are dropped. The cache is cleared by
+        ``.parse()``, ``.fit()`` and ``.restore()``. Current content of the
+        cache and its statistics are reset.
+
+        :param size: max number of results in the cache. If 0 or None, the
+                     cache is disabled
+        :type size: int
+        """
+        self._predict_cache = _LRUCache(size) if size else None
+
+    def predict_cache_info(self):
+        """Return the statistics of the cache of predictions: the numbers of
+        hits, misses and evicted results, the current and the max size of the
+        cache. If the cache is disabled, return None
+
+        :rtype: dict(str: int)
+        """
+        return self._predict_cache.info() if self._predict_cache else None
+
+    def _clear_predict_cache(self):
+        if self._predict_cache:
+            self._predict_cache.clear()
+
     def predict_tag(self, wform, isfirst=False, cnt_thresh=None):
         """If the *wform* has a trusted tag, then return that tag with
         a relevance coef equals to 1. Elsewise, we choose the most common tag
@@ -598,7 +1254,18 @@ class CorpusDict:
         If the *wform* is not known then return (None, None)"""
         if cnt_thresh is None:
             cnt_thresh = self._cnt_thresh
+        cache = self._predict_cache
+        if cache is None:
+            return self._predict_tag(wform, isfirst, cnt_thresh)
+        key = 'tag', wform, isfirst, cnt_thresh
+        res = cache.get(key)
+        if res is None:
+            res = self._predict_tag(wform, isfirst, cnt_thresh)
+            cache.put(key, res)
+        return res
 
+    def _predict_tag(self, wform, isfirst, cnt_thresh):
+        """Implementation of ``.predict_tag()``"""
         tag, coef = None, None
         wform_id = self._wforms_id.get(wform)
         wform_id2 = None
@@ -612,21 +1279,7 @@ class CorpusDict:
                 if tag_id is not None:
                     tag, coef = self._tags[tag_id], 1.
             if tag is None:
-                tag_cnts = {
-                    x: sum(y.values())
-                        for x, y in self._wform_tag_cnts[wform_id].items()
-                }
-                if wform_id2 is not None:
-                    for x, y in [
-                        (x, sum(y.values()))
-                            for x, y in self._wform_tag_cnts[wform_id2].items()
-                    ]:
-                        tag_cnts[x] = tag_cnts.get(x, 0) + y
-                #n = sum(tag_cnts.values())
-                # x[0] for stability
-                tag_id, cnt = max(tag_cnts.items(), key=lambda x: (x[1], x[0]))
-                del tag_cnts[tag_id]
-                cnt2 = max(tag_cnts.values()) if tag_cnts else 0
+                tag_id, cnt, cnt2 = self._get_tags_top(wform_id, wform_id2)
                 tag = self._tags[tag_id]
                 coef = (cnt - cnt2) * min((cnt - cnt2) / cnt_thresh, 1.) / cnt
                 #if isfirst and self._wforms[wform_id].istitle():
@@ -655,30 +1308,37 @@ class CorpusDict:
 
         if cnt_thresh is None:
             cnt_thresh = self._cnt_thresh
+        cache = self._predict_cache
+        if cache is None:
+            return self._predict_lemma(wform, tag_id, cnt_thresh)
+        key = 'lemma', wform, tag_id, cnt_thresh  # isfirst doesn't matter
+        res = cache.get(key)
+        if res is None:
+            res = self._predict_lemma(wform, tag_id, cnt_thresh)
+            cache.put(key, res)
+        return res
 
+    def _predict_lemma(self, wform, tag_id, cnt_thresh):
+        """Implementation of ``.predict_lemma()``"""
         lemma, coef = None, None
         if wform.isalpha():
-            lemma_cnts = None
+            lemma_top = None
             wform_hascaps = not wform.islower()
 
             # Trying to find wform in a dict
             wform_id = self._wforms_id.get(wform)
             if wform_id is not None:
-                lemma_cnts = self._wform_tag_cnts[wform_id].get(tag_id)
-                if not lemma_cnts:
+                lemma_top = self._get_lemmata_top(wform_id, tag_id)
+                if not lemma_top:
                     wform_id = None
             if wform_id is None and wform_hascaps:
                 wform_id = self._wforms_id.get(wform.lower())
                 if wform_id is not None:
-                    lemma_cnts = self._wform_tag_cnts[wform_id].get(tag_id)
+                    lemma_top = self._get_lemmata_top(wform_id, tag_id)
 
             # Wform is in a dict, so lemma is in a dict, too
-            if lemma_cnts:
-                lemma_cnts = sorted(lemma_cnts.items(),
-                                    # x[0] for stability
-                                    key=lambda x: (x[1], x[0]), reverse=True)
-                lemma_id, cnt = lemma_cnts[0]
-                cnt2 = lemma_cnts[1][1] if len(lemma_cnts) > 1 else 0
+            if lemma_top:
+                lemma_id, cnt, cnt2 = lemma_top
                 lemma = self._lemmata[lemma_id]
                 # Strong sorcery. Don't think about it.
                 coef = (cnt - cnt2) * min((cnt - cnt2) / cnt_thresh, 1.) / cnt
@@ -692,51 +1352,51 @@ class CorpusDict:
                     # frequency and length. In addition, keep in mind the first
                     # generated lemma.
                     known_lemma = gen_lemma = None
-                    for i in range(len(wform)):
-                        # Check all known lemma endings for a given wform
-                        # ending
-                        eds_ = eds.get(wform[i:])
-                        if eds_:
-                            # eds_ - list of tuples sorted by frequency
+                    # Check all known lemma endings for all known wform
+                    # endings, from the longest one
+                    for i, eds_ in eds.find_all(wform):
+                        # eds_ - list of tuples sorted by frequency
+                        for ed, _ in eds_:
+                            lemma_ = wform[:i] + ed
+                            # If lemma is in a dict, we've found it.
+                            lemma_id = self._lemmata_id.get(lemma_)
+                            if lemma_id is not None \
+                           and self._lemma_tag_cnts[lemma_id].get(tag_id):
+                                known_lemma = lemma_
+                                break
+                            # Save the first generated lemma
+                            if not gen_lemma:
+                                gen_lemma = lemma_
+                        else:
+                            continue
+                        break
+                    # If known lemma has not found and wform is not lower, do
+                    # all the same for its lower form
+                    if not known_lemma and wform_hascaps:
+                        wform_lower = wform.lower()
+                        for i, eds_ in eds.find_all(wform_lower):
+                            # the lower form may be longer than the wform;
+                            # its endings shorter than that are not checked
+                            if i >= len(wform):
+                                break
                             for ed, _ in eds_:
-                                lemma_ = wform[:i] + ed
-                                # If lemma is in a dict, we've found it.
+                                lemma_ = wform_lower[:i] + ed
                                 lemma_id = self._lemmata_id.get(lemma_)
                                 if lemma_id is not None \
                                and self._lemma_tag_cnts[lemma_id].get(tag_id):
                                     known_lemma = lemma_
                                     break
-                                # Save the first generated lemma
                                 if not gen_lemma:
                                     gen_lemma = lemma_
+                                    ## Has no effect:
+                                    #gen_lemma = lemma_ \
+                                    #    if not isfirst \
+                                    #    or tag_id \
+                                    #        not in self._capitalized_tags \
+                                    #    else wform[:i] + ed
                             else:
                                 continue
                             break
-                    # If known lemma has not found and wform is not lower, do
-                    # all the same for its lower form
-                    if not known_lemma and wform_hascaps:
-                        wform_lower = wform.lower()
-                        for i in range(len(wform)):
-                            eds_ = eds.get(wform_lower[i:])
-                            if eds_:
-                                for ed, _ in eds_:
-                                    lemma_ = wform_lower[:i] + ed
-                                    lemma_id = self._lemmata_id.get(lemma_)
-                                    if lemma_id is not None \
-                                   and self._lemma_tag_cnts[lemma_id].get(tag_id):
-                                        known_lemma = lemma_
-                                        break
-                                    if not gen_lemma:
-                                        gen_lemma = lemma_
-                                        ## Has no effect:
-                                        #gen_lemma = lemma_ \
-                                        #    if not isfirst \
-                                        #    or tag_id \
-                                        #        not in self._capitalized_tags \
-                                        #    else wform[:i] + ed
-                                else:
-                                    continue
-                                break
                     if known_lemma:
                         lemma, coef = known_lemma, .9
                     elif gen_lemma:
@@ -769,18 +1429,32 @@ class CorpusDict:
 
         if cnt_thresh is None:
             cnt_thresh = self._cnt_thresh
+        cache = self._predict_cache
+        if cache is not None:
+            key = 'feat', feat_id, wform, lemma, tag_id, cnt_thresh
+            res = cache.get(key)
+            if res is not None:
+                return res
 
+        wform_id = self._wforms_id.get(wform)
+        if wform_id is None:
+            wform_id = self._wforms_id.get(wform.lower())
+        res = self._predict_feat(feat_id, tag_id, wform_id,
+                                 self._lemmata_id.get(lemma), cnt_thresh)
+        if cache is not None:
+            cache.put(key, res)
+        return res
+
+    def _predict_feat(self, feat_id, tag_id, wform_id, lemma_id, cnt_thresh):
+        """Implementation of ``.predict_feat()`` for ids already found"""
         val, coef = None, None
         if feat_id not in self._tag_feats[tag_id]:
             val, coef = None, 1.
         else:
-            wform_id = self._wforms_id.get(wform)
-            if wform_id is None:
-                wform_id = self._wforms_id.get(wform.lower())
             if wform_id is not None:
                 val_id = self._most_probable_wform_feats.get(wform_id, {}).get(
                     feat_id, self._most_probable_lemma_feats.get(
-                        self._lemmata_id.get(lemma), {}
+                        lemma_id, {}
                     ).get(feat_id)
                 )
                 if val_id is not None:
@@ -788,7 +1462,7 @@ class CorpusDict:
                 else:
                     feat_cnts = self._wform_feat_cnts[wform_id] \
                                     .get(tag_id, {}) \
-                                    .get(self._lemmata_id.get(lemma))
+                                    .get(lemma_id)
                         # {wform_id: {tag_id: {lemma_id:
                         #    {feat_id: {val_id: cnt}}}}}
                     tag_cnt = sum(
@@ -815,3 +1489,132 @@ class CorpusDict:
                         val = self._feat_vals[feat_id][0]  # '_'
                         coef = min(tag_cnt / cnt_thresh, 1.)
         return val, coef
+
+    def predict_tags(self, wforms, isfirst=False, cnt_thresh=None):
+        """Batch version of ``.predict_tag()``. Repeated word forms are
+        processed only once.
+
+        :param wforms: word forms to predict tags for
+        :type wforms: iter(str)
+        :param isfirst: the *isfirst* param of ``.predict_tag()``, either for
+                        all the *wforms* or a sequence of values, one per
+                        wform
+        :type isfirst: bool|iter(bool)
+        :return: tags predicted and relevance coefs, one per wform
+        :rtype: list(tuple(str, float))
+        """
+        wforms = list(wforms)
+        isfirsts = list(isfirst) if hasattr(isfirst, '__iter__') else \
+                   [isfirst] * len(wforms)
+        assert len(isfirsts) == len(wforms), \
+            'ERROR: Lengths of wforms and isfirst are different'
+        res, cache = [], {}
+        for wform, isfirst in zip(wforms, isfirsts):
+            # isfirst matters only for title wforms
+            key = wform, bool(isfirst) and wform.istitle()
+            val = cache.get(key)
+            if val is None:
+                val = cache[key] = self.predict_tag(wform, isfirst=key[1],
+                                                    cnt_thresh=cnt_thresh)
+            res.append(val)
+        return res
+
+    def predict_lemmata(self, pairs, cnt_thresh=None):
+        """Batch version of ``.predict_lemma()``. Repeated pairs are
+        processed only once.
+
+        :param pairs: word forms and their tags
+        :type pairs: list(tuple(str, str))
+        :return: lemmata chosen and relevance coefs, one per pair
+        :rtype: list(tuple(str, float))
+        """
+        res, cache = [], {}
+        for wform, tag in pairs:
+            key = wform, tag
+            val = cache.get(key)
+            if val is None:
+                val = cache[key] = self.predict_lemma(wform, tag,
+                                                      cnt_thresh=cnt_thresh)
+            res.append(val)
+        return res
+
+    def predict_feats(self, triples, feats=None, cnt_thresh=None):
+        """Batch version of ``.predict_feat()``: predict values of several
+        feats at once. Repeated triples are processed only once, and ids of
+        the wform and lemma are looked up once for all the feats.
+
+        :param triples: word forms, their lemmata and tags
+        :type triples: list(tuple(str, str, str))
+        :param feats: feats to predict. If None, all feats known for the tag
+                      of the triple are used
+        :type feats: list(str)
+        :return: {feat: (val, coef)} for every triple; feats without
+                 ``feats`` specified are sorted by name
+        :rtype: list(OrderedDict(str: tuple(str, float)))
+        """
+        if cnt_thresh is None:
+            cnt_thresh = self._cnt_thresh
+        if feats is not None:
+            feat_ids = [self._feats_id.get(x) for x in feats]
+            assert None not in feat_ids, 'ERROR: Unknown feat specified'
+        res, cache = [], {}
+        for triple in triples:
+            val = cache.get(triple)
+            if val is None:
+                wform, lemma, tag = triple
+                tag_id = self._tags_id.get(tag)
+                assert tag_id is not None, 'ERROR: Unknown tag specified'
+                wform_id = self._wforms_id.get(wform)
+                if wform_id is None:
+                    wform_id = self._wforms_id.get(wform.lower())
+                lemma_id = self._lemmata_id.get(lemma)
+                feat_ids_ = feat_ids if feats is not None else \
+                            sorted(self._tag_feats[tag_id],
+                                   key=self._feats.__getitem__)
+                val = cache[triple] = OrderedDict(
+                    (self._feats[x],
+                     self._predict_feat(x, tag_id, wform_id, lemma_id,
+                                        cnt_thresh))
+                        for x in feat_ids_
+                )
+            res.append(val.copy())
+        return res
+
+    def predict_sentence(self, sentence, overwrite=False, cnt_thresh=None):
+        """Fill UPOS, LEMMA and FEATS fields of a *sentence* in Parsed
+        CoNLL-U format with the values predicted by the batch methods.
+        Multiword tokens and empty nodes are skipped.
+
+        :param overwrite: if False (default), only empty fields are filled,
+                          and values already present are used for
+                          prediction of other fields
+        :type overwrite: bool
+        :return: the *sentence* changed in place
+        """
+        tokens = sentence[0] if isinstance(sentence, tuple) else sentence
+        tokens = [x for x in tokens
+                      if x['FORM'] and x['ID'].isdecimal()]
+
+        tokens_ = [x for x in tokens if overwrite or not x.get('UPOS')]
+        for token, (tag, _) in zip(tokens_, self.predict_tags(
+            [x['FORM'] for x in tokens_],
+            isfirst=[x is tokens[0] for x in tokens_], cnt_thresh=cnt_thresh
+        )):
+            token['UPOS'] = tag if tag else self._most_common_tag
+
+        tokens = [x for x in tokens if x.get('UPOS') in self._tags_id]
+        tokens_ = [x for x in tokens if overwrite or not x.get('LEMMA')]
+        for token, (lemma, _) in zip(tokens_, self.predict_lemmata(
+            [(x['FORM'], x['UPOS']) for x in tokens_], cnt_thresh=cnt_thresh
+        )):
+            token['LEMMA'] = lemma
+
+        tokens_ = [x for x in tokens if overwrite or not x.get('FEATS')]
+        for token, feats in zip(tokens_, self.predict_feats(
+            [(x['FORM'], x['LEMMA'], x['UPOS']) for x in tokens_],
+            cnt_thresh=cnt_thresh
+        )):
+            token['FEATS'] = OrderedDict(
+                (x, y) for x, (y, _) in feats.items() if y not in [None, '_']
+            )
+        return sentence
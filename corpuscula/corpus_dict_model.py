@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+# Corpuscula project: Binary model format for Corpus Dictionary
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Binary model format for ``CorpusDict``. The model keeps both the counters
+extracted from corpora and the results of ``CorpusDict.fit()``, so a model
+can be used right after loading. The file is opened via mmap: nothing is
+decoded on load except a small table of metadata, and processes that load the
+same model share its pages. The model can also be placed in a named
+shared memory segment, and processes attach to it in the same way.
+
+Layout of the model file (all numbers are in native byte order of the
+platform where the model was saved):
+
+    header: magic, version, reserved, metadata offset, metadata size
+    sections: flat arrays aligned to 8 bytes
+    metadata: pickled dict with small tables (tags, feats, frequencies,
+              etc.) and descriptors (offset, typecode, length) of the
+              sections
+
+Word forms, lemmata and lemma endings are kept as string tables: a utf-8 blob,
+offsets of the strings in the blob and an open addressing hash table (by
+crc32 of the utf-8 form, with linear probing) for lookup. Nested counters and
+fitted tables are kept in the ``PackedCounts`` form along with their indices,
+common endings are kept as ``SuffixTrie`` arrays.
+"""
+from array import array
+from collections.abc import Mapping, Sequence
+import mmap
+import os
+import pickle
+import struct
+import sys
+from zlib import crc32
+
+from corpuscula.corpus_dict_storage import PackedCounts, SuffixTrie, \
+                                           _typecode
+
+MODEL_VERSION = 4
+_MAGIC = b'CRPSDICT'
+_HEADER = struct.Struct('=8sIIQQ')
+_ALIGN = 8
+
+# (attr, depth, width) of nested counters and fitted tables kept as
+# PackedCounts
+_PACKED_ATTRS = [('_wform_tag_cnts', 3, 1), ('_wform_feat_cnts', 5, 1),
+                 ('_lemma_tag_cnts', 2, 1), ('_lemma_feat_cnts', 4, 1),
+                 ('_most_probable_tags', 1, 1),
+                 ('_wform_tags_top', 1, 3), ('_wform_title_tags_top', 1, 3),
+                 ('_wform_tag_lemmata_top', 2, 3),
+                 ('_most_probable_wform_feats', 2, 1),
+                 ('_most_probable_lemma_feats', 2, 1)]
+# attrs kept in metadata as is
+_META_ATTRS = ['_cnt_thresh', '_ambiguity_thresh', '_tags', '_feats',
+               '_feat_vals', '_tags_freq', '_feats_freq', '_feat_vals_freq',
+               '_most_common_tag', '_capitalized_tags', '_tag_case_cnts',
+               '_tag_feats',
+               '_fit_thresholds']
+
+
+def is_model_file(file_path):
+    """Check if the file *file_path* is a ``CorpusDict`` model"""
+    with open(file_path, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+class _StringTable(Sequence):
+    """Read-only list of strings stored in the model file"""
+
+    __slots__ = ('_mm', '_base', '_offsets', '_slots')
+
+    def __init__(self, mm, base, offsets, slots):
+        self._mm = mm
+        self._base = base          # offset of the blob in the file
+        self._offsets = offsets    # [offset of the string in the blob]
+        self._slots = slots        # [idx + 1|0], hash table of the strings
+
+    def _bytes(self, idx):
+        base, offsets = self._base, self._offsets
+        return self._mm[base + offsets[idx]:base + offsets[idx + 1]]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[x] for x in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('string index out of range')
+        return str(self._bytes(idx), 'utf-8')
+
+    def find(self, s):
+        """Return an index of the string *s* or None if it's absent"""
+        try:
+            key = s.encode('utf-8')
+        except (AttributeError, UnicodeEncodeError):
+            return None
+        mm, base, offsets, slots = \
+            self._mm, self._base, self._offsets, self._slots
+        mask = len(slots) - 1
+        pos = crc32(key) & mask
+        while True:
+            idx = slots[pos]
+            if not idx:
+                return None
+            if mm[base + offsets[idx - 1]:base + offsets[idx]] == key:
+                return idx - 1
+            pos = (pos + 1) & mask
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+class _StringIndex(Mapping):
+    """Read-only {string: index} view of ``_StringTable``"""
+
+    __slots__ = ('_table',)
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, s):
+        res = self._table.find(s)
+        if res is None:
+            raise KeyError(s)
+        return res
+
+    def get(self, s, default=None):
+        res = self._table.find(s)
+        return default if res is None else res
+
+    def __contains__(self, s):
+        return self._table.find(s) is not None
+
+    def __iter__(self):
+        return iter(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def __reduce__(self):
+        return (dict, ([(x, i) for i, x in enumerate(self._table)],))
+
+
+class _SizeCounter:
+    """File-like object that only counts the size of the data written"""
+
+    def __init__(self):
+        self._pos = self.size = 0
+
+    def write(self, data):
+        self._pos += len(data)
+        self.size = max(self.size, self._pos)
+
+    def seek(self, pos):
+        self._pos = pos
+
+
+class _BufferWriter:
+    """File-like object that writes the data to a memory buffer"""
+
+    def __init__(self, buf):
+        self._buf = buf
+        self._pos = 0
+
+    def write(self, data):
+        pos = self._pos + len(data)
+        self._buf[self._pos:pos] = data
+        self._pos = pos
+
+    def seek(self, pos):
+        self._pos = pos
+
+
+class _ModelWriter:
+
+    def __init__(self, f):
+        self._f = f
+        self._pos = _HEADER.size
+
+    def add(self, arr):
+        """Write an array *arr* and return its descriptor"""
+        padding = -self._pos % _ALIGN
+        if padding:
+            self._f.write(b'\0' * padding)
+            self._pos += padding
+        res = (self._pos, _typecode(arr), len(arr))
+        data = arr.tobytes()
+        self._f.write(data)
+        self._pos += len(data)
+        return res
+
+    def add_strings(self, strs):
+        """Write a string table and return its descriptor"""
+        blob = bytearray()
+        offsets = array('Q', [0])
+        num_slots = 1
+        while num_slots < len(strs) * 2:
+            num_slots *= 2
+        slots, mask = array('I', [0]) * num_slots, num_slots - 1
+        for idx, s in enumerate(strs):
+            s = s.encode('utf-8')
+            blob += s
+            offsets.append(len(blob))
+            pos = crc32(s) & mask
+            while slots[pos]:
+                pos = (pos + 1) & mask
+            slots[pos] = idx + 1
+        if len(blob) <= 0xFFFFFFFF:
+            offsets = array('I', offsets)
+        return (self.add(array('B', blob)), self.add(offsets),
+                self.add(slots))
+
+    def add_packed(self, counts):
+        """Write ``PackedCounts`` *counts* and return its descriptor"""
+        return (counts._depth, {x: [self.add(y) for y in y]
+                                    for x, y in counts._get_arrays().items()},
+                counts._width)
+
+    def add_trie(self, trie):
+        """Write ``SuffixTrie`` *trie* and return its descriptor"""
+        arrays = trie._get_arrays()
+        return ({x: self.add(y) for x, y in arrays.items()},
+                self.add_strings(list(trie._strs)))
+
+
+def _get_packed_attrs(cdict):
+    res = {}
+    for attr, depth, width in _PACKED_ATTRS:
+        counts = getattr(cdict, attr)
+        if not isinstance(counts, PackedCounts):
+            counts = PackedCounts(counts, depth, width)
+        res[attr] = counts
+    return res
+
+def _write_model(cdict, f, packed_attrs):
+    """Write the model to the seekable file-like object *f*"""
+    f.write(_HEADER.pack(_MAGIC, MODEL_VERSION, 0, 0, 0))
+    writer = _ModelWriter(f)
+    sections = {
+        '_wforms': writer.add_strings(list(cdict._wforms)),
+        '_lemmata': writer.add_strings(list(cdict._lemmata)),
+        '_common_endings': {x: writer.add_trie(y) for x, y
+                                in cdict._common_endings.items()}
+    }
+    for attr, _, _ in _PACKED_ATTRS:
+        sections[attr] = writer.add_packed(packed_attrs[attr])
+    meta = {x: getattr(cdict, x) for x in _META_ATTRS}
+    meta['byteorder'] = sys.byteorder
+    meta['sections'] = sections
+    meta = pickle.dumps(meta, 2)
+    f.write(meta)
+    f.seek(0)
+    f.write(_HEADER.pack(_MAGIC, MODEL_VERSION, 0, writer._pos, len(meta)))
+
+def save_model(cdict, file_path):
+    """Save the state of a fitted ``CorpusDict`` *cdict* to the model file
+    *file_path*"""
+    file_path_ = file_path + '$'
+    with open(file_path_, 'wb') as f:
+        _write_model(cdict, f, _get_packed_attrs(cdict))
+    os.replace(file_path_, file_path)
+
+def _get_shared_memory_class():
+    try:
+        from multiprocessing import resource_tracker, shared_memory
+    except ImportError:
+        raise RuntimeError('ERROR: Shared memory requires Python 3.8+')
+
+    class SharedModel(shared_memory.SharedMemory):
+        """Shared memory segment with a model. If arrays of a loaded model
+        refer to the segment, it stays mapped until the last of them is
+        released"""
+
+        def __init__(self, name=None, create=False, size=0):
+            try:
+                super().__init__(name=name, create=create, size=size,
+                                 track=create)
+            except TypeError:  # Python < 3.13 tracks any attached segment
+                # and destroys it when the process exits
+                inherited = getattr(resource_tracker._resource_tracker,
+                                    '_fd', None) is not None
+                super().__init__(name=name, create=create, size=size)
+                if not (create or inherited):
+                    resource_tracker.unregister(self._name, 'shared_memory')
+
+        def __del__(self):
+            try:
+                self.close()
+            except BufferError:  # the segment is still in use
+                pass
+
+    return SharedModel
+
+def share_model(cdict, name=None):
+    """Save the state of a fitted ``CorpusDict`` *cdict* to a new shared
+    memory segment in the model format.
+
+    :param name: name of the segment. If None, a unique name is generated
+    :return: the segment. Its name has to be passed to ``attach_model()``.
+             When the segment is no longer needed, call its ``.unlink()``
+             method
+    :rtype: multiprocessing.shared_memory.SharedMemory
+    """
+    packed_attrs = _get_packed_attrs(cdict)
+    counter = _SizeCounter()
+    _write_model(cdict, counter, packed_attrs)
+    shm = _get_shared_memory_class()(name=name, create=True,
+                                     size=counter.size)
+    _write_model(cdict, _BufferWriter(shm.buf), packed_attrs)
+    return shm
+
+def load_model(cdict, file_path):
+    """Load the state of a ``CorpusDict`` *cdict* from the model file
+    *file_path*. The file stays mapped until *cdict* releases the state"""
+    with open(file_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _load_model(cdict, mm, file_path)
+
+def attach_model(cdict, name):
+    """Load the state of a ``CorpusDict`` *cdict* from the shared memory
+    segment *name* created by ``share_model()``. The segment stays mapped
+    until *cdict* releases the state"""
+    shm = _get_shared_memory_class()(name=name)
+    # own view of the buffer stays valid after the segment object is closed
+    _load_model(cdict, memoryview(shm.buf), 'Shared memory segment ' + name)
+
+def _load_model(cdict, mm, source):
+    magic, version, _, meta_offset, meta_size = _HEADER.unpack_from(mm)
+    if magic != _MAGIC or version != MODEL_VERSION:
+        raise ValueError('ERROR: {} is not a corpus dict model of version {}'
+                             .format(source, MODEL_VERSION))
+    meta = pickle.loads(mm[meta_offset:meta_offset + meta_size])
+    swap = meta['byteorder'] != sys.byteorder
+    mv = memoryview(mm)
+
+    def get_array(descr):
+        offset, typecode, length = descr
+        res = mv[offset:offset + length * array(typecode).itemsize] \
+                  .cast(typecode)
+        if swap:  # the model can't be used in place
+            res = array(typecode, res)
+            res.byteswap()
+        return res
+
+    def get_strings(descr):
+        blob, offsets, slots = descr
+        return _StringTable(mm, blob[0], get_array(offsets),
+                            get_array(slots))
+
+    def get_packed(descr):
+        depth, arrays, width = descr
+        return PackedCounts._from_arrays(
+            depth, {x: [get_array(y) for y in y] for x, y in arrays.items()},
+            width
+        )
+
+    sections = meta['sections']
+    for attr in _META_ATTRS:
+        setattr(cdict, attr, meta[attr])
+    for attr, _, _ in _PACKED_ATTRS:
+        setattr(cdict, attr, get_packed(sections[attr]))
+    cdict._wforms = get_strings(sections['_wforms'])
+    cdict._lemmata = get_strings(sections['_lemmata'])
+    cdict._wforms_id = _StringIndex(cdict._wforms)
+    cdict._lemmata_id = _StringIndex(cdict._lemmata)
+    cdict._tags_id = {x: i for i, x in enumerate(cdict._tags)}
+    cdict._feats_id = {x: i for i, x in enumerate(cdict._feats)}
+    cdict._feat_vals_id = [{x: i for i, x in enumerate(x)}
+                               for x in cdict._feat_vals]
+    cdict._common_endings = {
+        x: SuffixTrie._from_arrays({x: get_array(y) for x, y in y.items()},
+                                   get_strings(z))
+            for x, (y, z) in sections['_common_endings'].items()
+    }
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# Corpuscula project: NumPy-backed statistics for Corpus Dictionary
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+NumPy-backed computation of the statistics of ``CorpusDict.fit()``. The
+nested counters are flattened level by level into arrays of keys and offsets
+(the layout of ``PackedCounts``; the arrays of the compacted counters are used
+as is), and all the aggregations are done by segment reductions and sorts over
+the leaf counts. The results are the same as of the pure Python code,
+including the order of ties and of the items of the result dicts.
+
+Requires numpy. Import of the module fails if it's not installed.
+"""
+from itertools import chain
+
+import numpy as np
+
+from corpuscula.corpus_dict_storage import PackedCounts
+
+
+def _flatten(counts, depth):
+    """Flatten nested counters *counts*.
+
+    :return: keys of every level, offsets of the children of every level but
+             the last one and leaf counts
+    :rtype: tuple(list(np.array), list(np.array), np.array)
+    """
+    if isinstance(counts, PackedCounts):
+        return ([np.asarray(x, dtype=np.int64) for x in counts._keys],
+                [np.asarray(x, dtype=np.int64)
+                     for x in counts._ptrs[:depth - 1]],
+                np.asarray(counts._vals, dtype=np.int64))
+    keys, ptrs, nodes = [], [], [counts]
+    for level in range(depth):
+        keys.append(np.fromiter(chain.from_iterable(nodes), dtype=np.int64))
+        nodes = list(chain.from_iterable(map(dict.values, nodes)))
+        if level < depth - 1:
+            ptrs_ = np.zeros(len(nodes) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, nodes), dtype=np.int64,
+                                  count=len(nodes)),
+                      out=ptrs_[1:])
+            ptrs.append(ptrs_)
+    return keys, ptrs, np.fromiter(nodes, dtype=np.int64, count=len(nodes))
+
+def _parents(ptrs):
+    """Return the index of the parent for every child node"""
+    return np.repeat(np.arange(len(ptrs) - 1), np.diff(ptrs))
+
+def _path_keys(keys, ptrs, level, up_to):
+    """Return the keys of the level *up_to* for the nodes of the *level*"""
+    idx = np.arange(len(keys[level]))
+    for level_ in range(level, up_to, -1):
+        idx = _parents(ptrs[level_ - 1])[idx]
+    return keys[up_to][idx]
+
+def _segment_sums(vals, ptrs):
+    """Return the sums of *vals* over the segments given by offsets
+    *ptrs*"""
+    cumsum = np.zeros(len(vals) + 1, dtype=np.int64)
+    np.cumsum(vals, out=cumsum[1:])
+    return cumsum[ptrs[1:]] - cumsum[ptrs[:-1]]
+
+def _segment_tops(keys, cnts, ptrs):
+    """For every non-empty segment, find the key with the max (count, key),
+    its count and the max count of other keys, as ``CorpusDict._get_top()``
+    does"""
+    order = np.lexsort((keys, cnts, _parents(ptrs)))
+    last = order[ptrs[1:] - 1]
+    prev = order[np.maximum(ptrs[1:] - 2, 0)]
+    cnts2 = np.where(np.diff(ptrs) > 1, cnts[prev], 0)
+    return keys[last], cnts[last], cnts2
+
+def _segment_firsts(mask, ptrs):
+    """Return the index of the first True of *mask* in every segment. The
+    segments must contain at least one True"""
+    idx = np.where(mask, np.arange(len(mask)), len(mask))
+    return np.minimum.reduceat(idx, ptrs[:-1])
+
+def _join(keys, keys_):
+    """Return the positions of *keys_* in the unique *keys*"""
+    order = np.argsort(keys, kind='stable')
+    return order[np.searchsorted(keys, keys_, sorter=order)]
+
+def _is_trusted(cnt, n, cnt_thresh, ambiguity_thresh):
+    return (n >= cnt_thresh) & (cnt / n >= ambiguity_thresh)
+
+def _most_probable_feats(keys, ptrs, vals, block_cnts, tag_feats_ptrs,
+                         tag_feats, cnt_thresh, ambiguity_thresh):
+    """Count the trusted feat values of the owners (wforms or lemmata) of
+    the counters {owner_id: {tag_id: ... {feat_id: {val_id: cnt}}}} given by
+    the flattened *keys*, *ptrs* and *vals*. The level before the feats keeps
+    the blocks of counts (e.g., (wform_id, tag_id, lemma_id)) and
+    *block_cnts* are the numbers of tokens of the blocks. The feats of the
+    tags are given as CSR *tag_feats_ptrs* and *tag_feats* in the iteration
+    order of the sets of ``CorpusDict._tag_feats``.
+
+    Every count of the block is an event with a position in the iteration
+    order of the Python code. The feats of the tag that are absent in the
+    block or have less counts than the block get the value 0 with the
+    rest of the count of the block. Among the values with the max count, the
+    one inserted first (i.e., with the min position) wins; the feats of the
+    result are ordered by their first positions, too.
+
+    :return: {owner_id: {feat_id: val_id}}
+    """
+    depth = len(keys)
+    block_level, feat_level = depth - 3, depth - 2
+    num_blocks = len(keys[block_level])
+    block_owners = _path_keys(keys, ptrs, block_level, 0)
+    block_tags = _path_keys(keys, ptrs, block_level, 1)
+    block_ptrs, leaf_ptrs = ptrs[block_level], ptrs[feat_level]
+    feat_blocks = _parents(block_ptrs)
+    feats = keys[feat_level]
+    leaf_feats = _parents(leaf_ptrs)
+    leaf_blocks = feat_blocks[leaf_feats]
+    block_lo = leaf_ptrs[block_ptrs[:-1]]
+    block_len = leaf_ptrs[block_ptrs[1:]] - block_lo
+    step = 2 * block_len.max(initial=0) \
+         + np.diff(tag_feats_ptrs).max(initial=0) + 1
+
+    # events: counts of the leaves
+    owners = [block_owners[leaf_blocks]]
+    ev_feats = [feats[leaf_feats]]
+    ev_vals = [keys[-1]]
+    ev_cnts = [vals]
+    ev_poses = [leaf_blocks * step
+              + 2 * (np.arange(len(vals)) - block_lo[leaf_blocks])]
+
+    # events: the rest of the count of the block for the feats that are
+    # present in the block
+    rest_cnts = block_cnts[feat_blocks] - _segment_sums(vals, leaf_ptrs)
+    rest = np.flatnonzero(rest_cnts > 0)
+    rest_blocks = feat_blocks[rest]
+    owners.append(block_owners[rest_blocks])
+    ev_feats.append(feats[rest])
+    ev_vals.append(np.zeros(len(rest), dtype=np.int64))
+    ev_cnts.append(rest_cnts[rest])
+    ev_poses.append(rest_blocks * step
+                  + 2 * (leaf_ptrs[rest + 1] - 1 - block_lo[rest_blocks])
+                  + 1)
+
+    # events: the counts of the block for the feats of the tag that are
+    # absent in the block
+    num_tag_feats = tag_feats_ptrs[block_tags + 1] \
+                  - tag_feats_ptrs[block_tags]
+    cand_blocks = np.repeat(np.arange(num_blocks), num_tag_feats)
+    cand_ranks = np.arange(len(cand_blocks)) \
+               - np.repeat(np.cumsum(num_tag_feats) - num_tag_feats,
+                           num_tag_feats)
+    cand_feats = tag_feats[tag_feats_ptrs[block_tags[cand_blocks]]
+                         + cand_ranks]
+    num_feats = int(max(tag_feats.max(initial=0), feats.max(initial=0))) + 1
+    absent = np.flatnonzero(~np.isin(cand_blocks * num_feats + cand_feats,
+                                     feat_blocks * num_feats + feats))
+    absent_blocks = cand_blocks[absent]
+    owners.append(block_owners[absent_blocks])
+    ev_feats.append(cand_feats[absent])
+    ev_vals.append(np.zeros(len(absent), dtype=np.int64))
+    ev_cnts.append(block_cnts[absent_blocks])
+    ev_poses.append(absent_blocks * step + 2 * block_len[absent_blocks]
+                  + cand_ranks[absent])
+
+    owners, ev_feats, ev_vals, ev_cnts, ev_poses = \
+        [np.concatenate(x) for x in [owners, ev_feats, ev_vals, ev_cnts,
+                                     ev_poses]]
+    if not len(owners):
+        return {}
+
+    # group the events by (owner, feat, val), then by (owner, feat)
+    num_vals = int(ev_vals.max()) + 1
+    group_keys = (owners * num_feats + ev_feats) * num_vals + ev_vals
+    order = np.argsort(group_keys, kind='stable')
+    group_keys, ev_cnts, ev_poses = \
+        group_keys[order], ev_cnts[order], ev_poses[order]
+    starts = np.flatnonzero(np.diff(group_keys, prepend=-1))
+    group_ptrs = np.append(starts, len(group_keys))
+    group_keys = group_keys[starts]
+    cnts = _segment_sums(ev_cnts, group_ptrs)
+    poses = np.minimum.reduceat(ev_poses, starts)
+
+    feat_keys = group_keys // num_vals
+    starts = np.flatnonzero(np.diff(feat_keys, prepend=-1))
+    feat_ptrs = np.append(starts, len(feat_keys))
+    group_feats = _parents(feat_ptrs)
+    max_cnts = np.maximum.reduceat(cnts, starts)
+    n = _segment_sums(cnts, feat_ptrs)
+    is_max = cnts == max_cnts[group_feats]
+    first_poses = np.minimum.reduceat(np.where(is_max, poses, poses.max()),
+                                      starts)
+    best = np.flatnonzero(is_max & (poses == first_poses[group_feats]))
+    trusted = np.flatnonzero(_is_trusted(max_cnts, n, cnt_thresh,
+                                         ambiguity_thresh))
+    trusted = trusted[np.argsort(np.minimum.reduceat(poses, starts)[trusted],
+                                 kind='stable')]
+    res = {}
+    for owner_feat, val in zip(feat_keys[starts[trusted]].tolist(),
+                               (group_keys[best[trusted]] % num_vals)
+                                   .tolist()):
+        owner, feat = divmod(owner_feat, num_feats)
+        res.setdefault(owner, {})[feat] = val
+    return res
+
+def fit_counts(cdict, cnt_thresh, ambiguity_thresh):
+    """Count the statistics of tags and feats for ``CorpusDict.fit()``: fill
+    ``._most_probable_tags``, ``._wform_tags_top``,
+    ``._wform_tag_lemmata_top``, ``._tag_feats``,
+    ``._most_probable_wform_feats`` and ``._most_probable_lemma_feats`` of
+    *cdict*.
+
+    :return: the counts of tags and the counts of feat values for every tag
+    :rtype: tuple(dict(int: int), list(dict(int: dict(int: int))))
+    """
+    num_tags = len(cdict._tags)
+
+    # tags
+    keys, ptrs, vals = _flatten(cdict._wform_tag_cnts, 3)
+    wforms, tags, lemmata = keys
+    wform_ptrs, tag_ptrs = ptrs
+    tag_cnts = _segment_sums(vals, tag_ptrs)
+    wforms_ = wforms.tolist()
+    tag_lemmata_top = list(zip(
+        tags.tolist(),
+        zip(*[x.tolist() for x in _segment_tops(lemmata, vals, tag_ptrs)])
+    ))
+    cdict._wform_tag_lemmata_top = {
+        x: dict(tag_lemmata_top[y:z])
+            for x, y, z in zip(wforms_, wform_ptrs[:-1].tolist(),
+                               wform_ptrs[1:].tolist())
+    }
+    cdict._wform_tags_top = dict(zip(wforms_, zip(
+        *[x.tolist() for x in _segment_tops(tags, tag_cnts, wform_ptrs)]
+    )))
+    max_cnts = np.maximum.reduceat(tag_cnts, wform_ptrs[:-1]) \
+                   if len(tag_cnts) else \
+               tag_cnts
+    best = _segment_firsts(tag_cnts == np.repeat(max_cnts,
+                                                 np.diff(wform_ptrs)),
+                           wform_ptrs) \
+               if len(tag_cnts) else \
+           tag_cnts
+    trusted = np.flatnonzero(_is_trusted(
+        max_cnts, _segment_sums(tag_cnts, wform_ptrs), cnt_thresh,
+        ambiguity_thresh
+    ))
+    cdict._most_probable_tags = dict(zip(wforms[trusted].tolist(),
+                                         tags[best[trusted]].tolist()))
+    tag_id_cnts = np.zeros(num_tags, dtype=np.int64)
+    np.add.at(tag_id_cnts, tags, tag_cnts)
+    tag_id_cnts = {x: int(tag_id_cnts[x])
+                       for x in dict.fromkeys(tags.tolist())}
+    wform_tl_keys = (np.repeat(wforms, np.diff(wform_ptrs)) * num_tags
+                   + tags)[_parents(tag_ptrs)] * (len(cdict._lemmata) + 1) \
+                  + lemmata
+    wform_tl_cnts = vals
+
+    # feats of tags
+    keys, ptrs, vals = _flatten(cdict._wform_feat_cnts, 5)
+    leaf_tags = _path_keys(keys, ptrs, 4, 1)
+    leaf_feats = _path_keys(keys, ptrs, 4, 3)
+    num_feats = len(cdict._feats)
+    num_vals = max((len(x) for x in cdict._feat_vals), default=0)
+    tag_feat_keys = leaf_tags * num_feats + leaf_feats
+    tag_feats = cdict._tag_feats = [set() for _ in range(num_tags)]
+    feat_val_id_cnts             = [{}    for _ in range(num_tags)]
+    keys_, idx = np.unique(tag_feat_keys, return_index=True)
+    for key in keys_[np.argsort(idx)].tolist():  # in order of appearance
+        tag_id, feat_id = divmod(key, num_feats)
+        tag_feats[tag_id].add(feat_id)
+        feat_val_id_cnts[tag_id][feat_id] = {}
+    keys_, inverse = np.unique(tag_feat_keys * num_vals + keys[4],
+                               return_inverse=True)
+    cnts = np.zeros(len(keys_), dtype=np.int64)
+    np.add.at(cnts, inverse.ravel(), vals)
+    for key, cnt in zip(keys_.tolist(), cnts.tolist()):
+        tag_feat, val_id = divmod(key, num_vals)
+        tag_id, feat_id = divmod(tag_feat, num_feats)
+        feat_val_id_cnts[tag_id][feat_id][val_id] = cnt
+    # the Python code iterates over the copies of the sets
+    tag_feats = [list(set(x)) for x in tag_feats]
+    tag_feats_ptrs = np.zeros(num_tags + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in tag_feats], out=tag_feats_ptrs[1:])
+    tag_feats = np.fromiter(chain.from_iterable(tag_feats), dtype=np.int64,
+                            count=tag_feats_ptrs[-1])
+
+    # most probable feats of wforms
+    block_keys = (_path_keys(keys, ptrs, 2, 0) * num_tags
+                + _path_keys(keys, ptrs, 2, 1)) * (len(cdict._lemmata) + 1) \
+               + keys[2]
+    cdict._most_probable_wform_feats = _most_probable_feats(
+        keys, ptrs, vals, wform_tl_cnts[_join(wform_tl_keys, block_keys)],
+        tag_feats_ptrs, tag_feats, cnt_thresh, ambiguity_thresh
+    )
+
+    # most probable feats of lemmata
+    keys_, ptrs_, vals_ = _flatten(cdict._lemma_tag_cnts, 2)
+    lemma_t_keys = np.repeat(keys_[0], np.diff(ptrs_[0])) * num_tags \
+                 + keys_[1]
+    keys, ptrs, vals = _flatten(cdict._lemma_feat_cnts, 4)
+    block_keys = _path_keys(keys, ptrs, 1, 0) * num_tags + keys[1]
+    cdict._most_probable_lemma_feats = _most_probable_feats(
+        keys, ptrs, vals, vals_[_join(lemma_t_keys, block_keys)],
+        tag_feats_ptrs, tag_feats, cnt_thresh, ambiguity_thresh
+    )
+
+    return tag_id_cnts, feat_val_id_cnts
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+# Corpuscula project: Compact storage for Corpus Dictionary
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Compact read-only storage for the nested counters of ``CorpusDict``, e.g.
+{wform_id: {tag_id: {lemma_id: cnt}}}.
+
+The counters are kept level by level in flat arrays (CSR style). For each
+level, there are the keys of all the nodes of the level in insertion order
+and the offsets of the children of every key on the next level. To find a key
+by binary search, the keys of every node are also kept sorted (along with
+their positions); the keys of the top level are found via a dense index. Only
+the keys and the offsets are saved, the rest is rebuilt on load. The storage
+behaves as a read-only nested mapping with the same iteration order as the
+source dicts.
+
+Also, there is a suffix trie for the common endings of word forms
+and lemmata.
+
+The arrays may also be memoryviews of a memory-mapped model file (see
+``corpuscula.corpus_dict_model``).
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+import sys
+
+_NONE = 0xFFFFFFFF  # absent key in the dense index
+
+def _shrink(arr):
+    """Convert an unsigned array *arr* to the smallest sufficient type"""
+    max_val = max(arr) if arr else 0
+    typecode = 'B' if max_val < 0x100 else \
+               'H' if max_val < 0x10000 else \
+               'I'
+    return arr if arr.typecode == typecode else array(typecode, arr)
+
+def _typecode(arr):
+    """Return a typecode of an array or a memoryview *arr*"""
+    return arr.typecode if isinstance(arr, array) else arr.format
+
+
+class _PackedNode(Mapping):
+    """Read-only view of a nested node of ``PackedCounts``"""
+
+    __slots__ = ('_storage', '_level', '_lo', '_hi')
+
+    def __init__(self, storage, level, lo, hi):
+        self._storage = storage
+        self._level = level
+        self._lo, self._hi = lo, hi
+
+    def _find(self, key):
+        storage, level, lo, hi = \
+            self._storage, self._level, self._lo, self._hi
+        skeys = storage._skeys[level]
+        try:
+            idx = bisect_left(skeys, key, lo, hi)
+        except TypeError:  # e.g. None
+            return None
+        return storage._spos[level][idx] \
+                   if idx < hi and skeys[idx] == key else \
+               None
+
+    def __getitem__(self, key):
+        pos = self._find(key)
+        if pos is None:
+            raise KeyError(key)
+        return self._storage._get(self._level, pos)
+
+    def get(self, key, default=None):
+        pos = self._find(key)
+        return default if pos is None else self._storage._get(self._level,
+                                                                pos)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        return iter(self._storage._keys[self._level][self._lo:self._hi])
+
+    def __len__(self):
+        return self._hi - self._lo
+
+    def keys(self):
+        return self._storage._keys[self._level][self._lo:self._hi].tolist()
+
+    def values(self):
+        return [self._storage._get(self._level, x)
+                    for x in range(self._lo, self._hi)]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class PackedCounts(_PackedNode):
+    """Compact read-only form of nested dicts of integer counters with
+    non-negative integer keys"""
+
+    __slots__ = ('_depth', '_width', '_keys', '_ptrs', '_skeys', '_spos',
+                 '_vals', '_index')
+
+    def __init__(self, counts, depth, width=1):
+        """
+        :param counts: nested dicts to pack
+        :type counts: dict(int: dict(int: ... int))
+        :param depth: the number of key levels in *counts*. E.g., for
+                      {wform_id: {tag_id: {lemma_id: cnt}}} it's 3
+        :param width: if greater than 1, the values of *counts* are tuples
+                      of *width* non-negative integers
+        """
+        self._depth = depth
+        self._width = width
+        self._keys, self._ptrs = [], []
+        self._vals = array('I')
+        nodes = [counts]
+        for level in range(depth):
+            keys, ptrs = array('I'), array('I', [0])
+            nodes_ = []
+            for node in nodes:
+                keys.extend(node.keys())
+                if level < depth - 1:
+                    for child in node.values():
+                        nodes_.append(child)
+                        ptrs.append(ptrs[-1] + len(child))
+                elif width == 1:
+                    self._vals.extend(node.values())
+                else:
+                    for val in node.values():
+                        self._vals.extend(val)
+            self._keys.append(_shrink(keys))
+            self._ptrs.append(_shrink(ptrs))
+            nodes = nodes_
+        self._vals = _shrink(self._vals)
+        self._build_index()
+
+    def _build_index(self):
+        """Create the dense index of the top level and sorted keys of the
+        nodes of other levels"""
+        keys = self._keys[0]
+        self._index = array('I', [_NONE]) * (max(keys) + 1 if keys else 0)
+        for pos, key in enumerate(keys):
+            self._index[key] = pos
+        self._skeys, self._spos = [array('I')], [array('I')]
+        for level in range(1, self._depth):
+            keys, ptrs = self._keys[level], self._ptrs[level - 1]
+            skeys, spos = array('I'), array('I')
+            for lo, hi in zip(ptrs, ptrs[1:]):
+                if hi - lo == 1:
+                    skeys.append(keys[lo])
+                    spos.append(lo)
+                else:
+                    for pos in sorted(range(lo, hi), key=keys.__getitem__):
+                        skeys.append(keys[pos])
+                        spos.append(pos)
+            self._skeys.append(_shrink(skeys))
+            self._spos.append(_shrink(spos))
+        _PackedNode.__init__(self, self, 0, 0, len(self._keys[0]))
+
+    def _get_arrays(self):
+        """Return all the arrays of the storage, including the indices, as a
+        dict {name: [array]}"""
+        return {'keys': self._keys, 'ptrs': self._ptrs, 'skeys': self._skeys,
+                'spos': self._spos, 'vals': [self._vals],
+                'index': [self._index]}
+
+    @classmethod
+    def _from_arrays(cls, depth, arrays, width=1):
+        """Create the storage from the arrays returned by ``._get_arrays()``
+        without rebuilding the indices"""
+        res = cls.__new__(cls)
+        res._depth = depth
+        res._width = width
+        res._keys, res._ptrs, res._skeys, res._spos = \
+            [list(arrays[x]) for x in ['keys', 'ptrs', 'skeys', 'spos']]
+        res._vals, = arrays['vals']
+        res._index, = arrays['index']
+        _PackedNode.__init__(res, res, 0, 0, len(res._keys[0]))
+        return res
+
+    def _get(self, level, pos):
+        if level == self._depth - 1:
+            width = self._width
+            return self._vals[pos] if width == 1 else \
+                   tuple(self._vals[pos * width:(pos + 1) * width])
+        ptrs = self._ptrs[level]
+        return _PackedNode(self, level + 1, ptrs[pos], ptrs[pos + 1])
+
+    def _find(self, key):
+        index = self._index
+        try:
+            pos = index[key]
+        except (IndexError, TypeError):
+            return None
+        return pos if pos != _NONE and key >= 0 else None
+
+    def unpack(self):
+        """Convert the storage back to nested dicts
+
+        :rtype: dict
+        """
+        def unpack(level, lo, hi):
+            keys = self._keys[level][lo:hi]
+            if level == self._depth - 1:
+                return dict(zip(keys, self._vals[lo:hi])) \
+                           if self._width == 1 else \
+                       {x: self._get(level, pos)
+                            for x, pos in zip(keys, range(lo, hi))}
+            ptrs = self._ptrs[level]
+            return {x: unpack(level + 1, ptrs[pos], ptrs[pos + 1])
+                        for x, pos in zip(keys, range(lo, hi))}
+        return unpack(0, 0, len(self._keys[0]))
+
+    def __getstate__(self):
+        return (sys.byteorder, self._depth,
+                [[(_typecode(x), x.tobytes()) for x in arrays]
+                     for arrays in [self._keys, self._ptrs]],
+                (_typecode(self._vals), self._vals.tobytes()), self._width)
+
+    def __setstate__(self, state):
+        byteorder, self._depth, arrays, vals = state[:4]
+        self._width = state[4] if len(state) > 4 else 1
+
+        def load(data):
+            typecode, data = data
+            res = array(typecode)
+            res.frombytes(data)
+            if byteorder != sys.byteorder:
+                res.byteswap()
+            return res
+
+        self._keys, self._ptrs = \
+            [[load(x) for x in arrays_] for arrays_ in arrays]
+        self._vals = load(vals)
+        self._build_index()
+
+    def __reduce__(self):
+        return (_new_packed_counts, (), self.__getstate__())
+
+def _new_packed_counts():
+    return PackedCounts.__new__(PackedCounts)
+
+
+_CHAR_RANGE = 0x110000  # the number of unicode code points
+
+
+class SuffixTrie:
+    """Trie of reversed word endings with lists of (lemma ending, count) for
+    every word ending. It's a compiled form of a dict
+    {wform_ed: [(lemma_ed, cnt)]} that allows to find all the known endings of
+    a word in one walk.
+
+    The trie is kept in flat arrays: sorted edge keys
+    (parent_node * 0x110000 + char code) with their child nodes, and, for
+    every node, the range of its (lemma ending, count) items. The trie created
+    in memory is kept as a hash map {edge key: (child node,
+    [(lemma_ed, cnt)])} that is faster and can be updated; its arrays are
+    built on demand. The tries of a memory-mapped model work on the arrays
+    directly."""
+
+    __slots__ = ('_edges', '_children', '_vptrs', '_leds', '_cnts', '_strs',
+                 '_map', '_root_vals', '_num_nodes')
+
+    def __init__(self, endings):
+        """
+        :param endings: word endings with the lists of their lemma endings
+                        and counts
+        :type endings: dict(str: list(tuple(str, int)))
+        """
+        self._map, self._root_vals, self._num_nodes = {}, None, 1
+        self._update(endings)
+
+    def _update(self, endings):
+        """Add *endings* {wform_ed: [(lemma_ed, cnt)]} to the trie. The lists
+        of the word endings that are already in the trie are replaced"""
+        if self._map is None:
+            self._build_map()
+        map_, num_nodes = self._map, self._num_nodes
+        for wed, led_cnts in endings.items():
+            node, key = 0, None
+            for ch in reversed(wed):
+                key = node * _CHAR_RANGE + ord(ch)
+                item = map_.get(key)
+                if item is None:
+                    item = map_[key] = (num_nodes, None)
+                    num_nodes += 1
+                node = item[0]
+            if key is None:
+                self._root_vals = led_cnts
+            else:
+                map_[key] = (node, led_cnts)
+        self._num_nodes = num_nodes
+        self._edges = None  # the arrays are outdated
+
+    def _build_map(self):
+        vptrs = self._vptrs
+        self._map = {
+            x: (y, self._get_vals(y) if vptrs[y] < vptrs[y + 1] else None)
+                for x, y in zip(self._edges, self._children)
+        }
+        self._root_vals = self._get_vals(0) if vptrs[0] < vptrs[1] else None
+        self._num_nodes = len(vptrs) - 1
+
+    def _build_arrays(self):
+        map_ = self._map
+        node_vals = [None] * self._num_nodes
+        node_vals[0] = self._root_vals
+        edges = sorted(map_)
+        children = array('I')
+        for key in edges:
+            child, node_vals[child] = map_[key]
+            children.append(child)
+        self._edges = array('Q', edges)
+        self._children = _shrink(children)
+        self._strs, strs_id = [], {}
+        vptrs, leds, cnts = array('I', [0]), array('I'), array('I')
+        for led_cnts in node_vals:
+            if led_cnts:
+                for led, cnt in led_cnts:
+                    led_id = strs_id.get(led)
+                    if led_id is None:
+                        led_id = strs_id[led] = len(self._strs)
+                        self._strs.append(led)
+                    leds.append(led_id)
+                    cnts.append(cnt)
+            vptrs.append(len(leds))
+        self._vptrs, self._leds, self._cnts = \
+            _shrink(vptrs), _shrink(leds), _shrink(cnts)
+
+    def _get_child(self, node, ch):
+        edges = self._edges
+        key = node * _CHAR_RANGE + ord(ch)
+        idx = bisect_left(edges, key)
+        return self._children[idx] \
+                   if idx < len(edges) and edges[idx] == key else \
+               None
+
+    def _get_vals(self, node):
+        lo, hi = self._vptrs[node], self._vptrs[node + 1]
+        strs, cnts = self._strs, self._cnts
+        return [(strs[x], cnts[lo + i])
+                    for i, x in enumerate(self._leds[lo:hi])]
+
+    def get(self, wed, default=None):
+        """Return [(lemma_ed, cnt)] for the word ending *wed*"""
+        map_ = self._map
+        if map_ is not None:
+            vals = self._root_vals
+            node = 0
+            for ch in reversed(wed):
+                item = map_.get(node * _CHAR_RANGE + ord(ch))
+                if item is None:
+                    return default
+                node, vals = item
+            return vals if vals else default
+        node = 0
+        for ch in reversed(wed):
+            node = self._get_child(node, ch)
+            if node is None:
+                return default
+        return self._get_vals(node) \
+                   if self._vptrs[node] < self._vptrs[node + 1] else \
+               default
+
+    def find_all(self, wform):
+        """Find all the known non-empty endings of the *wform*.
+
+        :return: tuples (start of the ending in *wform*, [(lemma_ed, cnt)]),
+                 longest endings first
+        :rtype: iter(tuple(int, list(tuple(str, int))))
+        """
+        res, node = [], 0
+        map_ = self._map
+        if map_ is not None:
+            get, char_range, start = map_.get, _CHAR_RANGE, len(wform)
+            for ch in reversed(wform):
+                item = get(node * char_range + ord(ch))
+                if item is None:
+                    break
+                start -= 1
+                node, vals = item
+                if vals:
+                    res.append((start, vals))
+            return reversed(res)
+        edges, children, vptrs = self._edges, self._children, self._vptrs
+        num_edges = len(edges)
+        for start in range(len(wform) - 1, -1, -1):
+            key = node * _CHAR_RANGE + ord(wform[start])
+            idx = bisect_left(edges, key)
+            if idx == num_edges or edges[idx] != key:
+                break
+            node = children[idx]
+            if vptrs[node] < vptrs[node + 1]:
+                res.append((start, node))
+        return ((x, self._get_vals(y)) for x, y in reversed(res))
+
+    def __bool__(self):
+        if self._map is not None:
+            return bool(self._root_vals) \
+                or any(x for _, x in self._map.values())
+        return self._vptrs[-1] > 0
+
+    def unpack(self):
+        """Convert the trie back to the dict of endings
+
+        :rtype: dict(str: list(tuple(str, int)))
+        """
+        if self._edges is None:
+            self._build_arrays()
+        suffixes, res = {0: ''}, {}
+        if self._vptrs[1] > 0:
+            res[''] = self._get_vals(0)
+        for key, node in zip(self._edges, self._children):
+            suffixes[node] = chr(key % _CHAR_RANGE) \
+                           + suffixes[key // _CHAR_RANGE]
+            if self._vptrs[node] < self._vptrs[node + 1]:
+                res[suffixes[node]] = self._get_vals(node)
+        return res
+
+    def _get_arrays(self):
+        """Return all the arrays of the trie as a dict {name: array}"""
+        if self._edges is None:
+            self._build_arrays()
+        return {'edges': self._edges, 'children': self._children,
+                'vptrs': self._vptrs, 'leds': self._leds, 'cnts': self._cnts}
+
+    @classmethod
+    def _from_arrays(cls, arrays, strs):
+        """Create the trie from the arrays returned by ``._get_arrays()`` and
+        the list of lemma endings *strs*"""
+        res = cls.__new__(cls)
+        for name, arr in arrays.items():
+            setattr(res, '_' + name, arr)
+        res._strs = strs
+        res._map = None
+        return res
+
+    def __getstate__(self):
+        arrays = self._get_arrays()
+        return (sys.byteorder,
+                {x: (_typecode(y), y.tobytes()) for x, y in arrays.items()},
+                list(self._strs))
+
+    def __setstate__(self, state):
+        byteorder, arrays, self._strs = state
+        for name, (typecode, data) in arrays.items():
+            arr = array(typecode)
+            arr.frombytes(data)
+            if byteorder != sys.byteorder:
+                arr.byteswap()
+            setattr(self, '_' + name, arr)
+        self._build_map()
@@ -17,8 +17,11 @@ import sys
 from urllib.error import HTTPError
 
 from corpuscula.conllu import Conllu
+from corpuscula.corpus_cache import TMP_SUFFIX, CorpusCache, \
+                                    CorpusCacheWriter, get_cache_key
 from corpuscula.utils import DIR_ACCESS_RIGHTS, LOG_FILE, download_file, \
-                             rmdir, read_bz2, read_rar, read_zip
+                             print_progress, rmdir, read_bz2, read_rar, \
+                             read_zip
 
 
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -142,6 +145,129 @@ def get_corpus_fpath(dname=None, root_dir=None, fname=None, url=None):
                                 re.sub('^.+/', '', url))
     return fpath
 
+CACHE_DNAME = 'cache'
+USE_CACHE = True
+def get_cache_fpath(name, fpaths, variant=None, root_dir=None):
+    """Return full path for the binary cache of the corpus *name* built from
+    the files *fpaths*. The cache is stored in the directory ``CACHE_DNAME``
+    of the project storage.
+
+    :param variant: any additional value the corpus depends on
+    :type variant: str
+    :param root_dir: path to the root storage. If None, default value will
+                     be used
+    :type root_dir: str
+    """
+    dpath = os.path.join(root_dir if root_dir else get_root_dir(),
+                         CACHE_DNAME)
+    return os.path.join(dpath, '{}.{}.cache'.format(
+        re.sub(r'\W', '_', name), get_cache_key(fpaths, variant=variant)
+    ))
+
+def remove_cache(root_dir=None):
+    """Remove all cached corpora.
+
+    :param root_dir: path to the root storage. If None, default value will
+                     be used
+    :type root_dir: str
+    """
+    try:
+        rmdir(os.path.join(root_dir if root_dir else get_root_dir(),
+                           CACHE_DNAME))
+    except FileNotFoundError:
+        pass
+
+def get_corpus_cache(corpus):
+    """Return ``CorpusCache`` object with random access to sentences of the
+    *corpus* that is returned by any corpus wrapper (e.g.
+    ``syntagrus.train()``). If the cache does not exist yet, it will be
+    created"""
+    assert isinstance(corpus, _CachedCorpus), \
+        'ERROR: The corpus is not cacheable'
+    if not os.path.isfile(corpus.cache_fpath):
+        for _ in corpus:
+            pass
+    return CorpusCache(corpus.cache_fpath)
+
+
+class _CachedCorpus:
+    """Iterator over sentences of a corpus. On the first pass, sentences are
+    stored to the binary cache; next times they are read from the cache
+    without parsing of the source files"""
+
+    def __init__(self, name, fpaths, loader, variant=None, root_dir=None,
+                 log_file=LOG_FILE):
+        """
+        :param name: name of the corpus part
+        :param fpaths: source files of the corpus
+        :param loader: function that returns sentences in Parsed CoNLL-U
+                       format
+        :param variant: any additional value the corpus depends on
+        :param root_dir: path to the root storage. If None, default value
+                         will be used
+        """
+        self.cache_fpath = get_cache_fpath(name, fpaths, variant=variant,
+                                           root_dir=root_dir)
+        self._loader = loader
+        self._log_file = log_file
+        self._it = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._it is None:
+            self._it = self._read() if os.path.isfile(self.cache_fpath) else \
+                       self._write()
+        return next(self._it)
+
+    def close(self):
+        if self._it is not None:
+            self._it.close()
+
+    def _read(self):
+        log_file = self._log_file
+        if log_file:
+            print('Load corpus from cache', file=log_file)
+        with CorpusCache(self.cache_fpath) as cache:
+            for sent_no, sentence in enumerate(cache):
+                yield sentence
+                if log_file and not sent_no % 100:
+                    print_progress(sent_no, end_value=None, step=1000,
+                                   file=log_file)
+            if log_file and len(cache):
+                print_progress(len(cache), end_value=0, step=1000,
+                               file=log_file)
+                print('Corpus has been loaded: {} sentences'
+                          .format(len(cache)),
+                      file=log_file)
+
+    def _write(self):
+        dpath, fname = os.path.split(self.cache_fpath)
+        os.makedirs(dpath, DIR_ACCESS_RIGHTS, exist_ok=True)
+        # remove outdated caches of the same corpus. The unfinished caches
+        # may belong to other writers, so we keep them
+        prefix = fname[:fname.index('.') + 1]
+        for fname_ in os.listdir(dpath):
+            if fname_.startswith(prefix) and fname_ != fname \
+           and not fname_.endswith(TMP_SUFFIX):
+                try:
+                    os.remove(os.path.join(dpath, fname_))
+                except OSError:  # removed by another writer or in use
+                    pass
+        with CorpusCacheWriter(self.cache_fpath) as cache:
+            for sentence in self._loader():
+                # sentence may be changed by consumer, so we save it first
+                cache.add(sentence)
+                yield sentence
+
+def _load_cached(name, fpaths, loader, variant=None, root_dir=None):
+    return _CachedCorpus(name, fpaths, loader, variant=variant,
+                         root_dir=root_dir) \
+               if USE_CACHE else \
+           loader()
+
+
 def _get_ud_train_name(file_list):
     return next((x for x in file_list 
                    if x and x.lower().endswith('train.conllu')),
@@ -488,18 +614,24 @@ class gicr(_AbstractCorpus):
         """Return train part of GICR corpus in CoNLL-U format"""
         fpath = get_corpus_fpath(dname=GICR_DNAME, url=GICR_URL)
         cls.isfile(fpath)
-        return Conllu.load(read_zip(fpath, 'gikrya_new_train.out',
-                                    process_line=cls._fix),
-                           log_file=LOG_FILE)
+        return _load_cached(
+            cls.name + '_train', [fpath],
+            lambda: Conllu.load(read_zip(fpath, 'gikrya_new_train.out',
+                                         process_line=cls._fix),
+                                log_file=LOG_FILE)
+        )
 
     @classmethod
     def test(cls):
         """Return test part of GICR corpus in CoNLL-U format"""
         fpath = get_corpus_fpath(dname=GICR_DNAME, url=GICR_URL)
         cls.isfile(fpath)
-        return Conllu.load(read_zip(fpath, 'gikrya_new_test.out',
-                                    process_line=cls._fix),
-                           log_file=LOG_FILE)
+        return _load_cached(
+            cls.name + '_test', [fpath],
+            lambda: Conllu.load(read_zip(fpath, 'gikrya_new_test.out',
+                                         process_line=cls._fix),
+                                log_file=LOG_FILE)
+        )
 
 
 re_gdesc     = re.compile('<grammeme parent="(.*)">'
@@ -602,35 +734,39 @@ class opencorpora(_AbstractCorpus):
               OPENCORPORA_URL
         cls._dl_params =   'noamb=True'  if noamb  else '' \
                        + ', nounkn=True' if nounkn else ''
-        gparents = {}
-        fpath = get_corpus_fpath(dname=OPENCORPORA_DNAME,
-                                 url=OPENCORPORA_DICT_URL)
-        for line in read_bz2(fpath):
-            line = line.strip()
-            if line == '</grammemes>':
-                break
-            else:
-                res = re_gdesc.search(line)
-                if res:
-                    parent, name = res.groups()
-                    gparents[name] = parent if parent else name
-        for name, p in gparents.items():
-            while True:
-                parent = p
-                p = gparents.get(p)
-                if p == parent:
-                    break
-            gparents[name] = parent
-        cls._gparents = gparents
-
+        dict_fpath = get_corpus_fpath(dname=OPENCORPORA_DNAME,
+                                      url=OPENCORPORA_DICT_URL)
         fpath = get_corpus_fpath(dname=OPENCORPORA_DNAME, url=url)
         cls.isfile(fpath)
-        cls._tag_id = 1
-        return Conllu.load(
-            (x for x in read_bz2(fpath, process_line=cls._fix)
-                 if x is not None),
-            log_file=LOG_FILE
-        )
+
+        def load():
+            gparents = {}
+            for line in read_bz2(dict_fpath):
+                line = line.strip()
+                if line == '</grammemes>':
+                    break
+                else:
+                    res = re_gdesc.search(line)
+                    if res:
+                        parent, name = res.groups()
+                        gparents[name] = parent if parent else name
+            for name, p in gparents.items():
+                while True:
+                    parent = p
+                    p = gparents.get(p)
+                    if p == parent:
+                        break
+                gparents[name] = parent
+            cls._gparents = gparents
+
+            cls._tag_id = 1
+            return Conllu.load(
+                (x for x in read_bz2(fpath, process_line=cls._fix)
+                     if x is not None),
+                log_file=LOG_FILE
+            )
+
+        return _load_cached(cls.name + '_train', [fpath, dict_fpath], load)
 
 
 class rnc(_AbstractCorpus):
@@ -664,10 +800,13 @@ class rnc(_AbstractCorpus):
         """Return RNC corpus in CoNLL-U format"""
         fpath = get_corpus_fpath(dname=RNC_DNAME, url=RNC_URL)
         cls.isfile(fpath)
-        return Conllu.load(
-            (x for x in read_rar(fpath,  'RNCgoldInUD_Morpho.conll',
-                                 process_line=cls._fix) if x is not None),
-            log_file=LOG_FILE
+        return _load_cached(
+            cls.name + '_train', [fpath],
+            lambda: Conllu.load(
+                (x for x in read_rar(fpath,  'RNCgoldInUD_Morpho.conll',
+                                     process_line=cls._fix) if x is not None),
+                log_file=LOG_FILE
+            )
         )
 
 
@@ -682,21 +821,24 @@ class syntagrus(_AbstractCorpus):
         fpath = get_corpus_fpath(dname=SYNTAGRUS_DNAME,
                                  url=SYNTAGRUS_TRAIN_URL)
         cls.isfile(fpath)
-        return Conllu.load(fpath, log_file=LOG_FILE)
+        return _load_cached(cls.name + '_train', [fpath],
+                            lambda: Conllu.load(fpath, log_file=LOG_FILE))
 
     @classmethod
     def dev(cls):
         fpath = get_corpus_fpath(dname=SYNTAGRUS_DNAME,
                                  url=SYNTAGRUS_DEV_URL)
         cls.isfile(fpath)
-        return Conllu.load(fpath, log_file=LOG_FILE)
+        return _load_cached(cls.name + '_dev', [fpath],
+                            lambda: Conllu.load(fpath, log_file=LOG_FILE))
 
     @classmethod
     def test(cls):
         fpath = get_corpus_fpath(dname=SYNTAGRUS_DNAME,
                                  url=SYNTAGRUS_TEST_URL)
         cls.isfile(fpath)
-        return Conllu.load(fpath, log_file=LOG_FILE)
+        return _load_cached(cls.name + '_test', [fpath],
+                            lambda: Conllu.load(fpath, log_file=LOG_FILE))
 
 
 class UniversalDependencies(_AbstractCorpus):
@@ -718,14 +860,20 @@ class UniversalDependencies(_AbstractCorpus):
     def train(self):
         fpath = get_ud_train_path(self._corpus_name, root_dir=self._root_dir)
         self.isfile(fpath)
-        return Conllu.load(fpath, log_file=LOG_FILE)
+        return _load_cached(self.name + '_train', [fpath],
+                            lambda: Conllu.load(fpath, log_file=LOG_FILE),
+                            root_dir=self._root_dir)
 
     def dev(self):
         fpath = get_ud_dev_path(self._corpus_name, root_dir=self._root_dir)
         self.isfile(fpath)
-        return Conllu.load(fpath, log_file=LOG_FILE)
+        return _load_cached(self.name + '_dev', [fpath],
+                            lambda: Conllu.load(fpath, log_file=LOG_FILE),
+                            root_dir=self._root_dir)
 
     def test(self):
         fpath = get_ud_test_path(self._corpus_name, root_dir=self._root_dir)
         self.isfile(fpath)
-        return Conllu.load(fpath, log_file=LOG_FILE)
+        return _load_cached(self.name + '_test', [fpath],
+                            lambda: Conllu.load(fpath, log_file=LOG_FILE),
+                            root_dir=self._root_dir)
@@ -3,9 +3,12 @@
 #
 # Copyright (C) 2019-present by Sergei Ternovykh
 # License: BSD, see LICENSE for details
+from collections import deque
 from difflib import SequenceMatcher
+from functools import lru_cache
 import re
 import os
+from queue import Full, Queue
 import shutil
 import sys
 from urllib.request import urlopen
@@ -26,6 +29,31 @@ def vote(sequence, weights=None):
     res.sort(key=lambda x: (x[1], x[0]), reverse=True)
     return res
 
+_LCS_MAX_SEARCH = 4096  # max len(a) * len(b) for the substring search
+
+@lru_cache(maxsize=65536)
+def find_longest_match(a, b):
+    """Find the longest common substring of the strings *a* and *b*. The
+    result is the same as of ``difflib.SequenceMatcher(None, a, b, False)
+    .find_longest_match(0, len(a), 0, len(b))``: among the longest matches,
+    the one that starts earliest in *a* and then earliest in *b* is returned.
+    Optimized for short words: substrings of *a* are searched in *b* from the
+    longest ones.
+
+    :return: start in *a*, start in *b*, length of the match
+    :rtype: int, int, int
+    """
+    len_a, len_b = len(a), len(b)
+    if len_a * len_b > _LCS_MAX_SEARCH:
+        return tuple(SequenceMatcher(None, a, b, False)
+                         .find_longest_match(0, len_a, 0, len_b))
+    for size in range(min(len_a, len_b), 0, -1):
+        for i in range(len_a - size + 1):
+            j = b.find(a[i:i + size])
+            if j >= 0:
+                return i, j, size
+    return 0, 0, 0
+
 def find_affixes(wform, lemma, lower=False):
     """Find the longest common part of the given *wform* and *lemma*.
 
@@ -42,8 +70,7 @@ def find_affixes(wform, lemma, lower=False):
         lem = lemma.lower()
     lex = lex.replace('ё', 'е')
     lem = lem.replace('ё', 'е')
-    a, b, size = SequenceMatcher(None, lex, lem, False) \
-        .find_longest_match(0, len(lex), 0, len(lem))
+    a, b, size = find_longest_match(lex, lem)
     return wform[:a], wform[a:a + size], wform[a + size:], \
            lemma[:b], lemma[b:b + size], lemma[b + size:]
     #       lemma[:b], wform[a:a + size], lemma[b + size:]
@@ -277,17 +304,230 @@ def download_file(url, dpath=None, fname=None, chunk_size=CALLBACK_CHUNK_SIZE,
                   file=LOG_FILE)
     return fpath
 
-def read_bz2(apath, encoding='utf-8', errors='ignore', process_line=None):
+def imap_bounded(pool, func, iterable, max_pending, ordered=True):
+    """Like ``Pool.imap()``, but takes the next items from the *iterable*
+    only when less than *max_pending* items are being processed, so the
+    memory consumption doesn't depend on the length of the *iterable*.
+
+    :param pool: the pool of worker processes
+    :type pool: multiprocessing.Pool
+    :param max_pending: max number of items submitted to the *pool* and not
+                        yet returned
+    :type max_pending: int
+    :param ordered: if False, the results are returned in the order they
+                    become ready, like in ``Pool.imap_unordered()``
+    """
+    if ordered:
+        pending = deque()
+        for item in iterable:
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(func, (item,)))
+        while pending:
+            yield pending.popleft().get()
+    else:
+        results, num_pending = Queue(), 0
+
+        def get_result():
+            isok, res = results.get()
+            if not isok:
+                raise res
+            return res
+
+        for item in iterable:
+            if num_pending >= max_pending:
+                yield get_result()
+                num_pending -= 1
+            pool.apply_async(func, (item,),
+                             callback=lambda x: results.put((True, x)),
+                             error_callback=lambda x: results.put((False, x)))
+            num_pending += 1
+        for _ in range(num_pending):
+            yield get_result()
+
+BZ2_BLOCK_SIZE = 1 << 20  # bytes of a bz2 file read at once
+BZ2_QUEUE_SIZE = 16  # decompressed blocks the reader thread may keep ahead
+
+re_bz2_stream = re.compile(br'BZh[1-9]1AY&SY')  # head of a bz2 stream
+
+def _decompress_bz2(f, block_size=BZ2_BLOCK_SIZE, isfirst=True):
+    """Decompress the bz2 file object *f* from its current position. Return
+    an iterator of the decompressed blocks. As in ``bz2.open()``, the data
+    that follows the last stream and isn't a bz2 stream is ignored. If
+    *isfirst* is False, the first stream is treated as not the first one"""
+    from bz2 import BZ2Decompressor
+    decomp, instream = BZ2Decompressor(), False
+    for data in iter(lambda: f.read(block_size), b''):
+        while data:
+            if decomp.eof:
+                decomp, isfirst = BZ2Decompressor(), False
+            try:
+                block = decomp.decompress(data)
+            except OSError:
+                if isfirst or instream:
+                    raise
+                return
+            instream = not decomp.eof
+            data = decomp.unused_data if decomp.eof else b''
+            if block:
+                yield block
+    if instream or (isfirst and not decomp.eof):
+        raise EOFError('Compressed file ended before the end-of-stream '
+                       'marker was reached')
+
+def _decompress_bz2_streams(data):
+    """Decompress the *data* that consists of whole bz2 streams. Return None
+    if it doesn't"""
+    from bz2 import BZ2Decompressor
+    res = []
+    while data:
+        decomp = BZ2Decompressor()
+        try:
+            res.append(decomp.decompress(data))
+        except OSError:
+            return None
+        if not decomp.eof:
+            return None
+        data = decomp.unused_data
+    return b''.join(res)
+
+def _read_bz2_threaded(apath, block_size=BZ2_BLOCK_SIZE,
+                       queue_size=BZ2_QUEUE_SIZE):
+    """Decompress the file *apath* in a background thread. Return an
+    iterator of the decompressed blocks"""
+    from threading import Event, Thread
+    blocks, stop = Queue(maxsize=queue_size), Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run():
+        try:
+            with open(apath, 'rb') as f:
+                for block in _decompress_bz2(f, block_size):
+                    if not put((True, block)):
+                        return
+            put((True, None))
+        except Exception as e:
+            put((False, e))
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            isok, block = blocks.get()
+            if not isok:
+                raise block
+            if block is None:
+                break
+            yield block
+    finally:
+        stop.set()
+        thread.join()
+
+def _read_bz2_parallel(apath, workers=None, block_size=BZ2_BLOCK_SIZE):
+    """Decompress the multistream file *apath* in a pool of *workers*
+    threads. The file is split by the heads of the bz2 streams, so a single
+    stream file is decompressed sequentially. Return an iterator of the
+    decompressed blocks"""
+    from multiprocessing.pool import ThreadPool
+    with open(apath, 'rb') as f:
+        offsets = deque()  # offsets of the parts sent to the pool
+        offset = None  # where to continue the sequential decompression
+
+        def get_parts():
+            nonlocal offset
+            data, data_offset = b'', 0
+            for block in iter(lambda: f.read(block_size), b''):
+                start = max(len(data) - 9, 1)
+                data += block
+                pos = None
+                for match in re_bz2_stream.finditer(data, start):
+                    pos = match.start()
+                if pos is not None:
+                    offsets.append(data_offset)
+                    yield data[:pos]
+                    data, data_offset = data[pos:], data_offset + pos
+                elif len(data) > 4 * block_size:
+                    offset = data_offset
+                    return
+            if data:
+                offsets.append(data_offset)
+                yield data
+            elif not data_offset:  # the file is empty
+                offset = 0
+
+        pool = ThreadPool(processes=workers)
+        try:
+            for block in imap_bounded(pool, _decompress_bz2_streams,
+                                      get_parts(), max_pending=2 * (
+                                          workers or os.cpu_count() or 1
+                                      )):
+                part_offset = offsets.popleft()
+                if block is None:
+                    offset = part_offset
+                    break
+                if block:
+                    yield block
+        finally:
+            pool.terminate()
+        if offset is not None:
+            f.seek(offset)
+            for block in _decompress_bz2(f, block_size, isfirst=not offset):
+                yield block
+
+def read_bz2(apath, encoding='utf-8', errors='ignore', process_line=None,
+             workers=1):
     """Read lines from a file in bz2 archive.
 
     :param process_line: a function that will be invoked to process each file's
                          line. If its result is a list, then it will be
                          returned by lines
     :type process_line: callable
+    :param workers: if 1 (default), the file is decompressed in a background
+                    thread while the lines are being processed. If 0, it's
+                    decompressed in the current thread. If more than 1, the
+                    streams of the multistream file are decompressed in
+                    parallel by a pool of *workers* threads (None means the
+                    number of CPUs)
+    :type workers: int
     """
-    from bz2 import open as bz2_open
-    with bz2_open(apath, mode='rt', encoding=encoding, errors=errors) as f:
-        for line in f:
+    from codecs import getincrementaldecoder
+    from io import IncrementalNewlineDecoder
+    if workers == 0:
+        f = open(apath, 'rb')
+        blocks = _decompress_bz2(f)
+    else:
+        f = None
+        blocks = _read_bz2_threaded(apath) if workers == 1 else \
+                 _read_bz2_parallel(apath, workers=workers)
+    decoder = IncrementalNewlineDecoder(
+        getincrementaldecoder(encoding)(errors=errors), translate=True
+    )
+    def get_lines():
+        tail = ''
+        for block in blocks:
+            lines = decoder.decode(block).split('\n')
+            lines[0] = tail + lines[0]
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        lines = decoder.decode(b'', final=True).split('\n')
+        lines[0] = tail + lines[0]
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if tail:
+            yield tail
+
+    try:
+        for line in get_lines():
             if process_line:
                 line = process_line(line)
                 if isinstance(line, list):
@@ -295,6 +535,10 @@ def read_bz2(apath, encoding='utf-8', errors='ignore', process_line=None):
                         yield line_
                     continue
             yield line
+    finally:
+        blocks.close()
+        if f:
+            f.close()
 
 def read_rar(apath, fname, encoding='utf-8', errors='ignore',
              process_line=None):
@@ -7,27 +7,53 @@
 Tools for downloading and converting Russian part of Wikipedia.
 Includes wrapper to simplify the further processing.
 """
+from array import array
+from bisect import bisect_left, bisect_right
+from bz2 import decompress as bz2_decompress
+from collections import deque
 from html import unescape
-from re import compile as re_compile, match as re_match, sub as re_sub
+from itertools import islice
+import json
+from multiprocessing import Pool
+import os
+from os import cpu_count
+from re import compile as re_compile, sub as re_sub
+from zlib import crc32
 
 from corpuscula.corpus_utils import _AbstractCorpus, download_corpus, \
                                     remove_corpus, get_corpus_fpath
-from corpuscula.utils import LOG_FILE, print_progress, read_bz2
+from corpuscula.utils import LOG_FILE, imap_bounded, print_progress, \
+                             read_bz2
 
 
 WIKIPEDIA_RU = 'Wikipedia.RU'
 WIKIPEDIA_RU_URL = 'https://dumps.wikimedia.org/ruwiki/latest/ruwiki-latest-pages-articles.xml.bz2'
+WIKIPEDIA_RU_MULTISTREAM_URL = 'https://dumps.wikimedia.org/ruwiki/latest/ruwiki-latest-pages-articles-multistream.xml.bz2'
+WIKIPEDIA_RU_MULTISTREAM_INDEX_URL = 'https://dumps.wikimedia.org/ruwiki/latest/ruwiki-latest-pages-articles-multistream-index.txt.bz2'
 WIKIPEDIA_RU_DNAME = 'wikipedia_ru'
-def _consts(lang='RU'):
+CHUNK_SIZE = 100  # pages in a chunk for parallel processing
+STREAMS_CHUNK_SIZE = 10  # bz2 streams of a multistream dump in a chunk for
+                         # parallel processing (a stream keeps 100 pages)
+SHARD_SIZE = 10000  # articles in a shard of the extracted corpus
+CHECKPOINT_STEP = 10000  # pages between checkpoints of the extraction
+CHECKPOINT_FNAME = 'checkpoint.json'
+REVISIONS_FNAME = 'revisions.tsv'
+SHARD_FNAME = 'articles_{:05d}.jsonl'
+def _consts(lang='RU', multistream=False):
     if lang == 'RU':
-        res = {'name' : WIKIPEDIA_RU,
-               'url'  : WIKIPEDIA_RU_URL,
-               'dname': WIKIPEDIA_RU_DNAME}
+        res = {'name'     : WIKIPEDIA_RU,
+               'url'      : WIKIPEDIA_RU_MULTISTREAM_URL if multistream else
+                            WIKIPEDIA_RU_URL,
+               'index_url': WIKIPEDIA_RU_MULTISTREAM_INDEX_URL
+                                if multistream else
+                            None,
+               'dname'    : WIKIPEDIA_RU_DNAME}
     else:
         raise ValueError('ERROR: Lang "{}" is not supported yet'.format(lang))
     return res
 
-def download_wikipedia(lang='RU', root_dir=None, overwrite=True):
+def download_wikipedia(lang='RU', root_dir=None, overwrite=True,
+                       multistream=False):
     """Downloaded Wikipedia dump.
     
     :param root_dir: path to the root storage. If None, default value will
@@ -35,11 +61,18 @@ def download_wikipedia(lang='RU', root_dir=None, overwrite=True):
     :type root_dir: str
     :param overwrite: False means do not download the corpus if it's already
                       kept in the corpus storage
+    :param multistream: if True, download the multistream variant of the
+                        dump along with its index
     """
-    consts = _consts(lang=lang)
-    return download_corpus(consts['name'], consts['url'],
-                           dname=consts['dname'], root_dir=root_dir,
-                           overwrite=overwrite, file_noless=3000000000)
+    consts = _consts(lang=lang, multistream=multistream)
+    res = download_corpus(consts['name'], consts['url'],
+                          dname=consts['dname'], root_dir=root_dir,
+                          overwrite=overwrite, file_noless=3000000000)
+    if multistream:
+        download_corpus(consts['name'] + ' index', consts['index_url'],
+                        dname=consts['dname'], root_dir=root_dir,
+                        overwrite=overwrite)
+    return res
 
 def remove_wikipedia(lang='RU', root_dir=None):
     """Remove Wikipedia dump.
@@ -50,50 +83,424 @@ def remove_wikipedia(lang='RU', root_dir=None):
     """
     remove_corpus(_consts(lang=lang)['dname'], root_dir=root_dir)
 
-def _get_titles(fpath, silent=False):
-    return _get_all(fpath, what='titles', silent=silent)
-
-def _get_articles(fpath, silent=False):
-    return _get_all(fpath, what='articles', silent=silent)
-
-def _get_templates(fpath, silent=False):
-    return _get_all(fpath, what='templates', silent=silent)
+def _get_titles(fpath, silent=False, workers=1, ordered=True, index=None):
+    return _get_all(fpath, what='titles', silent=silent, workers=workers,
+                    ordered=ordered, index=index)
+
+def _get_articles(fpath, silent=False, workers=1, ordered=True, index=None):
+    return _get_all(fpath, what='articles', silent=silent, workers=workers,
+                    ordered=ordered, index=index)
+
+def _get_templates(fpath, silent=False, workers=1, ordered=True,
+                   index=None):
+    return _get_all(fpath, what='templates', silent=silent, workers=workers,
+                    ordered=ordered, index=index)
+
+def _read_txt(fpath):
+    with open(fpath, 'rt', encoding='utf-8-sig') as f:
+        for line in f:
+            yield line
+
+re_namespace = re_compile(r'<namespace \S+ case="first-letter">([^<]+)'
+                          r'</namespace>')
+def _read_pages(lines, namespaces):
+    """Split the *lines* of the dump into pages. Each page is a list of its
+    lines. The namespaces found in the header of the dump are added to the
+    set *namespaces*"""
+    page = []
+    isheader = True
+    for line in lines:
+        if isheader:
+            line_ = line.strip()
+            if line_ == '<page>':
+                isheader = False
+            else:
+                ns = re_namespace.match(line_)
+                if ns:
+                    namespaces.add(ns.group(1))
+                continue
+        page.append(line)
+        if '</page>' in line and line.strip() == '</page>':
+            yield page
+            page = []
+    if page:
+        yield page
+
+def _read_chunks(lines, namespaces, chunk_size=CHUNK_SIZE):
+    """Split the *lines* of the dump into chunks of *chunk_size* pages"""
+    pages = _read_pages(lines, namespaces)
+    while True:
+        chunk = list(islice(pages, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+def _parse_chunk(args):
+    """Process the pages of the chunk in the worker"""
+    chunk, namespaces, what = args
+    return [x for x in chunk for x in _parse_page(x, namespaces, what)]
+
+def _read_streams(fpath, start, end):
+    """Decompress the bz2 streams that occupy bytes [*start*, *end*) of the
+    multistream dump *fpath* and return the lines of the text"""
+    with open(fpath, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return bz2_decompress(data).decode('utf-8', errors='ignore') \
+                               .splitlines(keepends=True)
+
+def _parse_streams(args):
+    """Process the pages of the bz2 streams in the worker"""
+    fpath, start, end, namespaces, what = args
+    lines = _read_streams(fpath, start, end)
+    return len(lines), [x for x in _read_pages(lines, set())
+                           for x in _parse_page(x, namespaces, what)]
+
+
+class _MultistreamIndex:
+    """Index of a multistream dump: the lines "offset:page_id:title" of the
+    index file are kept as sorted arrays of numbers"""
+
+    def __init__(self, index_fpath, fpath):
+        self._fpath = fpath
+        self._namespaces = None
+        offsets, ids, hashes, streams = array('Q'), [], [], []
+        for line in read_bz2(index_fpath):
+            offset, id_, title = line.rstrip('\n').split(':', 2)
+            offset = int(offset)
+            if not offsets or offsets[-1] != offset:
+                offsets.append(offset)
+            id_ = int(id_)
+            ids.append((id_, len(offsets) - 1))
+            hashes.append((crc32(title.encode('utf-8')), id_))
+        offsets.append(os.path.getsize(fpath))
+        self._offsets = offsets  # [offset of the bz2 stream] + [file size]
+        ids.sort()
+        self._ids = array('Q', (x for x, _ in ids))          # [page_id]
+        self._id_streams = array('L', (x for _, x in ids))   # [stream_no]
+        hashes.sort()
+        self._hashes = array('L', (x for x, _ in hashes))    # [crc32(title)]
+        self._hash_ids = array('Q', (x for _, x in hashes))  # [page_id]
+
+    @property
+    def namespaces(self):
+        """The namespaces from the header of the dump (in the stream before
+        the first indexed one)"""
+        if self._namespaces is None:
+            self._namespaces = set()
+            for _ in _read_pages(_read_streams(self._fpath, 0,
+                                               self._offsets[0]),
+                                 self._namespaces):
+                pass
+        return self._namespaces
+
+    def chunks(self, chunk_size=STREAMS_CHUNK_SIZE, start=0):
+        """Split the streams with the pages into chunks of *chunk_size*
+        streams, beginning from the stream at the offset *start*. Return
+        bounds (start, end) of the chunks"""
+        offsets = self._offsets
+        for i in range(bisect_left(offsets, start), len(offsets) - 1,
+                       chunk_size):
+            yield offsets[i], offsets[min(i + chunk_size, len(offsets) - 1)]
+
+    def find_id(self, page_id):
+        """Return bounds (start, end) of the stream with the page *page_id*
+        or None if the page is absent"""
+        idx = bisect_left(self._ids, page_id)
+        if idx < len(self._ids) and self._ids[idx] == page_id:
+            stream_no = self._id_streams[idx]
+            return self._offsets[stream_no], self._offsets[stream_no + 1]
+
+    def find_title(self, title):
+        """Return ids of the pages that may have the *title*"""
+        hash_ = crc32(title.encode('utf-8'))
+        return self._hash_ids[bisect_left(self._hashes, hash_):
+                              bisect_right(self._hashes, hash_)]
+
+    def get_page(self, page_id, what=None):
+        """Return the processed page *page_id* or None if it's absent or
+        doesn't fit to *what*"""
+        bounds = self.find_id(page_id)
+        if bounds:
+            page_id = str(page_id)
+            for page in _read_pages(_read_streams(self._fpath, *bounds),
+                                    set()):
+                for res in _parse_page(page, self.namespaces, what):
+                    if res[0] == page_id:
+                        return res
 
 re_html = re_compile(r'<[^<>]+?>')
 re_spenter = re_compile(r'[^\S\n]+\n')
-def _get_all(fpath, what=None, silent=False):
 
-    def read_txt():
-        with open(fpath, 'rt', encoding='utf-8-sig') as f:
-            for line in f:
-                yield line
+# patterns of the cleaner of wikitext
+re_tag_pair = re_compile(r'<(\w+)(?:\s[^>]*)?>.*?</\1>')
+re_tag_empty = re_compile(r'<[^>]+/>')
+re_comment_head = re_compile(r'<!--.*')
+re_comment_tail = re_compile(r'.*-->')
+re_curly = re_compile(r'''(?x)
+    ( (?:^|[^{]) (?:\{\{)* )
+    \{\{
+    (
+        (?:
+            [{}]? [^{}]
+        )*
+        [{}]?
+    )
+    \}\}
+    ( (?:\}\})* (?:[^}]|$) )
+''')
+re_curly_3 = re_compile(r'^(?:'
+    r'СС2'
+r')\|([^|]+)\|([^|]+)\|([^|]+)(?:\|.*)?$')
+re_curly_2 = re_compile(r'^(?:'
+    r'num|число'
+r')\|([^|]+)\|([^|]+)(?:\|.*)?$')
+re_curly_1 = re_compile(r'^(?:'
+    r'num|число|lang-\w+|nobr|вьетнамго|'
+    r'(?:год|year)[^|]*'
+r')\|([^|]+)(?:\|.*)?$')
+re_table = re_compile(r'''(?x)
+    \{\|
+    (
+        (?:
+            [{}]? [^{}]
+        )*
+        [{}]?
+    )
+    \|\}
+''')
+re_square = re_compile(r'''(?xi)
+    (\#(?:redirect|перенаправление)\s*)?
+    ((?:^|[^\[])(?:\[\[)*)\[\[
+    (
+        (?:
+            [\[\]]? [^\[\]]
+        )*
+        [\[\]]?
+    )
+    \]\]((?:\]\])*(?:[^\]]|$))
+''')
+re_square_file = re_compile(r'(?i)^:?(?:'
+    r'File|Файл|Media|Медиа|Category|Категория'
+r')\:.+$')
+re_square_label = re_compile(r'^.+?\|([^|]+?)(?:\|.*)?$')
+re_square_paren = re_compile(r'^([^|(]+?)\s*\(.+?\)\s*\|\s*')
+re_square_prefix = re_compile(r'^.+?\:([^|:]+)\|\s*')
+re_square_interwiki = re_compile(r'^\:?\S+?\:.+')
+re_quotes = re_compile(r"''+")
+re_list = re_compile(r'^[*#:]+')
+re_term_def = re_compile(r'^;([^:]*)\:')
+re_term = re_compile(r'^;([^:]*)')
+re_header_head = re_compile(r'^==+')
+re_header_tail = re_compile(r'\s*==+$')
+re_signature = re_compile(r'\~~~+')
+re_extlink_label = re_compile(r'\[\w+\://\S+\s+([^\[\]]+)\]')
+re_extlink = re_compile(r'\[(\w+\://[^\s\[\]]+)\]')
+re_mailto = re_compile(r'\[mailto\:[^]]+?([^] ]+)\]')
+re_spaces = re_compile(r'[ \t]+')
+INSIDE_TAGS = [(x, '<' + x) for x in ['strike', 'math', 'nowiki', 'ref',
+                                      'gallery', 'imagemap', 'div']]
+
+def _sub_all(pattern, repl, line, marker):
+    """Apply the *pattern* while there is something to replace. The *repl*
+    must shorten the matches, and any match must contain the *marker*"""
+    while marker in line:
+        line, cnt = pattern.subn(repl, line)
+        if not cnt:
+            break
+    return line
+
+def _sub_curly(match):
+    """Replace a template with its meaningful content"""
+    head, res_, tail = match.groups()
+    if '[[' in res_ or ']]' in res_:
+        res = ''
+    else:
+        res = re_curly_3.sub(r'\g<1> \g<2> \g<3>', res_)
+        if res == res_:
+            res = re_curly_2.sub(r'\g<1> \g<2>', res_)
+            if res == res_:
+                res = re_curly_1.sub(r'\g<1>', res_)
+                if res == res_:
+                    res = ''
+    if "''" in res:
+        res = re_quotes.sub('', res)
+    return head + res + tail
+
+def _sub_square(match):
+    """Replace a wiki link with its label"""
+    redir, head, res_, tail = match.groups()
+    if redir:
+        res = ''
+    else:
+        res = re_square_file.sub('', res_)
+        if res == res_:
+            # [[Москва (город)|Москве]] -> Москве
+            res = re_square_label.sub(r'\g<1>', res_)
+            # [[царство (в биологии)|]] -> царство
+            if res == res_:
+                res = re_square_paren.sub(r'\g<1>', res_)
+                if res == res_:
+                    # [[Викизнание: Новости|]] -> Новости
+                    res = re_square_prefix.sub(r'\g<1>', res_)
+                    if res == res_:
+                        # [[sociowiki:Главная Страница]]
+                        # [[:Категория:Газеты Литвы]]
+                        res = re_square_interwiki.sub('', res_)
+    if "''" in res:
+        res = re_quotes.sub('', res)
+    return head + res + tail
+
+SKIP_LINE = object()  # the result of the cleaner for the commented lines
+
+
+class _TextCleaner:
+    """Cleaner of the text of an article. Lines are passed one by one; the
+    cleaner keeps track of the markup that spans several lines. All the
+    patterns are compiled in advance, and the ones that can't match a line
+    are not applied"""
+
+    __slots__ = ('isobject', 'istable', 'issquare', 'iscomment',
+                 'inside_tag', 'tag_cnt')
+
+    def __init__(self):
+        self.isobject = self.istable = self.issquare = 0
+        self.iscomment = False
+        self.inside_tag, self.tag_cnt = None, 0
+
+    def clean(self, line):
+        """Return the clean *line*. If the *line* is inside of a multiline
+        markup, return None. If the *line* is inside of a comment, return
+        SKIP_LINE"""
+        line = unescape(line)
+        if '</' in line:
+            line = _sub_all(re_tag_pair, '', line, '</')
+
+        inside_tag = self.inside_tag
+        if inside_tag:
+            pos = line.rfind('</' + inside_tag + '>')
+            if pos < 0:
+                return None
+            line = line[pos + 3 + len(inside_tag):]
+            self.tag_cnt -= 1
+            if not self.tag_cnt:
+                self.inside_tag = None
+
+        if '<' in line:
+            if '/>' in line:
+                line = re_tag_empty.sub('', line)
+            for token, token_ in INSIDE_TAGS:
+                pos = line.find(token_)
+                if pos >= 0:
+                    line = line[:pos]
+                    self.inside_tag = token
+                    self.tag_cnt += 1
+                    break
 
-    if not silent:
-        print('Process Wikipedia', file=LOG_FILE)
+        line = line.replace('́', '').replace('()', '')
+        if '<' in line:
+            line = re_html.sub(' ', line)
+        if '-->' in line:
+            self.iscomment = False
+        if self.iscomment:
+            return SKIP_LINE
+        if '<!--' in line:
+            self.iscomment = True
+            line = re_comment_head.sub('', line)
+        if '-->' in line:
+            line = re_comment_tail.sub('', line)
+
+        if line == '----':
+            return ''
+
+        if '{{' in line:
+            line = _sub_all(re_curly, _sub_curly, line, '{{')
+        if self.isobject:
+            cnt = line.count('}}')
+            if cnt > 0:
+                line = line[line.rfind('}}') + 2:]
+                self.isobject -= cnt
+
+        if '{|' in line:
+            line = _sub_all(re_table, '', line, '{|')
+        if self.istable:
+            cnt = line.count('|}')
+            if cnt > 0:
+                line_ = line[line.rfind('|}') + 2:]
+                if not line_ or line_[0] != '}':
+                    line = line_
+                    self.istable -= cnt
+
+        if '[[' in line:
+            line = _sub_all(re_square, _sub_square, line, '[[')
+        if self.issquare:
+            cnt = line.count(']]')
+            if cnt > 0:
+                line = line[line.rfind(']]') + 2:]
+                self.issquare -= cnt
+
+        isinside = self.isobject or self.istable or self.issquare
+        if not (self.istable or self.issquare):
+            cnt = line.count('{{')
+            if cnt > 0:
+                line = line[:line.find('{{')]
+                self.isobject += cnt
+        if not (self.isobject or self.issquare):
+            cnt = line.count('{|')
+            if cnt > 0:
+                line = line[:line.find('{|')]
+                self.istable += cnt
+        if not (self.isobject or self.istable):
+            cnt = line.count('[[')
+            if cnt > 0:
+                line = line[:line.find('[[')]
+                self.issquare += cnt
+        if isinside:
+            return None
+
+        if line[:1] in ('*', '#', ':'):
+            line = re_list.sub('', line)
+        if line[:1] == ';':
+            line = re_term_def.sub(r'\g<1>\n', line)
+            if line[:1] == ';':
+                line = re_term.sub(r'\g<1>:', line)
+        if '==' in line:
+            line = re_header_head.sub('', line)
+            line = re_header_tail.sub('\n', line)
+        if '~~~' in line:
+            line = re_signature.sub('', line)
+
+        if '[' in line:
+            if '://' in line:
+                # [http://freebsd.org Сайт FreeBSD] -> Сайт FreeBSD
+                line = re_extlink_label.sub(r' \g<1> ', line)
+                # [http://freebsd.org/] -> http://freebsd.org/
+                line = re_extlink.sub(r' \g<1> ', line)
+            if '[mailto:' in line:
+                # [mailto:name@example.com name@example.com]
+                #     -> name@example.com
+                line = re_mailto.sub(r' \g<1> ', line)
+        if "''" in line:
+            line = re_quotes.sub('', line)
+
+        line = unescape(line)
+        if '\t' in line or '  ' in line:
+            line = re_spaces.sub(' ', line)
+        return line.lstrip()
+
+def _parse_page(lines, namespaces, what=None):
+    """Extract the title and the clean text from the *lines* of one page"""
     id_ = title = text = None
-    isobject = istable = issquare = 0
-    iscomment = False
-    inside_tag, tag_cnt = None, 0
     ready_for_save = False
     enters = 0
     istemplate = False
-    namespaces = set()
+    cleaner = _TextCleaner()
 
-    article_no = -1
-    for line_no, line in enumerate(
-        read_bz2(fpath) if fpath[-4:].lower() == '.bz2' else read_txt()
-    ):
+    for line in lines:
 
         if text is None:
             line = line.strip()
 
-            ns = re_match(r'<namespace \S+ case="first-letter">'
-                          r'([^<]+)</namespace>', line)
-            if ns:
-                ns, = ns.groups()
-                namespaces.add(ns)
-                continue
-
             if line.startswith('<title>'):
                 title = re_html.sub('', line)
                 pos = title.find(':')
@@ -106,13 +513,9 @@ def _get_all(fpath, what=None, silent=False):
                         else:
                             title = None
                             continue
-                article_no += 1
-                if not silent:
-                    print_progress(article_no, end_value=None, step=100000,
-                                   file=LOG_FILE)
                 id_ = None
 
-            elif not id_ and line.startswith('<id>'):
+            elif title and not id_ and line.startswith('<id>'):
                 id_ = re_html.sub('', line)
                 if what == 'titles':
                     yield id_, title.strip()
@@ -127,7 +530,8 @@ def _get_all(fpath, what=None, silent=False):
                 line_isempty = True
             if line.endswith('</text>'):
                 ready_for_save = True
-            line = re_html.sub('', line)
+            if '<' in line:
+                line = re_html.sub('', line)
 
             if istemplate:
                 text += line
@@ -144,236 +548,17 @@ def _get_all(fpath, what=None, silent=False):
             if what and what != 'articles':
                 continue
 
-            continue_processing = True
-            line = unescape(line)
-            line_ = None
-            while line_ != line:
-                if line_ is not None:
-                    line = line_
-                line_ = re_sub(r'<(\w+)(?:\s[^>]*)?>.*?</\1>', '', line)
-
-            if inside_tag:
-                pos = line.rfind('</' + inside_tag + '>')
-                if pos >= 0:
-                    line = line[pos + 3 + len(inside_tag):]
-                    tag_cnt -= 1
-                    if not tag_cnt:
-                        inside_tag = None
-                else:
-                    continue_processing = False
-
-            if continue_processing:
-                line = re_sub('<[^>]+/>', '', line)
-                for token in ('strike', 'math', 'nowiki', 'ref', 'gallery',
-                              'imagemap', 'div'):
-                    pos = line.find('<' + token)
-                    if pos >= 0:
-                        line = line[:pos]
-                        inside_tag = token
-                        tag_cnt += 1
-                        break
-
-                line = line.replace('́', '').replace('()', '')
-                line = re_html.sub(' ', line)
-                if '-->' in line:
-                    iscomment = False
-                if iscomment:
-                    continue
-                if '<!--' in line:
-                    iscomment = True
-                line = re_sub(r'<!--.*', '', line)
-                line = re_sub(r'.*-->', '', line)
-
-                for _ in range(1):
-
-                    if line == '----':
-                        line = ''
-                        break
-
-                    def process_cu(match):
-                        head, res_, tail = match.groups()
-                        if '[[' in res_ or ']]' in res_:
-                            res = ''
-                        else:
-                            res = re_sub(r'^(?:'
-                                r'СС2'
-                            r')\|([^|]+)\|([^|]+)\|([^|]+)(?:\|.*)?$',
-                            '\g<1> \g<2> \g<3>', res_)
-                            if res == res_:
-                                res = re_sub(r'^(?:'
-                                    r'num|число'
-                                r')\|([^|]+)\|([^|]+)(?:\|.*)?$',
-                                '\g<1> \g<2>', res_)
-                                if res == res_:
-                                    res = re_sub(r'^(?:'
-                                        r'num|число|lang-\w+|nobr|вьетнамго|'
-                                        r'(?:год|year)[^|]*'
-                                    r')\|([^|]+)(?:\|.*)?$', '\g<1>', res_)
-                                    if res == res_:
-                                        res = ''
-                        return head + re_sub(r"''+", "", res) + tail
-
-                    line_ = None
-                    while line_ != line:
-                        if line_ is not None:
-                            line = line_
-                        line_ = re_sub(r'''(?x)
-                            ( (?:^|[^{]) (?:\{\{)* )
-                            \{\{
-                            (
-                                (?:
-                                    [{}]? [^{}]
-                                )*
-                                [{}]?
-                            )
-                            \}\}
-                            ( (?:\}\})* (?:[^}]|$) )
-                        ''', process_cu, line)
-                    if isobject:
-                        cnt = line.count('}}')
-                        if cnt > 0:
-                            pos = line.rfind('}}')
-                            if pos >= 0:
-                                line = line[pos + 2:]
-                                isobject -= cnt
-                    else:
-                        line.replace('}}', '')  # just in case
-
-                    line_ = None
-                    while line_ != line:
-                        if line_ is not None:
-                            line = line_
-                        line_ = re_sub(r'''(?x)
-                            \{\|
-                            (
-                                (?:
-                                    [{}]? [^{}]
-                                )*
-                                [{}]?
-                            )
-                            \|\}
-                        ''', '', line)
-                    if istable:
-                        cnt = line.count('|}')
-                        if cnt > 0:
-                            pos = line.rfind('|}')
-                            if pos >= 0:
-                                line_ = line[pos + 2:]
-                                if not line_ or line_[0] != '}':
-                                    line = line_
-                                    istable -= cnt
-                    else:
-                        line.replace('|}', '')  # just in case
-
-                    def process_sq(match):
-                        redir, head, res_, tail = match.groups()
-                        if redir:
-                            res = ''
-                        else:
-                            res = re_sub(r'(?i)^:?(?:'
-                                r'File|Файл|Media|Медиа|Category|Категория'
-                            r')\:.+$', '', res_)
-                            if res == res_:
-                                # [[Москва (город)|Москве]] -> Москве
-                                res = re_sub(r'^.+?\|([^|]+?)(?:\|.*)?$', '\g<1>', res_)
-                                # [[царство (в биологии)|]] -> царство
-                                if res == res_:
-                                    res = re_sub(r'^([^|(]+?)\s*\(.+?\)\s*\|\s*',
-                                                 '\g<1>', res_)
-                                    if res == res_:
-                                        # [[Викизнание: Новости|]] -> Новости
-                                        res = re_sub(r'^.+?\:([^|:]+)\|\s*',
-                                                     '\g<1>', res_)
-                                        if res == res_:
-                                            # [[sociowiki:Главная Страница]]
-                                            # [[:Категория:Газеты Литвы]]
-                                            res = re_sub(r'^\:?\S+?\:.+',
-                                                         '', res_)
-                                            #if res == res_:
-                                            #    # [[тест]] -> тест
-                                            #    pass
-                        return head + re_sub(r"''+", "", res) + tail
-
-                    line_ = None
-                    while line_ != line:
-                        if line_ is not None:
-                            line = line_
-                        line_ = re_sub(r'''(?xi)
-                            (\#(?:redirect|перенаправление)\s*)?
-                            ((?:^|[^\[])(?:\[\[)*)\[\[
-                            (
-                                (?:
-                                    [\[\]]? [^\[\]]
-                                )*
-                                [\[\]]?
-                            )
-                            \]\]((?:\]\])*(?:[^\]]|$))
-                        ''', process_sq, line)
-                    if issquare:
-                        cnt = line.count(']]')
-                        if cnt > 0:
-                            pos = line.rfind(']]')
-                            if pos >= 0:
-                                line = line[pos + 2:]
-                                issquare -= cnt
-                    else:
-                        line.replace(']]', '')  # just in case
-
-                    isobject_, istable_, issquare_ = isobject, istable, issquare
-                    if not (istable or issquare):
-                        cnt = line.count('{{')
-                        if cnt > 0:
-                            pos = line.find('{{')
-                            if pos >= 0:
-                                line = line[:pos]
-                                isobject += cnt
-                    if not (isobject or issquare):
-                        cnt = line.count('{|')
-                        if cnt > 0:
-                            pos = line.find('{|')
-                            if pos >= 0:
-                                line = line[:pos]
-                                istable += cnt
-                    if not (isobject or istable):
-                        cnt = line.count('[[')
-                        if cnt > 0:
-                            pos = line.find('[[')
-                            if pos >= 0:
-                                line = line[:pos]
-                                issquare += cnt
-                    if isobject_ or istable_ or issquare_:
-                        continue
-
-                    line_ = line = re_sub(r'^[*#:]+', '', line)
-                    line = re_sub(r'^;([^:]*)\:', '\g<1>\n', line)
-                    line = re_sub(r'^;([^:]*)', '\g<1>:', line)
-                    #line = re_sub(r'^;', '', line)
-                    line = re_sub(r'^==+', '', line)
-                    line = re_sub(r'\s*==+$', '\n', line)
-                    line = re_sub(r'\~~~+', '', line)
-
-                    # [http://freebsd.org Сайт FreeBSD] -> Сайт FreeBSD
-                    line = re_sub(r'\[\w+\://\S+\s+([^\[\]]+)\]', ' \g<1> ', line)
-                    # [http://freebsd.org/] -> http://freebsd.org/
-                    line = re_sub(r'\[(\w+\://[^\s\[\]]+)\]', ' \g<1> ', line)
-                    # [mailto:name@example.com name@example.com] -> name@example.com
-                    line = re_sub('\[mailto\:[^]]+?([^] ]+)\]', ' \g<1> ', line)
-                    line = re_sub(r"''+", "", line)
-                    break
-                else:
-                    continue_processing = False
-
-                if continue_processing:
-                    line = unescape(line)
-                    line = re_sub(r'[ \t]+', ' ', line)
-                    line = line.lstrip()
-                    if line != '':
-                        enters = line[-1] == '\n'
-                    text += line
-                    if enters < 2 and not ready_for_save:
-                        if line != '' or line_isempty:
-                            text += '\n'
-                            enters += 1
+            line = cleaner.clean(line)
+            if line is SKIP_LINE:
+                continue
+            if line is not None:
+                if line != '':
+                    enters = line[-1] == '\n'
+                text += line
+                if enters < 2 and not ready_for_save:
+                    if line != '' or line_isempty:
+                        text += '\n'
+                        enters += 1
 
         if ready_for_save:
             if text and enters:
@@ -381,26 +566,286 @@ def _get_all(fpath, what=None, silent=False):
             yield (id_, title.strip(), text) if what else \
                   (id_, title.strip(), text, None)
             id_ = title = text = None
-            isobject = istable = issquare = 0
-            iscomment = False
-            inside_tag, tag_cnt = None, 0
+            cleaner = _TextCleaner()
             ready_for_save = False
             enters = 0
 
-    if article_no >= 0:
-        if text:
-            text = re_spenter.sub('\n', text).strip()
-            yield (id_, title.strip(), text) if what else \
-                  (id_, title.strip(), 
-                   None if istemplate else text,
-                   text if istemplate else None)
-            article_no += 1
-        article_no += 1
-        if not silent:
-            print_progress(article_no, end_value=0, step=100000, file=LOG_FILE)
-            print('Wikipedia has been processed: {} lines, {} articles'
-                      .format(line_no + 1, article_no),
-                  file=LOG_FILE)
+    if text:
+        text = re_spenter.sub('\n', text).strip()
+        yield (id_, title.strip(), text) if what else \
+              (id_, title.strip(),
+               None if istemplate else text,
+               text if istemplate else None)
+
+def _get_all(fpath, what=None, silent=False, workers=1, ordered=True,
+             index=None):
+    """Process the dump *fpath*. If *workers* is not 1, the pages are
+    processed in a pool of *workers* processes (None means the number of
+    CPUs). With *ordered*=False, the results are returned in the order they
+    become ready. If *index* of the multistream dump is given, the workers
+    decompress the bz2 streams themselves"""
+
+    num_lines = 0
+    def read_lines():
+        nonlocal num_lines
+        for num_lines, line in enumerate(
+            read_bz2(fpath) if fpath[-4:].lower() == '.bz2' else
+            _read_txt(fpath),
+            start=1
+        ):
+            yield line
+
+    if not silent:
+        print('Process Wikipedia', file=LOG_FILE)
+    use_streams = index is not None and workers != 1
+    if use_streams:
+        func = _parse_streams
+        tasks = ((fpath, start, end, index.namespaces, what)
+                     for start, end in index.chunks())
+    else:
+        func = _parse_chunk
+        namespaces = set()
+        tasks = ((x, namespaces, what)
+                     for x in _read_chunks(read_lines(), namespaces))
+    article_no = 0
+    pool = None if workers == 1 else Pool(processes=workers)
+    try:
+        for chunk in (
+            map(func, tasks) if pool is None else
+            imap_bounded(pool, func, tasks,
+                         max_pending=2 * (workers or cpu_count() or 1),
+                         ordered=ordered)
+        ):
+            if use_streams:
+                chunk_lines, chunk = chunk
+                num_lines += chunk_lines
+            for res in chunk:
+                yield res
+                if not silent and not article_no % 100:
+                    print_progress(article_no, end_value=None, step=100000,
+                                   file=LOG_FILE)
+                article_no += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if not silent and article_no:
+        print_progress(article_no, end_value=0, step=100000, file=LOG_FILE)
+        print('Wikipedia has been processed: {} lines, {} articles'
+                  .format(num_lines, article_no),
+              file=LOG_FILE)
+
+def _get_page_revision(page):
+    """Return the id and the revision id of the *page* from its raw lines"""
+    page_id = None
+    isrevision = False
+    for line in page:
+        line = line.strip()
+        if line.startswith('<id>'):
+            if isrevision:
+                return page_id, re_html.sub('', line)
+            if page_id is None:
+                page_id = re_html.sub('', line)
+        elif line == '<revision>':
+            isrevision = True
+        elif line.startswith('<text '):
+            break
+    return page_id, None
+
+def _load_checkpoint(dpath):
+    """Return the checkpoint of the extraction into *dpath* or None if the
+    extraction has not been started"""
+    fpath = os.path.join(dpath, CHECKPOINT_FNAME)
+    if not os.path.isfile(fpath):
+        return None
+    with open(fpath, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_checkpoint(dpath, checkpoint):
+    fpath = os.path.join(dpath, CHECKPOINT_FNAME)
+    with open(fpath + '$', 'wt', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(fpath + '$', fpath)
+
+def _load_revisions(dpath):
+    """Return the revision ids of the pages from the previous extraction
+    into *dpath* as a dict {page_id: revision_id}"""
+    checkpoint = _load_checkpoint(dpath)
+    assert checkpoint, 'ERROR: No extracted corpus in "{}"'.format(dpath)
+    with open(os.path.join(dpath, REVISIONS_FNAME), 'rb') as f:
+        data = f.read(checkpoint['revisions_bytes'])
+    return dict(x.split('\t') for x in data.decode('utf-8').splitlines())
+
+def _read_streams_from(fpath, index, start):
+    """Read the lines of the multistream dump *fpath* beginning from the
+    stream at the offset *start*"""
+    for start, end in index.chunks(start=start):
+        for line in _read_streams(fpath, start, end):
+            yield line
+
+def _extract_articles(fpath, dpath, shard_size=SHARD_SIZE,
+                      checkpoint_step=CHECKPOINT_STEP, prev_dpath=None,
+                      silent=False, workers=1, index=None):
+    """Save clean texts of the articles of the dump *fpath* into the shards
+    in the directory *dpath*. Every *checkpoint_step* pages, the state of
+    the extraction is saved, and if the directory already has a checkpoint,
+    the extraction is continued from it. If *prev_dpath* is given, the
+    pages which revisions are the same as in the extraction from the
+    previous dump into *prev_dpath* are skipped. If *index* of the
+    multistream dump is given, it's used to find the position to continue
+    from"""
+    dump = [os.path.basename(fpath), os.path.getsize(fpath)]
+    checkpoint = _load_checkpoint(dpath)
+    if checkpoint is None:
+        os.makedirs(dpath, exist_ok=True)
+        checkpoint = {'dump': dump, 'namespaces': None, 'pages': 0,
+                      'page_id': None, 'unchanged': 0, 'articles': 0,
+                      'shard_no': 0, 'shard_articles': 0, 'shard_bytes': 0,
+                      'revisions_bytes': 0, 'done': False}
+    elif checkpoint['dump'] != dump:
+        raise ValueError('ERROR: The checkpoint in "{}" was made for '
+                         'another dump'.format(dpath))
+    if checkpoint['done']:
+        return checkpoint['articles']
+    prev_revisions = _load_revisions(prev_dpath) if prev_dpath else {}
+
+    if not silent:
+        print('Extract Wikipedia articles' + (
+                  ' (continue from page {})'.format(checkpoint['pages'])
+                      if checkpoint['pages'] else
+                  ''
+              ), file=LOG_FILE)
+    num_pages, page_id = checkpoint['pages'], checkpoint['page_id']
+    bounds = index.find_id(int(page_id)) if index and page_id else None
+    if bounds:
+        namespaces = set(checkpoint['namespaces'])
+        pages = _read_pages(_read_streams_from(fpath, index, bounds[0]),
+                            set())
+        for page in pages:
+            if _get_page_revision(page)[0] == page_id:
+                break
+        else:
+            raise ValueError('ERROR: The dump "{}" does not match the '
+                             'checkpoint in "{}"'.format(fpath, dpath))
+    else:
+        namespaces = set()
+        pages = _read_pages(read_bz2(fpath)
+                                if fpath[-4:].lower() == '.bz2' else
+                            _read_txt(fpath), namespaces)
+        if num_pages:
+            page_id_ = None
+            for page in islice(pages, num_pages):
+                page_id_ = _get_page_revision(page)[0] or page_id_
+            if page_id_ != page_id:
+                raise ValueError('ERROR: The dump "{}" does not match the '
+                                 'checkpoint in "{}"'.format(fpath, dpath))
+
+    metas = deque()  # the state after each chunk of pages
+    def get_tasks(start_page, start_page_id):
+        chunk, revisions, num_unchanged = [], [], 0
+        page_id, page_no = start_page_id, None
+        for page_no, page in enumerate(pages, start=start_page + 1):
+            page_id_, revision_id = _get_page_revision(page)
+            if page_id_ is not None:
+                page_id = page_id_
+                if revision_id is not None:
+                    revisions.append('{}\t{}\n'.format(page_id, revision_id))
+                    if prev_revisions.get(page_id) == revision_id:
+                        page = None
+                        num_unchanged += 1
+            if page is not None:
+                chunk.append(page)
+            if not (page_no - start_page) % CHUNK_SIZE:
+                metas.append((page_no, page_id, revisions, num_unchanged))
+                yield chunk, namespaces, 'articles'
+                chunk, revisions, num_unchanged = [], [], 0
+        if page_no is not None and (page_no - start_page) % CHUNK_SIZE:
+            metas.append((page_no, page_id, revisions, num_unchanged))
+            yield chunk, namespaces, 'articles'
+
+    shard = revisions_file = None
+    def open_files():
+        nonlocal shard, revisions_file
+        shard = open(os.path.join(dpath, SHARD_FNAME.format(
+            checkpoint['shard_no']
+        )), 'ab')
+        shard.truncate(checkpoint['shard_bytes'])
+        if revisions_file is None:
+            revisions_file = open(os.path.join(dpath, REVISIONS_FNAME), 'ab')
+            revisions_file.truncate(checkpoint['revisions_bytes'])
+
+    def make_checkpoint(done=False):
+        for f in [shard, revisions_file]:
+            f.flush()
+            os.fsync(f.fileno())
+        checkpoint.update(namespaces=sorted(namespaces), pages=num_pages,
+                          page_id=page_id, shard_bytes=shard.tell(),
+                          revisions_bytes=revisions_file.tell(), done=done)
+        _save_checkpoint(dpath, checkpoint)
+
+    num_pages_, tasks = num_pages, get_tasks(num_pages, page_id)
+    pool = None if workers == 1 else Pool(processes=workers)
+    try:
+        open_files()
+        for chunk in (
+            map(_parse_chunk, tasks) if pool is None else
+            imap_bounded(pool, _parse_chunk, tasks,
+                         max_pending=2 * (workers or cpu_count() or 1))
+        ):
+            num_pages, page_id, revisions, num_unchanged = metas.popleft()
+            for article in chunk:
+                if checkpoint['shard_articles'] >= shard_size:
+                    shard.close()
+                    checkpoint['shard_no'] += 1
+                    checkpoint['shard_articles'] = 0
+                    checkpoint['shard_bytes'] = 0
+                    open_files()
+                shard.write(json.dumps(article, ensure_ascii=False)
+                                .encode('utf-8') + b'\n')
+                checkpoint['shard_articles'] += 1
+                checkpoint['articles'] += 1
+            revisions_file.write(''.join(revisions).encode('utf-8'))
+            checkpoint['unchanged'] += num_unchanged
+            if num_pages - num_pages_ >= checkpoint_step:
+                make_checkpoint()
+                num_pages_ = num_pages
+                if not silent:
+                    print_progress(num_pages, end_value=None,
+                                   step=checkpoint_step, file=LOG_FILE)
+        make_checkpoint(done=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for f in [shard, revisions_file]:
+            if f is not None:
+                f.close()
+    if not silent:
+        print_progress(num_pages, end_value=0, step=checkpoint_step,
+                       file=LOG_FILE)
+        print('Wikipedia articles have been extracted: {} pages ({} '
+              'unchanged), {} articles'.format(num_pages,
+                                               checkpoint['unchanged'],
+                                               checkpoint['articles']),
+              file=LOG_FILE)
+    return checkpoint['articles']
+
+def load_articles(dpath):
+    """Return the articles extracted by ``Wikipedia.extract_articles()``
+    into the directory *dpath*. Only the articles saved before the last
+    checkpoint are returned.
+
+    :return: iterator of (<article id>, <article title>, <article text>)
+    """
+    checkpoint = _load_checkpoint(dpath)
+    assert checkpoint, 'ERROR: No extracted corpus in "{}"'.format(dpath)
+    for shard_no in range(checkpoint['shard_no'] + 1):
+        with open(os.path.join(dpath, SHARD_FNAME.format(shard_no)),
+                  'rb') as f:
+            data = f.read() if shard_no < checkpoint['shard_no'] else \
+                   f.read(checkpoint['shard_bytes'])
+        for line in data.decode('utf-8').splitlines():
+            yield tuple(json.loads(line))
 
 
 class Wikipedia(_AbstractCorpus):
@@ -409,28 +854,129 @@ class Wikipedia(_AbstractCorpus):
     name = 'Wikipedia'
     _dl_name = 'download_wikipedia'
 
-    def __init__(self, lang='RU', fpath=None, silent=False):
+    def __init__(self, lang='RU', fpath=None, silent=False,
+                 multistream=False, index_fpath=None):
+        """
+        :param multistream: if True, the dump is the multistream variant
+                            that has the index. Then, ``.get_article()`` is
+                            available, and the workers of ``.articles()``,
+                            etc. decompress the dump in parallel
+        :param index_fpath: path to the index of the multistream dump. If
+                            None, the index is searched near the dump
+        """
         self.name = _consts(lang=lang)['name']
         self._lang = lang
         if fpath:
             self._fpath = fpath
         self._silent = silent
+        self._multistream = multistream or bool(index_fpath)
+        if index_fpath:
+            self._index_fpath = index_fpath
+        self._index = None
 
     def _get_fpath(self):
-        consts = _consts(lang=self._lang)
+        consts = _consts(lang=self._lang, multistream=self._multistream)
         fpath = self._fpath if hasattr(self, '_fpath') else \
                 get_corpus_fpath(dname=consts['dname'], url=consts['url'])
         self.isfile(fpath)
         return fpath
 
-    def titles(self, silent=None):
+    def _get_index(self):
+        if not self._multistream:
+            return None
+        if self._index is None:
+            fpath = self._get_fpath()
+            if hasattr(self, '_index_fpath'):
+                index_fpath = self._index_fpath
+            elif hasattr(self, '_fpath'):
+                index_fpath = re_sub(r'\.xml\.bz2$', '-index.txt.bz2', fpath)
+            else:
+                consts = _consts(lang=self._lang, multistream=True)
+                index_fpath = get_corpus_fpath(dname=consts['dname'],
+                                               url=consts['index_url'])
+            self.isfile(index_fpath)
+            self._index = _MultistreamIndex(index_fpath, fpath)
+        return self._index
+
+    def titles(self, silent=None, workers=1, ordered=True):
         return _get_titles(self._get_fpath(),
-                           self._silent if silent is None else silent)
-
-    def articles(self, silent=None):
+                           self._silent if silent is None else silent,
+                           workers=workers, ordered=ordered,
+                           index=self._get_index() if workers != 1 else None)
+
+    def articles(self, silent=None, workers=1, ordered=True):
+        """Return clean texts of the articles.
+
+        :param workers: number of worker processes for the cleaning. If 1
+                        (default), the dump is processed in the current
+                        process. If None, the number of CPUs is used
+        :type workers: int
+        :param ordered: if True (default), the articles are returned in the
+                        order of the dump. Elsewise, in the order they become
+                        ready
+        :type ordered: bool
+        """
         return _get_articles(self._get_fpath(),
-                             self._silent if silent is None else silent)
+                             self._silent if silent is None else silent,
+                             workers=workers, ordered=ordered,
+                             index=self._get_index() if workers != 1 else
+                                   None)
 
-    def templates(self, silent=None):
+    def templates(self, silent=None, workers=1, ordered=True):
         return _get_templates(self._get_fpath(),
-                              self._silent if silent is None else silent)
+                              self._silent if silent is None else silent,
+                              workers=workers, ordered=ordered,
+                              index=self._get_index() if workers != 1 else
+                                    None)
+
+    def extract_articles(self, dpath, shard_size=SHARD_SIZE,
+                         checkpoint_step=CHECKPOINT_STEP, prev_dpath=None,
+                         silent=None, workers=1):
+        """Save clean texts of the articles into the directory *dpath*. The
+        extraction can be interrupted at any moment: invoked again with the
+        same *dpath*, it continues from the last checkpoint. Use
+        ``load_articles()`` to read the result.
+
+        :param shard_size: max number of articles in one file of the output
+        :type shard_size: int
+        :param checkpoint_step: number of pages between checkpoints
+        :type checkpoint_step: int
+        :param prev_dpath: the directory with the articles extracted from
+                           the previous dump. If specified, the pages with
+                           the same revisions as in there are skipped
+        :type prev_dpath: str
+        :param workers: number of worker processes for the cleaning
+        :type workers: int
+        :return: total number of the articles extracted into *dpath*
+        :rtype: int
+        """
+        return _extract_articles(self._get_fpath(), dpath,
+                                 shard_size=shard_size,
+                                 checkpoint_step=checkpoint_step,
+                                 prev_dpath=prev_dpath,
+                                 silent=self._silent if silent is None else
+                                        silent,
+                                 workers=workers, index=self._get_index())
+
+    def get_article(self, article_id=None, title=None):
+        """Return the article with the *article_id* or the *title* from the
+        multistream dump. Only the bz2 stream that contains the article is
+        decompressed. The index of the dump is loaded with the first call.
+
+        :type article_id: int|str
+        :type title: str
+        :return: (<article id>, <article title>, <article text>) or None if
+                 the article is not found
+        :rtype: tuple(str, str, str)
+        """
+        assert self._multistream, \
+            'ERROR: Random access requires the multistream dump'
+        assert (article_id is None) != (title is None), \
+            'ERROR: Either *article_id* or *title* must be specified'
+        index = self._get_index()
+        if article_id is not None:
+            return index.get_page(int(article_id), what='articles')
+        for article_id in index.find_title(title):
+            res = index.get_page(article_id, what='articles')
+            if res and unescape(res[1]) == title:
+                return res
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Corpuscula project: bz2 reading benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Benchmarks for ``corpuscula.utils.read_bz2()``. Usage:
+
+    bench_bz2.py [<file.bz2>]
+
+If the file is not specified, a synthetic multistream dump is created from
+the pages of the test *Wikipedia* dump.
+"""
+from bz2 import compress, open as bz2_open
+import os
+import re
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+###
+import sys
+sys.path.append(os.path.join(SCRIPT_DIR, '..'))
+###
+from corpuscula.utils import read_bz2
+from bench_wikipedia import make_dump
+
+PAGES_PER_STREAM = 100
+
+
+def make_multistream(fpath, bz2_fpath, pages_per_stream=PAGES_PER_STREAM):
+    """Compress the dump *fpath* into the multistream *bz2_fpath* with
+    *pages_per_stream* pages in a stream"""
+    with open(fpath, encoding='utf-8') as f:
+        dump = f.read()
+    pages = re.findall(r'  <page>.*?</page>\n', dump, re.S)
+    streams = [dump[:dump.index('  <page>')]] \
+            + [''.join(pages[i:i + pages_per_stream])
+                   for i in range(0, len(pages), pages_per_stream)] \
+            + [dump[dump.rindex('</page>\n') + 8:]]
+    with open(bz2_fpath, 'wb') as f:
+        for stream in streams:
+            f.write(compress(stream.encode('utf-8')))
+
+def read_bz2_stdlib(apath, encoding='utf-8', errors='ignore'):
+    """The previous implementation of ``read_bz2()``"""
+    with bz2_open(apath, mode='rt', encoding=encoding, errors=errors) as f:
+        for line in f:
+            yield line
+
+def bench(name, func, num_bytes):
+    time0 = time.perf_counter()
+    num_lines = sum(1 for _ in func())
+    elapsed = time.perf_counter() - time0
+    print('{:<40} {:8.3f} s {:8.1f} MB/s {:10} lines'
+              .format(name, elapsed, num_bytes / elapsed / 1e6, num_lines))
+
+
+if __name__ == '__main__':
+    tmp_fpaths = []
+    if len(sys.argv) > 1:
+        fpath = sys.argv[1]
+    else:
+        for suffix in ['.xml', '.xml.bz2']:
+            fd, tmp_fpath = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            tmp_fpaths.append(tmp_fpath)
+        make_dump(tmp_fpaths[0], num_copies=3000)
+        make_multistream(*tmp_fpaths)
+        fpath = tmp_fpaths[1]
+    try:
+        with bz2_open(fpath, 'rb') as f:
+            num_bytes = sum(len(x) for x in iter(lambda: f.read(1 << 20),
+                                                 b''))
+        print('File: {} ({} bytes, {} bytes decompressed)'
+                  .format(fpath, os.path.getsize(fpath), num_bytes))
+        assert list(read_bz2(fpath, workers=2)) == \
+               list(read_bz2_stdlib(fpath))
+        bench('bz2.open()', lambda: read_bz2_stdlib(fpath), num_bytes)
+        bench('read_bz2(), current thread',
+              lambda: read_bz2(fpath, workers=0), num_bytes)
+        bench('read_bz2(), background thread',
+              lambda: read_bz2(fpath, workers=1), num_bytes)
+        for workers in [2, 4]:
+            bench('read_bz2(), {} workers'.format(workers),
+                  lambda: read_bz2(fpath, workers=workers), num_bytes)
+    finally:
+        for tmp_fpath in tmp_fpaths:
+            os.remove(tmp_fpath)
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Corpuscula project: CoNLL-U benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Benchmarks for the ``Conllu`` class. Usage:
+
+    bench_conllu.py [<corpus.conllu>]
+
+If the corpus is not specified, a synthetic one will be generated. The
+benchmark of ``Conllu.fix()`` always runs on synthetic long sentences.
+"""
+from collections import OrderedDict
+import os
+import random
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+###
+import sys
+sys.path.append(os.path.join(SCRIPT_DIR, '..'))
+###
+from corpuscula import Conllu
+
+
+def make_corpus(fpath, num_sents=20000, seed=42):
+    """Generate a synthetic corpus in CoNLL-U format"""
+    rnd = random.Random(seed)
+    feats = ['Animacy=Inan', 'Case=Nom', 'Gender=Fem', 'Number=Sing',
+             'Tense=Past', 'VerbForm=Fin']
+    with open(fpath, 'wt', encoding='utf-8') as f:
+        for sent_no in range(num_sents):
+            num_tokens = rnd.randint(3, 30)
+            print('# sent_id = {}'.format(sent_no + 1), file=f)
+            print('# text = ' + ' '.join('слово' for _ in range(num_tokens)),
+                  file=f)
+            for id_ in range(1, num_tokens + 1):
+                head = rnd.randint(0, num_tokens)
+                print('\t'.join((
+                    str(id_), 'слово', 'слово', 'NOUN', '_',
+                    '|'.join(sorted(rnd.sample(feats, 3))), str(head),
+                    'nmod', '{}:nmod'.format(head),
+                    'SpaceAfter=No' if id_ == num_tokens else '_'
+                )), file=f)
+            print(file=f)
+
+def bench(name, func, num_tokens):
+    time0 = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - time0
+    print('{:<40} {:8.3f} s {:12.0f} tokens/s'
+              .format(name, elapsed, num_tokens / elapsed))
+
+def bench_load(fpath):
+    num_tokens = sum(len(x) for x, _ in Conllu.load(fpath, fix=False,
+                                                    fast=True,
+                                                    log_file=None))
+    print('Corpus: {} ({} tokens)'.format(fpath, num_tokens))
+
+    def load(fast, touch_feats=False):
+        for sentence, _ in Conllu.load(fpath, fix=False, fast=fast,
+                                       log_file=None):
+            if touch_feats:
+                for token in sentence:
+                    len(token['FEATS'])
+
+    bench('load(fix=False)', lambda: load(False), num_tokens)
+    bench('load(fix=False, fast=True)', lambda: load(True), num_tokens)
+    bench('load(fix=False, fast=True) + FEATS',
+          lambda: load(True, touch_feats=True), num_tokens)
+
+def bench_save(fpath, dpath):
+    corpus = list(Conllu.load(fpath, fix=False, fast=True, log_file=None))
+    num_tokens = sum(len(x) for x, _ in corpus)
+
+    def save(fname, **kwargs):
+        Conllu.save(corpus, os.path.join(dpath, fname), fix=False,
+                    log_file=None, **kwargs)
+
+    bench('save(fix=False, presorted=True)',
+          lambda: save('bench$.conllu', presorted=True), num_tokens)
+    corpus = list(Conllu.load(fpath, fix=False, log_file=None))
+    bench('save(fix=False)', lambda: save('bench$.conllu'), num_tokens)
+    bench('save(fix=False) to .gz', lambda: save('bench$.conllu.gz'),
+          num_tokens)
+    bench('get_as_text(fix=False)',
+          lambda: list(Conllu.get_as_text(corpus, fix=False,
+                                          log_file=None)),
+          num_tokens)
+    for fname in ['bench$.conllu', 'bench$.conllu.gz']:
+        os.remove(os.path.join(dpath, fname))
+
+def make_long_sentence(num_tokens, seed=42):
+    """Generate a sentence in Parsed CoNLL-U format where every third token
+    is a punctuation mark (to be dropped with adjust_for_speech=True)"""
+    rnd = random.Random(seed)
+    sentence = []
+    for id_ in range(1, num_tokens + 1):
+        head = str(rnd.randint(0, num_tokens))
+        sentence.append({
+            'ID': str(id_), 'FORM': ',' if id_ % 3 == 0 else 'Слово',
+            'LEMMA': 'слово', 'UPOS': 'NOUN', 'XPOS': None,
+            'FEATS': OrderedDict(), 'HEAD': head, 'DEPREL': 'nmod',
+            'DEPS': head + ':nmod', 'MISC': OrderedDict()
+        })
+    return sentence
+
+def bench_fix(sent_lens=(100, 1000, 10000), num_tokens=100000):
+    print('Conllu.fix(adjust_for_speech=True) on long sentences')
+    for sent_len in sent_lens:
+        sentence = make_long_sentence(sent_len)
+        corpus = [[x.copy() for x in sentence]
+                      for _ in range(max(num_tokens // sent_len, 1))]
+        bench('sentence length {}'.format(sent_len),
+              lambda: list(Conllu.fix(corpus, adjust_for_speech=True)),
+              len(corpus) * sent_len)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as dpath:
+        if len(sys.argv) > 1:
+            fpath = sys.argv[1]
+        else:
+            fpath = os.path.join(dpath, 'bench.conllu')
+            make_corpus(fpath)
+        bench_load(fpath)
+        bench_save(fpath, dpath)
+    bench_fix()
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Corpuscula project: Corpus Dictionary benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Benchmarks for the ``CorpusDict`` class. Usage:
+
+    bench_corpus_dict.py [<corpus.conllu>]
+
+If the corpus is not specified, a synthetic one will be generated. The last
+10% of sentences of the corpus are used for predictions, the rest is used for
+training. Predictions are measured with the cache of predictions disabled and
+enabled.
+"""
+from collections import OrderedDict
+import copy
+import os
+import random
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+###
+import sys
+sys.path.append(os.path.join(SCRIPT_DIR, '..'))
+###
+from corpuscula import Conllu, CorpusDict
+from corpuscula.corpus_dict import PREDICT_CACHE_SIZE, fit_counts_numpy
+
+PARADIGMS = {
+    'NOUN': [('а', 'а', 'Case=Nom|Number=Sing'),
+             ('ы', 'а', 'Case=Gen|Number=Sing'),
+             ('е', 'а', 'Case=Loc|Number=Sing'),
+             ('ами', 'а', 'Case=Ins|Number=Plur')],
+    'VERB': [('ать', 'ать', 'VerbForm=Inf'),
+             ('ает', 'ать', 'Number=Sing|Person=3|VerbForm=Fin'),
+             ('ал', 'ать', 'Gender=Masc|Tense=Past|VerbForm=Fin'),
+             ('али', 'ать', 'Number=Plur|Tense=Past|VerbForm=Fin')],
+    'ADJ': [('ый', 'ый', 'Case=Nom|Gender=Masc'),
+            ('ого', 'ый', 'Case=Gen|Gender=Masc'),
+            ('ая', 'ый', 'Case=Nom|Gender=Fem'),
+            ('ые', 'ый', 'Case=Nom|Number=Plur')]
+}
+
+
+def make_corpus(num_sents=20000, num_lemmata=5000, seed=42):
+    """Generate a synthetic corpus in Parsed CoNLL-U format with a Zipfian
+    distribution of lemmata"""
+    rnd = random.Random(seed)
+    letters = 'бвгдзклмнпрстхаеиоу'
+    tags = sorted(PARADIGMS)
+    stems = [(''.join(rnd.choice(letters) for _ in range(rnd.randint(2, 7))),
+              rnd.choice(tags))
+                 for _ in range(num_lemmata)]
+    corpus = []
+    for _ in range(num_sents):
+        sentence = []
+        for id_ in range(1, rnd.randint(3, 20) + 1):
+            stem, tag = stems[int(rnd.paretovariate(.7)) % num_lemmata]
+            wed, led, feats = rnd.choice(PARADIGMS[tag])
+            sentence.append({
+                'ID': str(id_), 'FORM': stem + wed, 'LEMMA': stem + led,
+                'UPOS': tag, 'XPOS': None,
+                'FEATS': OrderedDict(x.split('=') for x in feats.split('|')),
+                'HEAD': None, 'DEPREL': None, 'DEPS': None,
+                'MISC': OrderedDict()
+            })
+        sentence[0]['FORM'] = sentence[0]['FORM'].title()
+        corpus.append((sentence, OrderedDict()))
+    return corpus
+
+def bench(name, func, num_tokens):
+    time0 = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - time0
+    print('{:<40} {:8.3f} s {:12.0f} tokens/s'
+              .format(name, elapsed, num_tokens / elapsed))
+
+def bench_fit(cdict):
+    num_tokens = sum(x for x in cdict._wform_tag_cnts.values()
+                       for x in x.values() for x in x.values())
+    print('Fit for {} tokens'.format(num_tokens))
+    bench('fit()', lambda: cdict.fit(use_numpy=False, log_file=None),
+          num_tokens)
+    if fit_counts_numpy:
+        bench('fit(use_numpy=True)',
+              lambda: cdict.fit(use_numpy=True, log_file=None), num_tokens)
+
+def bench_predict(cdict, corpus):
+    tokens = [x for x, _ in corpus for x in x
+                  if x['FORM'] and x['ID'].isdecimal()
+                                and x['UPOS'] in cdict._tags_id]
+    wforms = [x['FORM'] for x in tokens]
+    isfirsts = [x['ID'] == '1' for x in tokens]
+    pairs = [(x['FORM'], x['UPOS']) for x in tokens]
+    triples = [(x['FORM'], x['LEMMA'], x['UPOS']) for x in tokens]
+    num_tokens = len(tokens)
+    print('Predictions for {} tokens'.format(num_tokens))
+
+    def predict_feats():
+        for wform, lemma, tag in triples:
+            tag_id = cdict._tags_id[tag]
+            for feat in sorted(cdict._feats[x]
+                                   for x in cdict._tag_feats[tag_id]):
+                cdict.predict_feat(feat, wform, lemma, tag)
+
+    corpus = copy.deepcopy(corpus)
+    for sentence, _ in corpus:
+        for token in sentence:
+            token['UPOS'] = token['LEMMA'] = None
+            token['FEATS'] = OrderedDict()
+
+    def predict_sentences():
+        for sentence in corpus:
+            cdict.predict_sentence(sentence, overwrite=True)
+
+    bench('predict_tag()',
+          lambda: [cdict.predict_tag(x, isfirst=y)
+                       for x, y in zip(wforms, isfirsts)], num_tokens)
+    bench('predict_tags()', lambda: cdict.predict_tags(wforms, isfirsts),
+          num_tokens)
+    bench('predict_lemma()',
+          lambda: [cdict.predict_lemma(x, y) for x, y in pairs], num_tokens)
+    bench('predict_lemmata()', lambda: cdict.predict_lemmata(pairs),
+          num_tokens)
+    bench('predict_feat() for all feats of tag', predict_feats, num_tokens)
+    bench('predict_feats()', lambda: cdict.predict_feats(triples),
+          num_tokens)
+    bench('predict_sentence()', predict_sentences, num_tokens)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        corpus = list(Conllu.load(sys.argv[1], log_file=None))
+    else:
+        corpus = make_corpus()
+    num_train = len(corpus) * 9 // 10
+    cdict = CorpusDict(log_file=None)
+    cdict.parse(corpus[:num_train], format='conllu_parsed', log_file=None)
+    bench_fit(cdict)
+    for cache_size in [None, PREDICT_CACHE_SIZE]:
+        cdict.set_predict_cache(cache_size)
+        print('Cache of predictions: {}'
+                  .format(cache_size or 'disabled'))
+        bench_predict(cdict, corpus[num_train:])
+        if cache_size:
+            print(cdict.predict_cache_info())
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Corpuscula project: Utils benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Benchmarks for ``corpuscula.utils``. Usage:
+
+    bench_utils.py [<corpus.conllu>]
+
+If the corpus is not specified, (word form, lemma) pairs are taken from a
+synthetic corpus.
+"""
+from difflib import SequenceMatcher
+import os
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+###
+import sys
+sys.path.append(os.path.join(SCRIPT_DIR, '..'))
+###
+from corpuscula import Conllu
+from corpuscula.utils import find_affixes, find_longest_match
+from bench_corpus_dict import make_corpus
+
+
+def find_affixes_difflib(form, lemma, lower=False):
+    """Reference implementation of ``find_affixes()`` based on
+    ``difflib.SequenceMatcher``"""
+    if lower:
+        lex = form = form.lower()
+        lem = lemma = lemma.lower()
+    else:
+        lex = form.lower()
+        lem = lemma.lower()
+    a, b, size = SequenceMatcher(None, lex.replace('ё', 'е'),
+                                 lem.replace('ё', 'е'), False) \
+                     .find_longest_match(0, len(lex), 0, len(lem))
+    return form[:a], form[a:a + size], form[a + size:], \
+           lemma[:b], lemma[b:b + size], lemma[b + size:]
+
+def bench(name, func, num_calls):
+    time0 = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - time0
+    print('{:<40} {:8.3f} s {:12.0f} calls/s'
+              .format(name, elapsed, num_calls / elapsed))
+
+
+if __name__ == '__main__':
+    corpus = Conllu.load(sys.argv[1], log_file=None) \
+                 if len(sys.argv) > 1 else \
+             make_corpus()
+    pairs = [(x['FORM'], x['LEMMA']) for x, _ in corpus for x in x
+                 if x['FORM'] and x['LEMMA']]
+    num_pairs = len(pairs)
+    print('find_affixes() for {} pairs ({} unique)'
+              .format(num_pairs, len(set(pairs))))
+    assert all(find_affixes(x, y) == find_affixes_difflib(x, y)
+                   for x, y in pairs)
+    find_longest_match.cache_clear()
+
+    bench('SequenceMatcher',
+          lambda: [find_affixes_difflib(x, y) for x, y in pairs], num_pairs)
+    bench('find_affixes(), cold cache',
+          lambda: [find_affixes(x, y) for x, y in pairs], num_pairs)
+    bench('find_affixes(), warm cache',
+          lambda: [find_affixes(x, y) for x, y in pairs], num_pairs)
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Corpuscula project: Wikipedia utils benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Benchmarks for ``corpuscula.wikipedia_utils``. Usage:
+
+    bench_wikipedia.py [<dump.xml[.bz2]>]
+
+If the dump is not specified, a synthetic one is created by replicating the
+pages of the test dump.
+"""
+import os
+import re
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+###
+import sys
+sys.path.append(os.path.join(SCRIPT_DIR, '..'))
+###
+from corpuscula.wikipedia_utils import Wikipedia
+
+TEST_WIKI_FPATH = os.path.join(SCRIPT_DIR, '..', 'tests', 'test_wiki.xml')
+NUM_COPIES = 1000
+
+
+def make_dump(fpath, num_copies=NUM_COPIES):
+    """Create a synthetic dump of *num_copies* copies of the test dump
+    pages"""
+    with open(TEST_WIKI_FPATH, encoding='utf-8') as f:
+        dump = f.read()
+    head = dump[:dump.index('  <page>')]
+    tail = dump[dump.rindex('</page>\n') + 8:]
+    pages = re.findall(r'  <page>.*?</page>\n', dump, re.S)
+    page_id = 0
+    with open(fpath, 'wt', encoding='utf-8') as f:
+        f.write(head)
+        for _ in range(num_copies):
+            for page in pages:
+                page_id += 1
+                f.write(re.sub(r'(<page>\s*<title>.*?</title>\s*<ns>\d+</ns>'
+                               r'\s*<id>)\d+', r'\g<1>{}'.format(page_id),
+                               page, count=1, flags=re.S))
+        f.write(tail)
+
+def bench(name, func):
+    time0 = time.perf_counter()
+    num_items = sum(1 for _ in func())
+    elapsed = time.perf_counter() - time0
+    print('{:<40} {:8.3f} s {:12.0f} items/s'
+              .format(name, elapsed, num_items / elapsed))
+
+
+if __name__ == '__main__':
+    fpath, tmp_fpath = None, None
+    if len(sys.argv) > 1:
+        fpath = sys.argv[1]
+    else:
+        fd, tmp_fpath = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        make_dump(tmp_fpath)
+        fpath = tmp_fpath
+    try:
+        print('Dump: {} ({} bytes)'.format(fpath, os.path.getsize(fpath)))
+        wiki = Wikipedia(fpath=fpath, silent=True)
+        bench('titles()', wiki.titles)
+        bench('articles()', wiki.articles)
+        bench('templates()', wiki.templates)
+        for workers in [2, 4]:
+            bench('articles(), {} workers'.format(workers),
+                  lambda: wiki.articles(workers=workers))
+    finally:
+        if tmp_fpath:
+            os.remove(tmp_fpath)
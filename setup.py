@@ -51,6 +51,7 @@ setup(
     packages=find_packages(exclude=['data', 'doc', 'examples', 'scripts',
                                     'tests']),
     install_requires=[],
+    extras_require={'numpy': ['numpy']},
     include_package_data=True,
     python_requires='>=3.5',
 )
@@ -3,7 +3,9 @@
 
 from math import isclose
 import filecmp
+import gzip
 import os
+import pickle
 
 ###
 import sys
@@ -19,6 +21,7 @@ import corpuscula.utils
 TEST_DNAME = '_test'
 TEST_FNAME = 'test.bz2'
 TEST_DICT_FNAME = 'test_dict.bz2'
+TEST_WIKI_FNAME = 'test_wiki.xml'
 TEST_DPATH = os.path.join(corpuscula.corpus_utils.get_root_dir(),
                           corpuscula.corpus_utils.CORPUS_DNAME, TEST_DNAME)
 
@@ -77,6 +80,169 @@ corpuscula.Conllu.save(test, WORK_FNAME)
 check_res(res and filecmp.cmp(os.path.join(WORK_DIR, 'test.conllu'),
                               WORK_FNAME))
 
+def f ():
+    fpath = WORK_FNAME + '.gz'
+    corpuscula.Conllu.save(test, fpath, log_file=None)
+    with gzip.open(fpath, 'rt', encoding='utf-8') as f_, \
+         open(os.path.join(WORK_DIR, 'test.conllu'), 'rt',
+              encoding='utf-8') as f:
+        res = f_.read() == f.read()
+    os.remove(fpath)
+    return res
+check_res(safe_run(f, 'Testing corpuscula.Conllu save to .gz'))
+
+def f ():
+    corpus = list(corpuscula.Conllu.load(WORK_FNAME, fast=True,
+                                         log_file=None))
+    # repr of the unaccessed lazy FEATS and MISC must be the same
+    res = repr(corpus[-1][0][0]) == repr(test[-1][0][0]) \
+      and repr(corpus[0]) == repr(test[0]) \
+      and corpus == test
+    return res and list(corpuscula.Conllu.get_as_text(
+        corpuscula.Conllu.load(WORK_FNAME, fast=True, log_file=None),
+        log_file=None
+    )) == list(corpuscula.Conllu.get_as_text(test, log_file=None))
+check_res(safe_run(f, 'Testing corpuscula.Conllu.load(fast=True)'))
+
+def f ():
+    load = corpuscula.Conllu.load
+    load_parallel = corpuscula.Conllu.load_parallel
+    res = list(load_parallel(WORK_FNAME, workers=2, shard_size=100000,
+                             log_file=None)) == test \
+      and sorted(map(repr, load_parallel(WORK_FNAME, workers=2,
+                                         ordered=False, shard_size=100000,
+                                         log_file=None))) \
+              == sorted(map(repr, test))
+    # shards of CoNLL-U Plus file must inherit its columns
+    fpath = WORK_FNAME + '.plus'
+    with open(WORK_FNAME, 'rt', encoding='utf-8') as f_, \
+         open(fpath, 'wt', encoding='utf-8') as f:
+        print('# global.columns = ID FORM UPOS LEMMA XPOS FEATS HEAD DEPREL '
+              'DEPS MISC', file=f)
+        for line in f_:
+            line = line.split('\t')
+            if len(line) == 10:
+                line[2], line[3] = line[3], line[2]
+            f.write('\t'.join(line))
+    gold = list(load(fpath, log_file=None))
+    res = res and len(gold) == len(test) \
+              and gold[-1][0][0]['UPOS'] == test[-1][0][0]['UPOS'] \
+              and list(load_parallel(fpath, workers=2, shard_size=100000,
+                                     log_file=None)) == gold \
+              and sorted(map(repr, load_parallel(fpath, workers=2,
+                                                 ordered=False,
+                                                 shard_size=100000,
+                                                 log_file=None))) \
+                      == sorted(map(repr, gold))
+    os.remove(fpath)
+    return res
+check_res(safe_run(f, 'Testing corpuscula.Conllu.load_parallel'))
+
+def f ():
+    index = corpuscula.Conllu.build_index(WORK_FNAME, log_file=None)
+    sent_ids = [test[-1][1]['sent_id'], test[7][1]['sent_id']]
+    # sent_ids of the test corpus are not unique
+    gold = [x for id_ in sent_ids for x in test if x[1].get('sent_id') == id_]
+    res = len(index) == len(test) and len(gold) > len(sent_ids) \
+      and list(corpuscula.Conllu.load_slice(WORK_FNAME, 100, 110,
+                                            fix=True)) == test[100:110] \
+      and list(corpuscula.Conllu.load_by_ids(WORK_FNAME, sent_ids)) == gold
+    os.remove(index.index_path)
+    return res
+check_res(safe_run(f, 'Testing corpuscula.Conllu index'))
+
+def f ():
+    corpus1 = list(corpuscula.Conllu.get_as_text(test[:50], log_file=None))
+    corpus2 = list(corpuscula.Conllu.get_as_text(test[:10] + test[11:50],
+                                                 log_file=None))
+    conflicts = []
+    res = list(corpuscula.Conllu.merge_aligned(corpus1, corpus2,
+                                               conflicts=conflicts,
+                                               log_file=None)) == test[:50]
+    return res and [(x['type'], x['sent_no1']) for x in conflicts] \
+                == [('missing_sentence', 10)]
+check_res(safe_run(f, 'Testing corpuscula.Conllu.merge_aligned'))
+
+def f ():
+    from copy import deepcopy
+    from corpuscula import ConlluCorpus
+    corpus = ConlluCorpus(test)
+    res = len(corpus) == len(test) \
+      and corpus.get_num_tokens() == sum(len(x[0]) for x in test) \
+      and [([dict(x) for x in x[0]], x[1]) for x in corpus] == test \
+      and list(corpuscula.Conllu.get_as_text(corpus, log_file=None)) \
+              == list(corpuscula.Conllu.get_as_text(test, log_file=None)) \
+      and list(corpuscula.Conllu.fix(ConlluCorpus(test[:500]))) \
+              == list(corpuscula.Conllu.fix(deepcopy(test[:500])))
+    cdict, cdict_ = corpuscula.CorpusDict(), corpuscula.CorpusDict()
+    cdict.parse(test, format='conllu_parsed', log_file=None)
+    cdict_.parse(corpus, format='conllu_parsed', log_file=None)
+    res = res and repr(cdict_.backup()) == repr(cdict.backup())
+    # in-place edits of FEATS and MISC are stored to the corpus
+    token = corpus[0][0][0]
+    feats, misc = token['FEATS'], token['MISC']
+    feats['Test'] = 'Yes'
+    misc.update(Test='No')
+    res = res and corpus[0][0][0]['FEATS']['Test'] == 'Yes' \
+              and corpus[0][0][0]['MISC']['Test'] == 'No' \
+              and repr(corpus[0][0][0]['FEATS']) == repr(feats) \
+              and repr(feats).startswith('OrderedDict(')
+    del feats['Test']
+    misc.pop('Test')
+    res = res and [dict(x) for x in corpus[0][0]] == test[0][0]
+    corpus = ConlluCorpus(test[:500])
+    test_ = deepcopy(test[:500])
+    for sent, sent_ in zip(corpus, test_):
+        for token, token_ in zip(sent[0], sent_[0]):
+            for feats in [token['FEATS'], token_['FEATS']]:
+                feats['Test'] = feats.get('Case', 'No')
+    return res and [([dict(x) for x in x[0]], x[1]) for x in corpus] == test_
+check_res(safe_run(f, 'Testing corpuscula.ConlluCorpus'))
+
+def f ():
+    corpus = test_corpus.train()  # now it's read from the binary cache
+    corpuscula.Conllu.save(corpus, WORK_FNAME, log_file=None)
+    res = filecmp.cmp(os.path.join(WORK_DIR, 'test.conllu'), WORK_FNAME)
+    with corpuscula.corpus_utils.get_corpus_cache(test_corpus.train()) \
+             as cache:
+        res = res and len(cache) == len(test) and cache[-1] == test[-1]
+    os.remove(corpus.cache_fpath)
+    return res
+check_res(safe_run(f, 'Testing corpuscula.corpus_utils cache'))
+
+def f ():
+    # two writers of the same cache must not interfere
+    res = sum(1 for _ in zip(test_corpus.train(), test_corpus.train())) \
+              == len(test)
+    corpus = test_corpus.train()
+    res = res and len(list(corpus)) == len(test) \
+              and os.listdir(os.path.dirname(corpus.cache_fpath)) \
+                      == [os.path.basename(corpus.cache_fpath)]
+    os.remove(corpus.cache_fpath)
+    return res
+check_res(safe_run(f, 'Testing corpuscula.corpus_utils cache writers'))
+
+def f ():
+    # the cache must be kept in the same storage as the corpus
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    root_dir = mkdtemp()
+    try:
+        dpath = os.path.join(root_dir, corpuscula.corpus_utils.CORPUS_DNAME,
+                             corpuscula.corpus_utils.UD_DNAME, 'UD_Test')
+        os.makedirs(dpath)
+        corpuscula.utils.copy_file('test.conllu',
+                                   os.path.join(dpath, 'xx-ud-train.conllu'))
+        ud = corpuscula.corpus_utils.UniversalDependencies('UD_Test',
+                                                           root_dir=root_dir)
+        corpus = ud.train()
+        return corpus.cache_fpath.startswith(root_dir + os.sep) \
+           and len(list(corpus)) == len(test) \
+           and len(list(ud.train())) == len(test)
+    finally:
+        rmtree(root_dir)
+check_res(safe_run(f, 'Testing corpuscula.UniversalDependencies with root_dir'))
+
 def f ():
     sent = ['Съешь', 'же', 'ещё', 'этих', 'мягких',
             'французских булок', ',', 'да', 'выпей', 'чаю', '.']
@@ -99,6 +265,18 @@ def f ():
 check_res(safe_run(f, 'Testing corpuscula.Conllu: '
                       'from_sentence/from_sentences/fix'))
 
+def f ():
+    sent = [{'ID': str(i), 'FORM': x, 'LEMMA': None, 'HEAD': y, 'DEPS': z}
+                for i, (x, y, z) in enumerate([
+                    (',', '3', '3:punct'), ('мы', '3', '3:nsubj|4:nsubj'),
+                    ('идём', '0', '0:root'), ('домой', '3', '3:advmod')
+                ], start=1)]
+    test = list(corpuscula.Conllu.fix([sent], adjust_for_speech=True))
+    return [(x['ID'], x['HEAD'], x['DEPS']) for x in test[0][0]] \
+        == [('1', '2', '2:nsubj|3:nsubj'), ('2', '0', '0:root'),
+            ('3', '2', '2:advmod')]
+check_res(safe_run(f, 'Testing corpuscula.Conllu: fix of HEAD and DEPS'))
+
 WORK_FNAME = 'test$'
 def f ():
     cdict = corpuscula.CorpusDict()
@@ -124,7 +302,378 @@ def f ():
     return res and g()
 check_res(safe_run(f, 'Testing corpuscula.CorpusDict'))
 
+def f ():
+    cdict = corpuscula.CorpusDict()
+    cdict.parse(os.path.join(WORK_DIR, 'test.conllu'), log_file=None)
+    cdict_ = corpuscula.CorpusDict()
+    cdict_.parse(os.path.join(WORK_DIR, 'test.conllu'), workers=2,
+                 log_file=None)
+    res = repr(cdict_.backup()) == repr(cdict.backup())
+    cdict = corpuscula.CorpusDict()
+    cdict.parse(test_corpus, format='conllu_parsed', log_file=None)
+    cdict_ = corpuscula.CorpusDict()
+    cdict_.parse(test_corpus, format='conllu_parsed', workers=2,
+                 log_file=None)
+    return res and repr(cdict_.backup()) == repr(cdict.backup())
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict parallel parse'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    wforms = cdict._wforms[::100]
+    res = [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+            cdict.predict_feat('CAse', x, x, 'NOUN')) for x in wforms]
+    cdict.compact()
+    cdict.backup_to(WORK_FNAME)
+    cdict = corpuscula.CorpusDict(restore_from=WORK_FNAME, log_file=None)
+    return cdict.iscompact() \
+       and res == [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+                    cdict.predict_feat('CAse', x, x, 'NOUN'))
+                       for x in wforms]
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict.compact'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    wforms = cdict._wforms[::100] + ['Искусства', 'неизвестнейшего']
+    res = [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+            cdict.predict_feat('CAse', x, x, 'NOUN')) for x in wforms]
+    backup = repr(cdict.backup())
+    cdict.save_model(WORK_FNAME + '.model')
+    cdict = corpuscula.CorpusDict(restore_from=WORK_FNAME + '.model',
+                                  log_file=None)
+    return res == [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+                    cdict.predict_feat('CAse', x, x, 'NOUN'))
+                       for x in wforms] \
+       and repr(pickle.loads(pickle.dumps(cdict.backup(), 2))) == backup
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict.save_model'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    wforms = cdict._wforms[::100]
+    res = [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+            cdict.predict_feat('CAse', x, x, 'NOUN')) for x in wforms]
+    tags_freq = cdict.get_tags_freq()
+    cdict.backup_to(WORK_FNAME, fitted=True)
+    cdict = corpuscula.CorpusDict()
+    cdict.restore_from(WORK_FNAME, refit=False, log_file=None)
+    if not (cdict._fit_thresholds == (20, 1.)
+        and cdict.get_tags_freq() == tags_freq
+        and res == [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+                     cdict.predict_feat('CAse', x, x, 'NOUN'))
+                        for x in wforms]):
+        return False
+    with open(WORK_FNAME, 'rb') as f:
+        o = pickle.load(f)
+    o['_tags_freq'] = []
+    cdict.restore(o, refit=False, log_file=None)
+    if cdict.get_tags_freq() != []:
+        return False
+    with open(WORK_FNAME, 'rb') as f:
+        o = pickle.load(f)
+    o['_tags_freq'] = []
+    o['_lemmata_id']['_test_lemma_'] = len(o['_lemmata_id'])
+    cdict.restore(o, refit=False, log_file=None)
+    return bool(cdict.get_tags_freq())
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict: restore without refit'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    sentence = list(test_corpus.train())[5][0]
+    wforms = [x['FORM'] for x in sentence] * 2
+    triples = [(x['FORM'], x['LEMMA'], x['UPOS']) for x in sentence]
+    sentence_ = [{'ID': x['ID'], 'FORM': x['FORM'], 'UPOS': None,
+                  'LEMMA': None, 'FEATS': {}} for x in sentence]
+    cdict.predict_sentence(sentence_)
+    tags = [x['UPOS'] for x in sentence_]
+    return cdict.predict_tags(iter(wforms),
+                              isfirst=[True] + [False] * (len(wforms) - 1)) \
+               == [cdict.predict_tag(x, isfirst=i == 0)
+                       for i, x in enumerate(wforms)] \
+       and cdict.predict_tags(wforms, isfirst=1) \
+               == [cdict.predict_tag(x, isfirst=True) for x in wforms] \
+       and cdict.predict_lemmata(zip(wforms, tags * 2)) == \
+               [cdict.predict_lemma(x, y) for x, y in zip(wforms, tags * 2)] \
+       and cdict.predict_feats(triples) == \
+               [{cdict._feats[x]: cdict.predict_feat(cdict._feats[x], *y)
+                     for x in cdict._tag_feats[cdict._tags_id[y[2]]]}
+                    for y in triples] \
+       and tags == [cdict.predict_tag(x, isfirst=i == 0)[0]
+                        for i, x in enumerate(wforms[:len(sentence)])]
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict batch predictions'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+
+    def get_top(cnts):
+        cnts = sorted(cnts.items(), key=lambda x: (x[1], x[0]), reverse=True)
+        return cnts[0] + (cnts[1][1] if len(cnts) > 1 else 0,)
+
+    res = True
+    for wform_id, tag_cnts in cdict._wform_tag_cnts.items():
+        res = res and cdict._wform_tag_lemmata_top[wform_id] == \
+                          {x: get_top(y) for x, y in tag_cnts.items()} \
+                  and cdict._wform_tags_top[wform_id] == \
+                          get_top({x: sum(y.values())
+                                       for x, y in tag_cnts.items()})
+        wform = cdict._wforms[wform_id]
+        wform_id2 = cdict._wforms_id.get(wform.lower())
+        if wform.istitle() and wform_id2 is not None:
+            tag_cnts = {x: sum(y.values()) for x, y in tag_cnts.items()}
+            for x, y in cdict._wform_tag_cnts[wform_id2].items():
+                tag_cnts[x] = tag_cnts.get(x, 0) + sum(y.values())
+            res = res and cdict._wform_title_tags_top[wform_id] == \
+                              get_top(tag_cnts)
+    wforms = cdict._wforms[::50]
+    wforms += [x.title() for x in wforms]
+    preds = [(cdict.predict_tag(x), cdict.predict_tag(x, isfirst=True),
+              cdict.predict_lemma(x, 'NOUN')) for x in wforms]
+    cdict._fit_thresholds = None  # predict by the counts directly
+    return res and preds == [(cdict.predict_tag(x),
+                              cdict.predict_tag(x, isfirst=True),
+                              cdict.predict_lemma(x, 'NOUN'))
+                                 for x in wforms]
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict: top tags and lemmata'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    res = True
+    for trie in cdict._common_endings.values():
+        eds = trie.unpack()
+        trie_ = pickle.loads(pickle.dumps(trie, 2))
+        for wform in cdict._wforms[::20]:
+            eds_ = [(i, eds[wform[i:]]) for i in range(len(wform))
+                                            if wform[i:] in eds]
+            res = res and list(trie.find_all(wform)) == eds_ \
+                      and list(trie_.find_all(wform)) == eds_ \
+                      and trie.get(wform) == eds.get(wform)
+    return res
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict: common endings trie'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    corpus = list(test_corpus.train())
+    cdict_ = corpuscula.CorpusDict(corpus=corpus[:-10],
+                                   format='conllu_parsed', log_file=None)
+    cdict_.parse(corpus[-10:], format='conllu_parsed', append=True,
+                 log_file=None)
+    res = cdict_._fit_delta is not None
+    cdict_.fit(log_file=None)
+    for attr in cdict._FITTED_ATTRS:
+        val, val_ = getattr(cdict, attr), getattr(cdict_, attr)
+        if attr == '_common_endings':
+            val = {x: y.unpack() for x, y in val.items()}
+            val_ = {x: y.unpack() for x, y in val_.items()}
+        res = res and val == val_
+    return res
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict: incremental fit'))
+
+def f ():
+    from corpuscula.corpus_dict import fit_counts_numpy
+    if fit_counts_numpy is None:  # numpy is not installed
+        return True
+    cdict = corpuscula.CorpusDict(log_file=None)
+    cdict.parse(test_corpus, format='conllu_parsed', log_file=None)
+    res = True
+    for cnt_thresh, ambiguity_thresh in [(20, 1.), (2, .5), (1, 0.)]:
+        cdict.fit(cnt_thresh, ambiguity_thresh, use_numpy=False,
+                  log_file=None)
+        o = pickle.dumps(cdict.backup(fitted=True), 2)
+        cdict.fit(cnt_thresh, ambiguity_thresh, use_numpy=True, log_file=None)
+        res = res and pickle.dumps(cdict.backup(fitted=True), 2) == o
+    return res
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict.fit with numpy'))
+
+def f ():
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  predict_cache_size=100, log_file=None)
+    cdict_ = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                   predict_cache_size=0, log_file=None)
+    wforms = cdict._wforms[::10]
+    wforms += [x.title() for x in wforms] + ['абвгд']
+    feat = 'CAse'
+    def preds (cdict):
+        return [(cdict.predict_tag(x), cdict.predict_tag(x, isfirst=True),
+                 cdict.predict_lemma(x, 'NOUN'),
+                 cdict.predict_feat(feat, x, x, 'NOUN')) for x in wforms]
+    res = preds(cdict) == preds(cdict_) == preds(cdict) \
+      and cdict_.predict_cache_info() is None
+    cdict.predict_tag(wforms[0])
+    res = res and cdict.predict_tag(wforms[0]) == preds(cdict_)[0][0]
+    info = cdict.predict_cache_info()
+    res = res and info['hits'] > 0 and info['misses'] > 0 \
+              and info['evictions'] > 0 \
+              and info['size'] == info['maxsize'] == 100
+    cdict.fit(cnt_thresh=5, log_file=None)
+    cdict_.fit(cnt_thresh=5, log_file=None)
+    res = res and cdict.predict_cache_info()['size'] == 0 \
+              and preds(cdict) == preds(cdict_)
+    cdict.set_predict_cache(None)
+    return res and cdict.predict_cache_info() is None
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict: predictions cache'))
+
+def f ():
+    if sys.version_info < (3, 8):  # no shared memory
+        return True
+    cdict = corpuscula.CorpusDict(corpus=test_corpus, format='conllu_parsed',
+                                  log_file=None)
+    wforms = cdict._wforms[::100] + ['Искусства', 'неизвестнейшего']
+    res = [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+            cdict.predict_feat('CAse', x, x, 'NOUN')) for x in wforms]
+    backup = repr(cdict.backup())
+    shm = cdict.share_model()
+    try:
+        cdict = corpuscula.CorpusDict(log_file=None)
+        cdict.attach_model(shm.name)
+        res = res == [(cdict.predict_tag(x), cdict.predict_lemma(x, 'NOUN'),
+                       cdict.predict_feat('CAse', x, x, 'NOUN'))
+                          for x in wforms] \
+          and repr(pickle.loads(pickle.dumps(cdict.backup(), 2))) == backup
+        del cdict
+    finally:
+        shm.close()
+        shm.unlink()
+    return res
+check_res(safe_run(f, 'Testing corpuscula.CorpusDict.share_model'))
+
+def f ():
+    from difflib import SequenceMatcher
+    pairs = [(x['FORM'].lower(), x['LEMMA'].lower())
+                 for x in test[:100] for x in x[0]
+                     if x['FORM'] and x['LEMMA']] \
+          + [('', ''), ('abc', ''), ('abcab', 'cabab'), ('ab' * 50, 'ba' * 50),
+             ('xabyab', 'abzab')]
+    return all(corpuscula.utils.find_longest_match(x, y) == tuple(
+                   SequenceMatcher(None, x, y, False)
+                       .find_longest_match(0, len(x), 0, len(y))
+               ) for x, y in pairs) \
+       and corpuscula.utils.find_affixes('Ёжиками', 'ежик') == \
+               ('', 'Ёжик', 'ами', '', 'ежик', '')
+check_res(safe_run(f, 'Testing corpuscula.utils.find_longest_match'))
+
+def f ():
+    import bz2
+    with bz2.open(TEST_FNAME, 'rt', encoding='utf-8') as f:
+        lines = list(f)
+    with open(WORK_FNAME + '.bz2', 'wb') as f:
+        for i in range(0, len(lines), 100):
+            f.write(bz2.compress(''.join(lines[i:i + 100])
+                                   .replace('\n', '\r\n').encode('utf-8')))
+    res = all(list(corpuscula.utils.read_bz2(TEST_FNAME, workers=x)) == lines
+                  and list(corpuscula.utils.read_bz2(WORK_FNAME + '.bz2',
+                                                     workers=x)) == lines
+                  for x in [0, 1, 2])
+    os.remove(WORK_FNAME + '.bz2')
+    return res
+check_res(safe_run(f, 'Testing corpuscula.utils.read_bz2'))
+
+def f ():
+    from corpuscula.wikipedia_utils import Wikipedia
+    wiki = Wikipedia(fpath=TEST_WIKI_FNAME, silent=True)
+    res = True
+    for method in [wiki.titles, wiki.articles, wiki.templates]:
+        items = list(method())
+        res = res and items and list(method(workers=2)) == items \
+                  and sorted(method(workers=2, ordered=False)) == sorted(items)
+    return res and [x[:2] for x in wiki.templates()] == [('8', 'Государство'),
+                                                          ('14', 'Num'),
+                                                          ('17', 'Пустой')]
+check_res(safe_run(f, 'Testing corpuscula.wikipedia_utils: workers'))
+
+def f ():
+    import json
+    from corpuscula.wikipedia_utils import Wikipedia, _get_all
+    with open('test_wiki_golden.json', encoding='utf-8') as f:
+        gold = [tuple(x) for x in json.load(f)]
+    wiki = Wikipedia(fpath=TEST_WIKI_FNAME, silent=True)
+    return list(_get_all(TEST_WIKI_FNAME, silent=True)) == gold \
+       and list(wiki.articles()) == [x[:3] for x in gold if x[2] is not None]
+check_res(safe_run(f, 'Testing corpuscula.wikipedia_utils: golden texts'))
+
+def f ():
+    import bz2, re
+    from corpuscula.wikipedia_utils import Wikipedia
+    with open(TEST_WIKI_FNAME, encoding='utf-8') as f:
+        dump = f.read()
+    pages = re.findall(r'  <page>.*?</page>\n', dump, re.S)
+    streams = [dump[:dump.index('  <page>')]] \
+            + [''.join(pages[i:i + 2]) for i in range(0, len(pages), 2)] \
+            + [dump[dump.rindex('</page>\n') + 8:]]
+    index = []
+    with open(WORK_FNAME + '.xml.bz2', 'wb') as f:
+        for stream in streams:
+            for page in re.findall(r'<title>(.*?)</title>\s*<ns>\d+</ns>\s*'
+                                   r'<id>(\d+)</id>', stream):
+                index.append('{}:{}:{}\n'.format(f.tell(), page[1], page[0]))
+            f.write(bz2.compress(stream.encode('utf-8')))
+    with bz2.open(WORK_FNAME + '-index.txt.bz2', 'wt') as f:
+        f.writelines(index)
+    wiki = Wikipedia(fpath=TEST_WIKI_FNAME, silent=True)
+    wiki_ = Wikipedia(fpath=WORK_FNAME + '.xml.bz2', multistream=True,
+                      silent=True)
+    res = True
+    for method, method_ in [(wiki.titles, wiki_.titles),
+                            (wiki.articles, wiki_.articles),
+                            (wiki.templates, wiki_.templates)]:
+        items = list(method())
+        res = res and list(method_()) == list(method_(workers=2)) == items
+    for article in wiki.articles():
+        res = res and wiki_.get_article(article[0]) == article \
+                  and wiki_.get_article(int(article[0])) == article \
+                  and wiki_.get_article(title=article[1]) == article
+    return res and wiki_.get_article(8) is None \
+               and wiki_.get_article(title='Нет такой статьи') is None
+check_res(safe_run(f, 'Testing corpuscula.wikipedia_utils: multistream'))
+
+def f ():
+    import shutil
+    from corpuscula import wikipedia_utils
+    from corpuscula.wikipedia_utils import Wikipedia, load_articles
+    wiki = Wikipedia(fpath=TEST_WIKI_FNAME, silent=True)
+    articles = list(wiki.articles())
+    chunk_size, save_checkpoint = \
+        wikipedia_utils.CHUNK_SIZE, wikipedia_utils._save_checkpoint
+    def fail_checkpoint (dpath, checkpoint):
+        save_checkpoint(dpath, checkpoint)
+        if checkpoint['pages'] >= 4:
+            raise RuntimeError('Interrupted')
+    wikipedia_utils.CHUNK_SIZE = 2
+    wikipedia_utils._save_checkpoint = fail_checkpoint
+    try:
+        wiki.extract_articles(WORK_FNAME + '.wiki', shard_size=2,
+                              checkpoint_step=1)
+    except RuntimeError:
+        pass
+    finally:
+        wikipedia_utils.CHUNK_SIZE = chunk_size
+        wikipedia_utils._save_checkpoint = save_checkpoint
+    res = list(load_articles(WORK_FNAME + '.wiki')) == articles[:2] \
+      and wiki.extract_articles(WORK_FNAME + '.wiki', shard_size=2,
+                                checkpoint_step=1) == len(articles) \
+      and list(load_articles(WORK_FNAME + '.wiki')) == articles
+    with open(TEST_WIKI_FNAME, encoding='utf-8') as f:
+        dump = f.read()
+    with open(WORK_FNAME + '.xml', 'wt', encoding='utf-8') as f:
+        f.write(dump.replace('<id>100501</id>', '<id>100502</id>'))
+    wiki = Wikipedia(fpath=WORK_FNAME + '.xml', silent=True)
+    res = res and wiki.extract_articles(WORK_FNAME + '.wiki2',
+                                        prev_dpath=WORK_FNAME + '.wiki') == 1 \
+              and list(load_articles(WORK_FNAME + '.wiki2')) == articles[:1]
+    shutil.rmtree(WORK_FNAME + '.wiki')
+    shutil.rmtree(WORK_FNAME + '.wiki2')
+    os.remove(WORK_FNAME + '.xml')
+    return res
+check_res(safe_run(f, 'Testing corpuscula.wikipedia_utils: extract_articles'))
+
 os.remove(WORK_FNAME)
+os.remove(WORK_FNAME + '.model')
+os.remove(WORK_FNAME + '.xml.bz2')
+os.remove(WORK_FNAME + '-index.txt.bz2')
 
 safe_run(lambda: corpuscula.corpus_utils.remove_corpus(TEST_DNAME),
          'Remove test corpus')